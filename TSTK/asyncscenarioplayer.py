@@ -0,0 +1,277 @@
+# vi: spell spl=en
+
+"""Scenario player that runs on an asyncio event loop.
+"""
+#-----------------------------------------------------------
+import asyncio
+import inspect
+import time
+
+import zmq
+import zmq.asyncio
+
+from scenarioplayer    import ScenarioPlayer, NANOSECONDS, POLLIN, poll_key
+#-----------------------------------------------------------
+
+
+class AsyncScenarioPlayer(ScenarioPlayer):
+    """Stores and executes test scenario's on an asyncio event loop.
+
+    This player has the same interface as :class:`ScenarioPlayer`.
+    The steps are started with the ``call_at`` timers of the event
+    loop and the registered sockets are watched with a
+    :class:`zmq.asyncio.Poller`.  Both steps and socket call backs can
+    be plain functions or ``async def`` coroutine functions.  A
+    coroutine runs as a task, so several of them can wait for I/O at
+    the same time.  A socket is not polled while its coroutine call
+    back runs.
+
+    The scenario ends when there are no more steps and all tasks
+    started by steps and call backs are done, or when it is stopped.
+    An exception in a step or call back stops the scenario and is
+    raised again by :meth:`play`.
+    """
+    def __init__(self, test_system, scheduler="heap"):
+        ScenarioPlayer.__init__(self, test_system, scheduler)
+
+        #: zmq poller to poll all registered sockets
+        self.poller = zmq.asyncio.Poller()
+
+        #: the event loop the scenario is played on
+        self.loop = None
+
+        # loop.time() at the start of the scenario
+        self._loop_start = None
+        # timer for the first step and its deadline
+        self._timer = None
+        self._timer_deadline = None
+        # tasks started by steps and call backs
+        self._tasks = set()
+        # set when the scenario is finished
+        self._done = None
+        # the pending poll of the sockets
+        self._poll_future = None
+        # exception that stopped the scenario
+        self._error = None
+        # sockets whose coroutine call back is running, these are
+        # not polled meanwhile
+        self._busy_sockets = {}
+
+
+    def play(self):
+        """
+        Play the current scenario on a new event loop.
+
+        See :meth:`play_async` to play it on a running event loop.
+        """
+        asyncio.run(self.play_async())
+
+
+    async def play_async(self):
+        """
+        Play the current scenario on the running event loop.
+        """
+        self.runit = 1
+        self._error = None
+        self.loop = asyncio.get_running_loop()
+        self._done = asyncio.Event()
+        self._start_time = time.monotonic_ns()
+        self._loop_start = self.loop.time()
+        self.logger.info("starting scenario")
+        poll_task = self.loop.create_task(self._poll_sockets())
+        self._arm_timer()
+        self._check_done()
+        try:
+            await self._done.wait()
+        finally:
+            self.runit = 0
+            poll_task.cancel()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(poll_task, *self._tasks,
+                                 return_exceptions=True)
+            self._tasks.clear()
+            self.loop = None
+        if self._error is not None:
+            raise self._error
+
+
+    def stop(self):
+        """Stop the current scenario.
+
+        Once stopped a scenario cannot be resumed.  Tasks of steps and
+        call backs that are still running are cancelled.
+        """
+        self.runit = 0
+        if self.loop is not None:
+            # Might be called from a signal handler.
+            self.loop.call_soon_threadsafe(self._done.set)
+
+
+    def add_socket(self, a_socket, call_back_function):
+        """See :meth:`ScenarioPlayer.add_socket`.
+
+        The call back function can also be a coroutine function.
+        """
+        ScenarioPlayer.add_socket(self, a_socket, call_back_function)
+        self._repoll()
+
+
+    def remove_socket(self, a_socket):
+        """See :meth:`ScenarioPlayer.remove_socket`."""
+        key = poll_key(a_socket)
+        if key in self._busy_sockets:
+            # Not registered with the poller right now.
+            self.logger.info("removing socket " + str(a_socket))
+            self._generation += 1
+            del self.call_backs[key]
+            del self._busy_sockets[key]
+        else:
+            ScenarioPlayer.remove_socket(self, a_socket)
+        self._repoll()
+
+
+    def _push(self, when, priority, item):
+        """Add an item to the scheduler and move the timer forward if
+        it is the new first step.
+        """
+        ScenarioPlayer._push(self, when, priority, item)
+        if self.loop is not None and self.runit:
+            self._arm_timer()
+
+
+    def _arm_timer(self):
+        """Make sure the timer fires at the deadline of the first step.
+        """
+        entry = self.scheduler.peek()
+        if entry is None:
+            return
+        deadline = entry[0]
+        if self._timer is not None:
+            if self._timer_deadline <= deadline:
+                return
+            self._timer.cancel()
+        self._timer_deadline = deadline
+        self._timer = self.loop.call_at(
+                self._loop_start + deadline / NANOSECONDS,
+                self._run_due_steps)
+
+
+    def _run_due_steps(self):
+        """Execute all steps whose deadline has passed."""
+        self._timer = None
+        try:
+            while self.runit:
+                entry = self.scheduler.peek()
+                if entry is None:
+                    break
+                lateness = (time.monotonic_ns() - self._start_time
+                            - entry[0])
+                if lateness < 0:
+                    # The timer fired a little early.
+                    break
+                self.lateness.record(lateness)
+                (deadline, priority, (step, arguments, series)) = (
+                        self.scheduler.pop())
+                if series is not None:
+                    # Keep a single entry per series in the scheduler.
+                    self._add_next(series, priority)
+                self._track(self.execute_step(step, arguments))
+        except Exception as err:
+            self._fail(err)
+            return
+        if self.runit:
+            self._arm_timer()
+            self._check_done()
+
+
+    async def _poll_sockets(self):
+        """Wait for events on the registered sockets and call the
+        call backs.
+        """
+        while True:
+            self._poll_future = self.poller.poll()
+            # Not awaited directly, so _repoll() can cancel the poll
+            # without cancelling this task.
+            await asyncio.wait([self._poll_future])
+            if self._poll_future.cancelled():
+                continue
+            generation = self._generation
+            try:
+                for socket_key, event in self._poll_future.result():
+                    callb = self.call_backs.get(socket_key)
+                    if callb is None or callb[2] > generation or (
+                            not event & POLLIN):
+                        # Changed by an earlier call back.
+                        continue
+                    result = callb[1](callb[0], self)
+                    if inspect.isawaitable(result):
+                        self._call_back_task(socket_key, callb[0], result)
+            except Exception as err:
+                self._fail(err)
+                return
+            # The call backs might have added steps.
+            self._check_done()
+
+
+    def _call_back_task(self, socket_key, a_socket, result):
+        """Run a coroutine call back as a task.
+
+        The socket is not polled until the task is done, otherwise the
+        call back would be started again for the same data.
+        """
+        self.poller.unregister(a_socket)
+        task = asyncio.ensure_future(result)
+        self._busy_sockets[socket_key] = task
+        self._tasks.add(task)
+        def done(task):
+            if self._busy_sockets.get(socket_key) is task:
+                del self._busy_sockets[socket_key]
+                self.poller.register(a_socket, zmq.POLLIN)
+                self._repoll()
+            self._task_done(task)
+        task.add_done_callback(done)
+
+
+    def _repoll(self):
+        """Restart a pending poll, so it includes changed sockets."""
+        if self._poll_future is not None and not self._poll_future.done():
+            self._poll_future.cancel()
+
+
+    def _track(self, result):
+        """Run the result of a step or call back as a task if it is a
+        coroutine.
+        """
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self._tasks.add(task)
+            task.add_done_callback(self._task_done)
+
+
+    def _task_done(self, task):
+        """Clean up after a task of a step or call back."""
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self._fail(task.exception())
+        else:
+            self._check_done()
+
+
+    def _check_done(self):
+        """Finish the scenario when nothing is left to do."""
+        if self.scheduler.empty() and not self._tasks:
+            self._done.set()
+
+
+    def _fail(self, err):
+        """Stop the scenario because of an exception."""
+        self.logger.error("scenario stopped by %r", err)
+        if self._error is None:
+            self._error = err
+        self.stop()
@@ -0,0 +1,94 @@
+"""Benchmark of the callback dispatch of SimulatorInterface.
+
+Usage
+    python benchmarks/bench_callbacks.py
+
+Run from the TSTK directory.  It measures the cost per message of
+do_callbacks() with 1, 10 and 100 callbacks for the message id, and the
+cost of the typical "wait for the reply" pattern: set a one-shot
+callback and dispatch the message that removes it again.  For
+comparison it also runs the old dispatch, which copied the callback
+list on every message.
+"""
+import os
+import sys
+import copy
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+from simulatorinterface import SimulatorInterface
+
+MESSAGES = 100000
+
+
+class Message(object):
+    """Message from a simulator."""
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+def old_do_callbacks(callbacks, message):
+    """The dispatch SimulatorInterface.do_callbacks() used to do."""
+    if message.message_id in callbacks:
+        for function in copy.copy(callbacks[message.message_id]):
+            function(message)
+
+
+def per_message(function):
+    """Run the function MESSAGES times.
+
+    :returns: nanoseconds per call.
+    """
+    start = time.perf_counter()
+    for unused in range(MESSAGES):
+        function()
+    return (time.perf_counter() - start) / MESSAGES * 1e9
+
+
+def main():
+    context = zmq.Context()
+    interface = SimulatorInterface("bench", 0, context)
+    message = Message(1)
+    def callback(message):
+        pass
+
+    print("{0:<28} {1:>10} {2:>10}".format("case", "old ns", "new ns"))
+    for count in (1, 10, 100):
+        interface.callbacks.clear()
+        old_callbacks = {1:[callback] * count}
+        for unused in range(count):
+            interface.set_callback(1, callback)
+        old = per_message(lambda: old_do_callbacks(old_callbacks, message))
+        new = per_message(lambda: interface.do_callbacks(message))
+        print("{0:<28} {1:>10.0f} {2:>10.0f}".format(
+            "{0} callbacks".format(count), old, new))
+
+    # Wait for a reply, while 10 other callbacks are set.
+    interface.callbacks.clear()
+    old_callbacks = {1:[callback] * 10}
+    for unused in range(10):
+        interface.set_callback(1, callback)
+    def old_wait():
+        def reply(message):
+            old_callbacks[2].remove(reply)
+        old_callbacks.setdefault(2, []).append(reply)
+        old_do_callbacks(old_callbacks, Message(2))
+    reply_message = Message(2)
+    def new_wait():
+        interface.set_callback(2, callback, once=True)
+        interface.do_callbacks(reply_message)
+    old = per_message(old_wait)
+    new = per_message(new_wait)
+    print("{0:<28} {1:>10.0f} {2:>10.0f}".format(
+        "one-shot reply", old, new))
+
+    interface.message_link.close(linger=0)
+    interface.command_link.close(linger=0)
+    context.term()
+
+
+if __name__ == '__main__':
+    main()
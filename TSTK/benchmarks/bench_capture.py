@@ -0,0 +1,128 @@
+"""Benchmark of traffic capture and replay.
+
+Usage
+    python benchmarks/bench_capture.py
+
+Run from the TSTK directory.  Writes 200000 frames of 64 bytes to a
+memory mapped capture and to a traffic log, in a temporary directory,
+and reports the CPU time of the writing thread per frame and the wall
+time until the file is complete.  Then it replays the capture through
+a dispatcher to an interface at maximum speed, and a capture of 2000
+frames 0.5 ms apart at 1x and 10x, and reports the frames per second
+and how late the last frame was played.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+import capture
+import dispatcher
+import logpipeline
+import simulatorinterface
+
+FRAMES = 200000
+FRAME = bytes(64)
+COMMAND_PORT = 29821
+MESSAGE_PORT = 29822
+
+
+def bench_write(log):
+    start = time.perf_counter()
+    cpu = time.thread_time()
+    for number in range(FRAMES):
+        log.record(logpipeline.RECEIVED, 1, FRAME)
+    cpu = time.thread_time() - cpu
+    log.close()
+    return cpu / FRAMES * 1e6, time.perf_counter() - start
+
+
+def write_paced(path, count, interval):
+    """A capture of frames that arrived every interval seconds."""
+    writer = capture.CaptureWriter(path)
+    deadline = time.monotonic()
+    for number in range(count):
+        deadline += interval
+        while time.monotonic() < deadline:
+            pass
+        writer.record(logpipeline.RECEIVED, 1, FRAME)
+    writer.close()
+
+
+def bench_replay(path, speed):
+    """Replay through a dispatcher to an interface.
+
+    :returns: frames per second and lateness of the last frame in ms.
+    """
+    a_dispatcher = dispatcher.Dispatcher("tcp", 0)
+    a_dispatcher.logger.disabled = True
+    a_dispatcher.command_listen_port = COMMAND_PORT
+    a_dispatcher.message_forward_port = MESSAGE_PORT
+    a_dispatcher.create_player_links()
+    a_dispatcher.repeater_socket.setsockopt(zmq.SNDHWM, 0)
+    context = zmq.Context()
+    interface = simulatorinterface.SimulatorInterface(
+            "tcp", 0, context, COMMAND_PORT, MESSAGE_PORT)
+    link = interface.message_link
+    link.setsockopt(zmq.RCVHWM, 0)
+    received = []
+    interface.set_callback(simulatorinterface.ANY,
+                           lambda message: received.append(None))
+    time.sleep(0.3)
+
+    with capture.CaptureReader(path) as reader:
+        frames = list(reader.frames())
+        count = len(frames)
+        span = (frames[-1][0] - frames[0][0]) / 1e9
+        del frames
+    receiver = threading.Thread(
+            target=lambda: [interface.on_message(link, None)
+                            for number in range(count)])
+    receiver.start()
+    start = time.perf_counter()
+    with capture.CaptureReader(path) as reader:
+        capture.Replay(reader, a_dispatcher.inject, speed).run(
+                a_dispatcher.poll_sockets)
+    elapsed = time.perf_counter() - start
+    receiver.join()
+    lateness = (elapsed - span / speed) * 1000 if speed else 0
+    link.close(linger=0)
+    interface.command_link.close(linger=0)
+    context.term()
+    a_dispatcher.context.destroy(linger=0)
+    return count / elapsed, lateness
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        print("{0:<14} {1:>14} {2:>10}".format(
+            "write", "cpu us/frame", "total s"))
+        for name, log in (
+                ("capture", capture.CaptureWriter(
+                    os.path.join(directory, "capture"))),
+                ("traffic log", logpipeline.TrafficLog(
+                    os.path.join(directory, "traffic")))):
+            cpu, total = bench_write(log)
+            print("{0:<14} {1:>14.2f} {2:>10.2f}".format(name, cpu, total))
+
+        paced = os.path.join(directory, "paced")
+        write_paced(paced, 2000, 0.0005)
+        print()
+        print("{0:<14} {1:>14} {2:>10}".format(
+            "replay", "frames/s", "late ms"))
+        for name, path, speed in (
+                ("maximum", os.path.join(directory, "capture"), 0),
+                ("1x", paced, 1),
+                ("10x", paced, 10)):
+            rate, lateness = bench_replay(path, speed)
+            print("{0:<14} {1:>14.0f} {2:>10.2f}".format(
+                name, rate, lateness))
+
+
+if __name__ == '__main__':
+    main()
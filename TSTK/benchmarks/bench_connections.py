@@ -0,0 +1,132 @@
+"""Benchmark of the number of connections of the TCP dispatcher.
+
+Usage
+    python benchmarks/bench_connections.py [max connections]
+
+Run from the TSTK directory.  The dispatcher runs its poll loop in a
+thread.  For 10, 100, 1000 and 5000 clients (up to the maximum) it
+measures how long it takes until all clients are accepted, how many
+messages per second are forwarded to the player when every client
+sends one message, and how long a broadcast command takes to reach all
+clients.  The number of connections is limited by ``ulimit -n``.
+"""
+import os
+import sys
+import select
+import socket
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+import dispatcher
+from simulatorinterface import SimulatorInterface
+
+COMMAND_PORT = 29201
+MESSAGE_PORT = 29202
+
+
+def wait_for(condition, timeout=60):
+    """Wait until the condition holds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError("timeout")
+        time.sleep(0.001)
+
+
+def read_all(clients, expected):
+    """Read from the clients until each has the expected data."""
+    pending = {client.fileno(): [client, len(expected)]
+               for client in clients}
+    poller = select.poll()
+    for fileno in pending:
+        poller.register(fileno, select.POLLIN)
+    while pending:
+        ready = poller.poll(10000)
+        if not ready:
+            raise RuntimeError("timeout")
+        for fileno, unused in ready:
+            entry = pending[fileno]
+            entry[1] -= len(entry[0].recv(entry[1]))
+            if not entry[1]:
+                poller.unregister(fileno)
+                del pending[fileno]
+
+
+def bench(count):
+    """Connect count clients and measure.
+
+    :returns: accept time, forwarded messages per second, broadcast time.
+    """
+    a_dispatcher = dispatcher.TCPDispatcher("tcp", 0)
+    a_dispatcher.logger.disabled = True
+    a_dispatcher.accept_address = "127.0.0.1"
+    a_dispatcher.listen_port = 0
+    a_dispatcher.backlog = socket.SOMAXCONN
+    a_dispatcher.command_listen_port = COMMAND_PORT
+    a_dispatcher.message_forward_port = MESSAGE_PORT
+    a_dispatcher.create_sockets()
+    address = a_dispatcher.accept_socket.getsockname()
+    def loop():
+        while a_dispatcher.go_on:
+            a_dispatcher.poll_sockets(10)
+    thread = threading.Thread(target=loop)
+    thread.start()
+
+    context = zmq.Context()
+    interface = SimulatorInterface("tcp", 0, context, COMMAND_PORT,
+                                   MESSAGE_PORT)
+    link = interface.message_link
+    clients = []
+    try:
+        start = time.perf_counter()
+        for unused in range(count):
+            clients.append(socket.create_connection(address))
+        wait_for(lambda: len(a_dispatcher.connections) == count)
+        accept_time = time.perf_counter() - start
+        # Let the subscriptions settle.
+        time.sleep(0.3)
+
+        start = time.perf_counter()
+        for client in clients:
+            client.sendall(b"message")
+        for unused in range(count):
+            link.recv_multipart()
+        rate = count / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        interface.send(b"command")
+        read_all(clients, b"command")
+        broadcast_time = time.perf_counter() - start
+    finally:
+        a_dispatcher.go_on = False
+        thread.join()
+        for client in clients:
+            client.close()
+        for system_socket in list(a_dispatcher.connections.values()):
+            system_socket.close()
+        a_dispatcher.accept_socket.close()
+        a_dispatcher.context.destroy(linger=0)
+        link.close(linger=0)
+        interface.command_link.close(linger=0)
+        context.term()
+    return accept_time, rate, broadcast_time
+
+
+def main():
+    maximum = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print("{0:>11} {1:>12} {2:>12} {3:>14}".format(
+        "connections", "accept ms", "fwd msgs/s", "broadcast ms"))
+    for count in (10, 100, 1000, 5000):
+        if count > maximum:
+            break
+        accept_time, rate, broadcast_time = bench(count)
+        print("{0:>11} {1:>12.1f} {2:>12.0f} {3:>14.1f}".format(
+            count, accept_time * 1000, rate, broadcast_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark of starting and stopping simulators.
+
+Usage
+    python benchmarks/bench_daemon.py
+
+Run from the TSTK directory.  Starts a daemon with a TCP dispatcher 10
+times, and stops it with ``Daemon.stop``, as a restart does.  It
+reports the time until the starting process returned, which is when the
+dispatcher reported that it is ready, and the time of each stop, which
+took at least two seconds with the fixed sleeps of the old stop.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import daemonbase
+
+RUNS = 10
+COMMAND_PORT = 29831
+MESSAGE_PORT = 29832
+
+SCRIPT = """
+import sys
+import daemonbase
+import dispatcher
+
+class Daemon(daemonbase.Daemon):
+    ready_timeout = 5.0
+    def run(self):
+        self.dispatcher.run(self.notify_ready)
+
+daemon = Daemon(sys.argv[1])
+daemon.dispatcher = dispatcher.TCPDispatcher("tcp", 0)
+daemon.dispatcher.logger.disabled = True
+daemon.dispatcher.accept_address = "127.0.0.1"
+daemon.dispatcher.listen_port = 0
+daemon.dispatcher.backlog = 16
+daemon.dispatcher.command_listen_port = {0}
+daemon.dispatcher.message_forward_port = {1}
+daemon.start()
+""".format(COMMAND_PORT, MESSAGE_PORT)
+
+
+def main():
+    directory = os.path.join(os.path.dirname(__file__), '..')
+    with tempfile.TemporaryDirectory() as temporary:
+        daemon = daemonbase.Daemon(os.path.join(temporary, "tcp_0.pid"))
+        print("{0:<6} {1:>10} {2:>10}".format("run", "start ms", "stop ms"))
+        for run in range(RUNS):
+            start = time.perf_counter()
+            subprocess.check_call(
+                    [sys.executable, "-c", SCRIPT, daemon.pidfile],
+                    cwd=directory)
+            started = time.perf_counter() - start
+            start = time.perf_counter()
+            daemon.stop()
+            print("{0:<6} {1:>10.1f} {2:>10.1f}".format(
+                run, started * 1000, (time.perf_counter() - start) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark of the socket call back dispatch of the poll loops.
+
+Usage
+    python benchmarks/bench_dispatch.py
+
+Run from the TSTK directory.  With 1, 10 and 100 registered links it
+measures how many messages per second the poll loops of
+ScenarioPlayer and Dispatcher handle, when one of the links is busy.
+For comparison it also runs the old dispatch, which copied the call
+backs and scanned all of them after every poll.
+"""
+import os
+import sys
+import logging
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+from scenarioplayer import ScenarioPlayer
+from dispatcher import Dispatcher
+
+MESSAGES = 20000
+
+
+def old_player_dispatch(player, timeout):
+    """The dispatch ScenarioPlayer.play() used to do."""
+    socks = dict(player.poller.poll(timeout))
+    for socket_key in player.call_backs.copy():
+        if socket_key in socks and (
+                socks[socket_key] == zmq.POLLIN):
+            callb = player.call_backs[socket_key]
+            function = callb[1]
+            function(callb[0], player)
+
+
+def old_dispatcher_dispatch(dispatcher, timeout):
+    """The dispatch Dispatcher.run() used to do."""
+    socks = dict(dispatcher.poller.poll(timeout))
+    for socket_key in dispatcher.call_backs.copy():
+        if socket_key in socks and socks[socket_key] == zmq.POLLIN:
+            if socket_key in dispatcher.call_backs:
+                cbp = dispatcher.call_backs[socket_key]
+                function = cbp[1]
+                function(cbp[0])
+
+
+def bench(links, register, dispatch, context):
+    """Send messages over the first link and time the dispatch.
+
+    :returns: messages per second.
+    """
+    received = [0]
+    def on_message(a_socket, *unused):
+        a_socket.recv()
+        received[0] += 1
+    senders = []
+    receivers = []
+    for link in range(links):
+        receiver = context.socket(zmq.PAIR)
+        receiver.bind("inproc://link{0}".format(link))
+        sender = context.socket(zmq.PAIR)
+        sender.set_hwm(0)
+        sender.connect("inproc://link{0}".format(link))
+        register(receiver, on_message)
+        senders.append(sender)
+        receivers.append(receiver)
+    for unused in range(MESSAGES):
+        senders[0].send(b"x")
+    start = time.perf_counter()
+    while received[0] < MESSAGES:
+        dispatch(100)
+    duration = time.perf_counter() - start
+    for a_socket in senders + receivers:
+        a_socket.close(linger=0)
+    return MESSAGES / duration
+
+
+if __name__ == "__main__":
+    logging.getLogger('ScenarioPlayer').setLevel(logging.WARNING)
+    print("{0:>6} {1:>11} {2:>12} {3:>12}".format(
+        "links", "loop", "old (msg/s)", "new (msg/s)"))
+    for links in (1, 10, 100):
+        player = ScenarioPlayer(None)
+        old = bench(links, player.add_socket,
+                    lambda timeout: old_player_dispatch(player, timeout),
+                    player.context)
+        player = ScenarioPlayer(None)
+        new = bench(links, player.add_socket, player.poll_sockets,
+                    player.context)
+        print("{0:>6} {1:>11} {2:>12.0f} {3:>12.0f}".format(
+            links, "player", old, new))
+
+        dispatcher = Dispatcher("bench", 0)
+        old = bench(links, dispatcher.register,
+                    lambda timeout: old_dispatcher_dispatch(dispatcher,
+                                                            timeout),
+                    dispatcher.context)
+        dispatcher = Dispatcher("bench", 0)
+        new = bench(links, dispatcher.register, dispatcher.poll_sockets,
+                    dispatcher.context)
+        print("{0:>6} {1:>11} {2:>12.0f} {3:>12.0f}".format(
+            links, "dispatcher", old, new))
@@ -0,0 +1,129 @@
+"""Benchmark of the transports of the links with the player.
+
+Usage
+    python benchmarks/bench_endpoints.py
+
+Run from the TSTK directory.  A dispatcher binds its links to TCP ports,
+to ipc:// and to inproc:// endpoints in turn, and announces them in an
+endpoint registry in a temporary directory; an interface resolves the
+name of the simulator and connects.  The interface sends 5000 commands
+that the dispatcher answers one at a time with a message on the message
+link, and then the dispatcher publishes 100000 messages.  It reports the
+round trips and the messages per second.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+import dispatcher
+import endpoints
+import simulatorinterface
+
+ROUND_TRIPS = 5000
+MESSAGES = 100000
+
+
+class EchoDispatcher(dispatcher.Dispatcher):
+    """Publishes every command as a message."""
+
+    def send_to_system(self, connection_id, data):
+        self.forward(connection_id, data)
+
+
+def run_dispatcher(a_dispatcher, stop):
+    while not stop:
+        a_dispatcher.poll_sockets(100)
+
+
+def bench(registry, command_endpoint, message_endpoint, inproc):
+    """Measure the round trips and the messages over the endpoints.
+
+    :returns: round trips per second and messages per second.
+    """
+    context = zmq.Context()
+    a_dispatcher = EchoDispatcher("tcp", 0)
+    a_dispatcher.logger.disabled = True
+    if inproc:
+        a_dispatcher.use_context(context)
+    a_dispatcher.registry = registry
+    a_dispatcher.command_endpoint = command_endpoint
+    a_dispatcher.message_endpoint = message_endpoint
+    a_dispatcher.create_player_links()
+    a_dispatcher.repeater_socket.setsockopt(zmq.SNDHWM, 0)
+
+    command, message = registry.resolve("tcp-0")
+    interface = simulatorinterface.SimulatorInterface(
+            "tcp", 0, context, command, message, topic="tcp-0")
+    link = interface.message_link
+    link.setsockopt(zmq.RCVHWM, 0)
+    received = []
+    interface.set_callback(simulatorinterface.ANY, received.append)
+
+    stop = []
+    thread = threading.Thread(target=run_dispatcher,
+                              args=(a_dispatcher, stop))
+    thread.start()
+    # Wait for the subscriptions of both links.
+    while not received:
+        interface.send(b"x")
+        if link.poll(10):
+            interface.on_message(link, None)
+    while link.poll(100):
+        interface.on_message(link, None)
+
+    start = time.perf_counter()
+    for number in range(ROUND_TRIPS):
+        interface.send(b"x")
+        interface.on_message(link, None)
+    round_trips = ROUND_TRIPS / (time.perf_counter() - start)
+
+    stop.append(True)
+    thread.join()
+    del received[:]
+    start = time.perf_counter()
+    publisher = threading.Thread(
+            target=lambda: [a_dispatcher.forward(1, b"m")
+                            for number in range(MESSAGES)])
+    publisher.start()
+    while len(received) < MESSAGES:
+        interface.on_message(link, None)
+    messages = MESSAGES / (time.perf_counter() - start)
+    publisher.join()
+
+    a_dispatcher.withdraw()
+    link.close(linger=0)
+    interface.command_link.close(linger=0)
+    a_dispatcher.context.destroy(linger=0)
+    if not inproc:
+        context.term()
+    return round_trips, messages
+
+
+def main():
+    directory = tempfile.TemporaryDirectory()
+    registry = endpoints.EndpointRegistry(directory.name)
+    try:
+        print("{0:<8} {1:>14} {2:>12}".format(
+            "link", "round trips/s", "messages/s"))
+        for name, command_endpoint, message_endpoint, inproc in (
+                ("tcp", None, None, False),
+                ("ipc", "ipc://{0}/command".format(directory.name),
+                        "ipc://{0}/message".format(directory.name), False),
+                ("inproc", "inproc://tcp-0-command",
+                           "inproc://tcp-0-message", True)):
+            round_trips, messages = bench(registry, command_endpoint,
+                                          message_endpoint, inproc)
+            print("{0:<8} {1:>14.0f} {2:>12.0f}".format(
+                name, round_trips, messages))
+    finally:
+        directory.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Latency benchmark of the poller and asyncio scenario player engines.
+
+Usage
+    python benchmarks/bench_engines.py
+
+Run from the TSTK directory.  For both engines it measures:
+
+* the lateness of 2000 steps, one every millisecond,
+* the latency from sending a message on a zmq socket to the call back
+  that receives it, for 2000 messages sent by another thread while the
+  steps run.
+"""
+import os
+import sys
+import logging
+import struct
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+from scenarioplayer import ScenarioPlayer, LatenessHistogram
+from asyncscenarioplayer import AsyncScenarioPlayer
+
+COUNT = 2000
+
+
+def bench(player_class):
+    """Play a scenario and return the lateness of the steps and the
+    latency of the messages.
+    """
+    player = player_class(None)
+    receiver = player.context.socket(zmq.PULL)
+    receiver.bind("inproc://bench")
+    sender = player.context.socket(zmq.PUSH)
+    sender.connect("inproc://bench")
+    latency = LatenessHistogram()
+    def on_message(a_socket, unused):
+        sent = struct.unpack("q", a_socket.recv())[0]
+        latency.record(time.monotonic_ns() - sent)
+    player.add_socket(receiver, on_message)
+
+    def send_messages():
+        for unused in range(COUNT):
+            sender.send(struct.pack("q", time.monotonic_ns()))
+            time.sleep(0.0007)
+    traffic = threading.Thread(target=send_messages)
+    player.add_periodic_step(0.001, 1, lambda: None, count=COUNT)
+    # Keep playing until all messages are in.
+    player.add_step(COUNT * 0.001 + 0.5, 1, lambda: None)
+    traffic.start()
+    player.play()
+    traffic.join()
+    sender.close(linger=0)
+    receiver.close(linger=0)
+    player.context.term()
+    return player.lateness, latency
+
+
+def describe(histogram):
+    """Format a histogram as mean, median, 99th percentile and maximum
+    in microseconds.
+    """
+    return "{0:>8.1f} {1:>8.1f} {2:>8.1f} {3:>8.1f}".format(
+        histogram.mean() / 1000.0, histogram.percentile(50) / 1000.0,
+        histogram.percentile(99) / 1000.0, histogram.maximum / 1000.0)
+
+
+if __name__ == "__main__":
+    logging.getLogger('ScenarioPlayer').setLevel(logging.WARNING)
+    print("{0:>8} {1:>9} {2:>8} {3:>8} {4:>8} {5:>8}  (us)".format(
+        "engine", "measure", "mean", "p50", "p99", "max"))
+    for name, player_class in (("poller", ScenarioPlayer),
+                               ("asyncio", AsyncScenarioPlayer)):
+        lateness, latency = bench(player_class)
+        print("{0:>8} {1:>9} {2}".format(name, "steps",
+                                         describe(lateness)))
+        print("{0:>8} {1:>9} {2}".format(name, "messages",
+                                         describe(latency)))
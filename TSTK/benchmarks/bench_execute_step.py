@@ -0,0 +1,65 @@
+"""Microbenchmark of the per-step overhead in ScenarioPlayer.execute_step.
+
+Usage
+    python benchmarks/bench_execute_step.py
+
+Run from the TSTK directory.  Compares the cost of calling a step
+after inspecting its signature on every call (the old way) with the
+cached call plan that add_step() stores with the queued step.
+"""
+import os
+import sys
+import logging
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from inspect import getfullargspec
+
+import scenarioplayer
+
+
+class Steps(object):
+    def method(self, test_system):
+        pass
+
+
+def function(test_system):
+    pass
+
+
+def inspecting_call(step, test_system):
+    """The signature inspection execute_step used to do per step."""
+    argspec = getfullargspec(step)
+    if len(argspec.args) > 0 and argspec.args[0] == 'self' :
+        if len(argspec.args) == 2:
+            step(test_system)
+        else :
+            step()
+    else:
+        if len(argspec.args) == 1:
+            step(test_system)
+        else :
+            step()
+
+
+if __name__ == "__main__":
+    logging.getLogger('ScenarioPlayer').setLevel(logging.WARNING)
+    player = scenarioplayer.ScenarioPlayer(None)
+    number = 200000
+    steps = {"function":function,
+             "method":Steps().method,
+             "lambda":lambda: None}
+    print("{0:>10} {1:>14} {2:>14} {3:>14}".format(
+        "step", "inspect (ns)", "cached (ns)", "direct (ns)"))
+    for name, step in steps.items():
+        inspecting = timeit.timeit(lambda: inspecting_call(step, None),
+                                   number=number)
+        arguments = player.step_arguments(step)
+        cached = timeit.timeit(
+                lambda: player.execute_step(step, arguments),
+                number=number)
+        direct = timeit.timeit(lambda: step(*arguments), number=number)
+        print("{0:>10} {1:>14.0f} {2:>14.0f} {3:>14.0f}".format(
+            name, 1e9 * inspecting / number, 1e9 * cached / number,
+            1e9 * direct / number))
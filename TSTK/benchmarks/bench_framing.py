@@ -0,0 +1,109 @@
+"""Benchmark of the framing of the TCP receive path.
+
+Usage
+    python benchmarks/bench_framing.py
+
+Run from the TSTK directory.  A thread writes length-prefixed frames to
+one end of a socket pair, in large writes, and the main thread cuts
+them into frames.  It compares:
+
+* the old receive path, one ``recv(2048)`` per message, which does not
+  frame at all.  The count shows how many "messages" it would forward
+  instead of the number of frames.
+* framing with a bytes buffer that grows by concatenation,
+* the StreamBuffer of the framing module with ``recv_into``.
+"""
+import os
+import sys
+import socket
+import struct
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import framing
+
+FRAMES = 200000
+
+
+def sender(a_socket, size):
+    """Write FRAMES frames of size bytes, 64 kB at a time."""
+    frame = struct.pack('>I', size) + b"x" * size
+    per_write = max(1, 65536 // len(frame))
+    for unused in range(FRAMES // per_write):
+        a_socket.sendall(frame * per_write)
+    a_socket.sendall(frame * (FRAMES % per_write))
+    a_socket.shutdown(socket.SHUT_WR)
+
+
+def old_recv(a_socket):
+    """One message per recv, as Dispatcher.process_message() did."""
+    count = 0
+    while True:
+        data = a_socket.recv(2048)
+        if not data:
+            return count
+        count += 1
+
+
+def concat_framing(a_socket):
+    """Frame with a bytes buffer."""
+    count = 0
+    data = b""
+    while True:
+        chunk = a_socket.recv(65536)
+        if not chunk:
+            return count
+        data += chunk
+        while len(data) >= 4:
+            length = struct.unpack_from('>I', data)[0]
+            if len(data) < 4 + length:
+                break
+            frame = data[4:4 + length]
+            data = data[4 + length:]
+            count += 1
+
+
+def buffer_framing(a_socket):
+    """Frame with a StreamBuffer."""
+    count = 0
+    buffer = framing.StreamBuffer()
+    framer = framing.get_framer("length", strip=True)
+    while buffer.recv_into(a_socket):
+        for frame in buffer.frames(framer):
+            count += 1
+    return count
+
+
+def bench(receive, size):
+    """Run a receive function against the sender.
+
+    :returns: frames counted and frames per second.
+    """
+    one, other = socket.socketpair()
+    thread = threading.Thread(target=sender, args=(one, size))
+    start = time.perf_counter()
+    thread.start()
+    count = receive(other)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    one.close()
+    other.close()
+    return count, FRAMES / elapsed
+
+
+def main():
+    print("{0:<12} {1:>6} {2:>10} {3:>12}".format(
+        "receive", "size", "frames", "frames/s"))
+    for size in (16, 100, 1000):
+        for name, receive in (("old recv", old_recv),
+                              ("concat", concat_framing),
+                              ("recv_into", buffer_framing)):
+            count, rate = bench(receive, size)
+            print("{0:<12} {1:>6} {2:>10} {3:>12.0f}".format(
+                name, size, count, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Benchmark of the HTTP dispatcher.
+
+Usage
+    python benchmarks/bench_http.py
+
+Run from the TSTK directory.  A client thread polls the dispatcher with
+GET requests and a player thread answers every request through a
+simulator interface, so each request makes the full round trip through
+the player.  It compares:
+
+* a new connection per request, as the old dispatcher forced by closing
+  every connection,
+* one connection that is kept alive, a request at a time,
+* one connection with 16 pipelined requests at a time.
+"""
+import os
+import sys
+import socket
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+import dispatcher
+import simulatorinterface
+
+REQUESTS = 4000
+COMMAND_PORT = 29501
+MESSAGE_PORT = 29502
+REQUEST = b"GET /status HTTP/1.1\r\nHost: system\r\n\r\n"
+CLOSE_REQUEST = b"GET /status HTTP/1.1\r\nConnection: close\r\n\r\n"
+RESPONSE_SIZE = len(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+
+
+def player(stop):
+    """Answer every request with "ok"."""
+    context = zmq.Context()
+    interface = simulatorinterface.SimulatorInterface(
+            "http", 0, context, COMMAND_PORT, MESSAGE_PORT)
+    interface.set_callback(
+            "/status", lambda request: interface.send(
+                request.response(body=b"ok")))
+    link = interface.message_link
+    while not stop.is_set():
+        if link.poll(50):
+            interface.on_message(link, None)
+    link.close(linger=0)
+    interface.command_link.close(linger=0)
+    context.term()
+
+
+def read(client, size):
+    """Read size bytes."""
+    data = b""
+    while len(data) < size:
+        chunk = client.recv(65536)
+        if not chunk:
+            raise RuntimeError("connection closed")
+        data += chunk
+
+
+def per_request(address):
+    for unused in range(REQUESTS):
+        client = socket.create_connection(address)
+        client.sendall(CLOSE_REQUEST)
+        while client.recv(65536):
+            pass
+        client.close()
+
+
+def keep_alive(address, depth=1):
+    client = socket.create_connection(address)
+    for unused in range(REQUESTS // depth):
+        client.sendall(REQUEST * depth)
+        read(client, RESPONSE_SIZE * depth)
+    client.close()
+
+
+def pipelined(address):
+    keep_alive(address, 16)
+
+
+def bench(client):
+    """Run the client against the dispatcher and the player.
+
+    :returns: requests per second.
+    """
+    a_dispatcher = dispatcher.HttpDispatcher("http", 0)
+    a_dispatcher.logger.disabled = True
+    a_dispatcher.accept_address = "127.0.0.1"
+    a_dispatcher.listen_port = 0
+    a_dispatcher.backlog = 128
+    a_dispatcher.command_listen_port = COMMAND_PORT
+    a_dispatcher.message_forward_port = MESSAGE_PORT
+    a_dispatcher.create_sockets()
+    address = a_dispatcher.accept_socket.getsockname()
+
+    stop = threading.Event()
+    player_thread = threading.Thread(target=player, args=(stop,))
+    player_thread.start()
+    time.sleep(0.3)
+    client_thread = threading.Thread(target=client, args=(address,))
+    start = time.perf_counter()
+    client_thread.start()
+    while client_thread.is_alive():
+        a_dispatcher.poll_sockets(10)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    player_thread.join()
+    for system_socket in a_dispatcher.connections.values():
+        system_socket.close()
+    a_dispatcher.accept_socket.close()
+    a_dispatcher.context.destroy(linger=0)
+    return REQUESTS / elapsed
+
+
+def main():
+    print("{0:<20} {1:>10}".format("client", "requests/s"))
+    for name, client in (("connection/request", per_request),
+                         ("keep-alive", keep_alive),
+                         ("pipelined 16", pipelined)):
+        print("{0:<20} {1:>10.0f}".format(name, bench(client)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark of a hub of simulators against a process per simulator.
+
+Usage
+    python benchmarks/bench_hub.py
+
+Run from the TSTK directory.  For 10 and 40 TCP simulators it writes a
+simulator.conf in a temporary directory and starts the simulators in
+two ways: a Python process per simulator, each with its own pair of
+ports for the player, the way start_simulator.py runs them, and one
+process with a hub.  Each process creates its sockets and reports that
+it is ready.  It reports the time until all simulators are ready, the
+total resident memory, the threads and the ports for the player.
+"""
+import os
+import sys
+import subprocess
+import tempfile
+import time
+
+TSTK = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PORT_BASE = 29700
+
+SIMULATOR = """
+import sys
+sys.path.insert(0, {0!r})
+import dispatcher
+a_dispatcher = dispatcher.TCPDispatcher("tcp", {1})
+a_dispatcher.create_sockets()
+print("ready", flush=True)
+sys.stdin.read()
+"""
+
+HUB = """
+import sys
+sys.path.insert(0, {0!r})
+import hub
+a_hub = hub.Hub("hub", 0)
+a_hub.create_sockets()
+print("ready", flush=True)
+sys.stdin.read()
+"""
+
+
+def write_config(count):
+    """Write the sections of the simulators and the hub."""
+    with open('simulator.conf', 'w') as config:
+        config.write("[dispatcher-hub-0]\n"
+                     "CommandListenPort = {0}\n"
+                     "MessageForwardPort = {1}\n"
+                     "Simulators = {2}\n".format(
+                         PORT_BASE, PORT_BASE + 1,
+                         ", ".join("tcp-{0}".format(number)
+                                   for number in range(count))))
+        for number in range(count):
+            config.write("[dispatcher-tcp-{0}]\n"
+                         "AcceptAddress = 127.0.0.1\n"
+                         "ListenPort = 0\n"
+                         "CommandListenPort = {1}\n"
+                         "MessageForwardPort = {2}\n".format(
+                             number, PORT_BASE + 2 + 2 * number,
+                             PORT_BASE + 3 + 2 * number))
+
+
+def status(pid, field):
+    """A field of /proc/<pid>/status, as a number."""
+    with open('/proc/{0}/status'.format(pid)) as status_file:
+        for line in status_file:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def start(scripts):
+    """Start the processes and wait until all are ready.
+
+    :returns: seconds until ready, RSS in MB and the number of threads.
+    """
+    start_time = time.perf_counter()
+    processes = [subprocess.Popen([sys.executable, '-c', script],
+                                  stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE)
+                 for script in scripts]
+    for process in processes:
+        if process.stdout.readline() != b"ready\n":
+            raise RuntimeError("simulator did not start")
+    elapsed = time.perf_counter() - start_time
+    rss = sum(status(process.pid, 'VmRSS') for process in processes)
+    threads = sum(status(process.pid, 'Threads') for process in processes)
+    for process in processes:
+        process.stdin.close()
+        process.wait()
+    return elapsed, rss / 1024.0, threads
+
+
+def main():
+    directory = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    os.chdir(directory.name)
+    try:
+        print("{0:>10} {1:<12} {2:>9} {3:>8} {4:>8} {5:>6}".format(
+            "simulators", "model", "start s", "RSS MB", "threads", "ports"))
+        for count in (10, 40):
+            write_config(count)
+            for name, scripts, ports in (
+                    ("process", [SIMULATOR.format(TSTK, number)
+                                 for number in range(count)], 2 * count),
+                    ("hub", [HUB.format(TSTK)], 2)):
+                elapsed, rss, threads = start(scripts)
+                print("{0:>10} {1:<12} {2:>9.2f} {3:>8.1f} {4:>8} {5:>6}"
+                      .format(count, name, elapsed, rss, threads, ports))
+    finally:
+        os.chdir(cwd)
+        directory.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark of queries on an indexed capture.
+
+Usage
+    python benchmarks/bench_index.py
+
+Run from the TSTK directory.  Writes a capture of 1000000 frames of 32
+bytes with 100 message ids in a temporary directory, and finds the
+frames of one message id in the middle tenth of the capture: with the
+index, by scanning all frames with the reader, and by reading the whole
+file and parsing it, the way a grep over a log would.  It reports the
+frames found and the time of each query.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import capture
+import logpipeline
+
+FRAMES = 1000000
+IDS = 100
+PADDING = bytes(31)
+
+
+def write(path):
+    writer = capture.CaptureWriter(path)
+    for number in range(FRAMES):
+        message_id = number % IDS
+        writer.record(logpipeline.RECEIVED, 1, bytes([message_id]) + PADDING,
+                      message_id)
+    writer.close()
+
+
+def query_index(path, start, end):
+    with capture.CaptureReader(path) as reader:
+        found = sum(1 for frame in reader.frames(message_id=7, start=start,
+                                                 end=end))
+    return found
+
+
+def query_scan(path, start, end):
+    found = 0
+    with capture.CaptureReader(path) as reader:
+        for time_ns, unused, unused, data in reader.frames():
+            if start <= time_ns < end and data[0] == 7:
+                found += 1
+            data.release()
+    return found
+
+
+def query_read(path, start, end):
+    with open(path, 'rb') as capture_file:
+        data = capture_file.read()
+    offset = capture.CAPTURE_HEADER.size
+    size = logpipeline.TRAFFIC_RECORD.size
+    unpack_from = logpipeline.TRAFFIC_RECORD.unpack_from
+    found = 0
+    while offset + size <= len(data):
+        time_ns, unused, unused, length = unpack_from(data, offset)
+        offset += size
+        if start <= time_ns < end and data[offset] == 7:
+            found += 1
+        offset += length
+    return found
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "capture")
+        start = time.perf_counter()
+        write(path)
+        print("wrote {0} frames, {1:.1f} MB, index {2:.1f} MB in {3:.2f} s"
+              .format(FRAMES, os.path.getsize(path) / 1e6,
+                      os.path.getsize(capture.index_path(path)) / 1e6,
+                      time.perf_counter() - start))
+        with capture.CaptureReader(path) as reader:
+            times = reader.index.times
+            first = times[len(times) * 45 // 100]
+            last = times[len(times) * 55 // 100]
+        print("{0:<8} {1:>8} {2:>10}".format("query", "frames", "ms"))
+        for name, query in (("index", query_index), ("scan", query_scan),
+                            ("read", query_read)):
+            start = time.perf_counter()
+            found = query(path, first, last)
+            print("{0:<8} {1:>8} {2:>10.1f}".format(
+                name, found, (time.perf_counter() - start) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark of logging on the hot path of a dispatcher.
+
+Usage
+    python benchmarks/bench_logging.py
+
+Run from the TSTK directory.  Logs a record with a hex dump of a 256
+byte frame for each of 50000 frames, to a file in a temporary
+directory: the old way, formatted right away through a FileHandler, and
+through a log pipeline without and with a rate limit of 100 records per
+second on the traffic category.  It also logs the frames in a traffic
+log.  It reports the CPU time of the logging thread per frame, and the
+wall time until everything is written.
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import logpipeline
+
+FRAMES = 50000
+FRAME = bytes(range(256))
+
+
+def handler(path):
+    filehandler = logging.FileHandler(path)
+    filehandler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    return filehandler
+
+
+def bench_sync(path):
+    logger = logging.getLogger('bench_sync')
+    logger.propagate = False
+    filehandler = handler(path)
+    logger.addHandler(filehandler)
+    start = time.perf_counter()
+    cpu = time.thread_time()
+    for number in range(FRAMES):
+        logger.warning('Received a full message from the system: %s',
+                       FRAME.hex(','))
+    cpu = time.thread_time() - cpu
+    logger.removeHandler(filehandler)
+    filehandler.close()
+    return cpu, time.perf_counter() - start
+
+
+def bench_pipeline(path, rate):
+    logger = logging.getLogger('bench_pipeline_{0}'.format(rate))
+    logger.propagate = False
+    pipeline = logpipeline.get_pipeline(logger, handler(path))
+    if rate is not None:
+        pipeline.filter.limit('traffic', rate=rate)
+    start = time.perf_counter()
+    cpu = time.thread_time()
+    for number in range(FRAMES):
+        logger.warning('Received a full message from the system: %s',
+                       logpipeline.HexDump(FRAME), extra=logpipeline.TRAFFIC)
+    cpu = time.thread_time() - cpu
+    pipeline.stop()
+    return cpu, time.perf_counter() - start
+
+
+def bench_traffic(path):
+    traffic_log = logpipeline.TrafficLog(path)
+    start = time.perf_counter()
+    cpu = time.thread_time()
+    for number in range(FRAMES):
+        traffic_log.record(logpipeline.RECEIVED, 1, FRAME)
+    cpu = time.thread_time() - cpu
+    traffic_log.close()
+    return cpu, time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        print("{0:<22} {1:>14} {2:>10} {3:>9}".format(
+            "logging", "hot path cpu us", "total s", "file MB"))
+        for name, bench in (
+                ("FileHandler", bench_sync),
+                ("pipeline", lambda path: bench_pipeline(path, None)),
+                ("pipeline 100/s", lambda path: bench_pipeline(path, 100)),
+                ("traffic log", bench_traffic)):
+            path = os.path.join(directory, name.replace(' ', '_')
+                                               .replace('/', '_'))
+            elapsed, total = bench(path)
+            print("{0:<22} {1:>14.2f} {2:>10.2f} {3:>9.1f}".format(
+                name, elapsed / FRAMES * 1e6, total,
+                os.path.getsize(path) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Benchmark of the response table of the dispatchers.
+
+Usage
+    python benchmarks/bench_responses.py
+
+Run from the TSTK directory.  A client thread sends heartbeats, lines
+of "ping", to a TCP dispatcher and waits for each "pong".  The pong
+comes from a callback of the player in a thread, the old way, or from
+the response table of the dispatcher, which still forwards the ping to
+the player.  It reports the round trip time of the heartbeats.
+"""
+import os
+import sys
+import socket
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+import dispatcher
+import framing
+import simulatorinterface
+
+HEARTBEATS = 5000
+COMMAND_PORT = 29601
+MESSAGE_PORT = 29602
+
+
+def player(stop, use_table, ready):
+    """Answer the pings, or let the dispatcher do it."""
+    context = zmq.Context()
+    interface = simulatorinterface.SimulatorInterface(
+            "tcp", 0, context, COMMAND_PORT, MESSAGE_PORT)
+    if use_table:
+        interface.set_callback(simulatorinterface.ANY, lambda ping: None)
+    else:
+        interface.set_callback(
+                simulatorinterface.ANY,
+                lambda ping: interface.send(b"pong\n",
+                                            interface.connection_id))
+    link = interface.message_link
+    while not stop.is_set():
+        if use_table and not ready.is_set():
+            interface.set_response(b"pong\n", prefix=b"ping")
+            time.sleep(0.01)
+        if link.poll(50):
+            interface.on_message(link, None)
+    link.close(linger=0)
+    interface.command_link.close(linger=0)
+    context.term()
+
+
+def client(address, times):
+    """Send the heartbeats and measure the round trips."""
+    a_socket = socket.create_connection(address)
+    for unused in range(HEARTBEATS):
+        start = time.perf_counter()
+        a_socket.sendall(b"ping\n")
+        a_socket.recv(100)
+        times.append(time.perf_counter() - start)
+    a_socket.close()
+
+
+def bench(use_table):
+    """Run the heartbeats.
+
+    :returns: mean and 99th percentile of the round trip in us.
+    """
+    a_dispatcher = dispatcher.TCPDispatcher("tcp", 0)
+    a_dispatcher.logger.disabled = True
+    a_dispatcher.accept_address = "127.0.0.1"
+    a_dispatcher.listen_port = 0
+    a_dispatcher.backlog = 16
+    a_dispatcher.command_listen_port = COMMAND_PORT
+    a_dispatcher.message_forward_port = MESSAGE_PORT
+    a_dispatcher.framer = framing.get_framer("delimiter")
+    a_dispatcher.create_sockets()
+    address = a_dispatcher.accept_socket.getsockname()
+
+    stop = threading.Event()
+    ready = threading.Event()
+    player_thread = threading.Thread(target=player,
+                                     args=(stop, use_table, ready))
+    player_thread.start()
+    deadline = time.monotonic() + 0.5
+    while time.monotonic() < deadline or (use_table and
+                                          not a_dispatcher.responses):
+        a_dispatcher.poll_sockets(10)
+    ready.set()
+    times = []
+    client_thread = threading.Thread(target=client, args=(address, times))
+    client_thread.start()
+    while client_thread.is_alive():
+        a_dispatcher.poll_sockets(10)
+    stop.set()
+    player_thread.join()
+    for system_socket in a_dispatcher.connections.values():
+        system_socket.close()
+    a_dispatcher.accept_socket.close()
+    a_dispatcher.context.destroy(linger=0)
+    times.sort()
+    return (sum(times) / len(times) * 1e6,
+            times[int(len(times) * 0.99)] * 1e6)
+
+
+def main():
+    print("{0:<8} {1:>9} {2:>9}".format("pong", "mean us", "p99 us"))
+    for name, use_table in (("player", False), ("table", True)):
+        mean, p99 = bench(use_table)
+        print("{0:<8} {1:>9.0f} {2:>9.0f}".format(name, mean, p99))
+
+
+if __name__ == '__main__':
+    main()
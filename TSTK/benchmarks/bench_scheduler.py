@@ -0,0 +1,52 @@
+"""Benchmark of the scheduler backends of the scenario player.
+
+Usage
+    python benchmarks/bench_scheduler.py
+
+Run from the TSTK directory.  For 10^3 up to 10^6 pending steps it
+measures the time per push and per pop of every backend.  The pops
+are preceded by a peek, the way the scenario player uses them.
+"""
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import scheduler
+
+
+def bench(scheduler_type, deadlines):
+    """Push all deadlines and pop them again.
+
+    :returns: the time per push and per pop in microseconds.
+    """
+    a_scheduler = scheduler.get_scheduler(scheduler_type)
+    start = time.perf_counter()
+    for when in deadlines:
+        a_scheduler.push(when, 1, None)
+    push_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    while a_scheduler.peek() is not None:
+        a_scheduler.pop()
+    pop_time = time.perf_counter() - start
+    return (1e6 * push_time / len(deadlines),
+            1e6 * pop_time / len(deadlines))
+
+
+if __name__ == "__main__":
+    rand = random.Random(1)
+    print("{0:>8} {1:>6} {2:>10} {3:>10}".format(
+        "steps", "type", "push (us)", "pop (us)"))
+    for exponent in range(3, 7):
+        count = 10 ** exponent
+        # Spread the steps over an hour, like a soak scenario.  The
+        # scenario player uses deadlines in nanoseconds.
+        deadlines = [rand.randrange(3600 * 10 ** 9)
+                     for unused in range(count)]
+        for scheduler_type in ("queue", "heap", "wheel"):
+            push, pop = bench(scheduler_type, deadlines)
+            print("{0:>8} {1:>6} {2:>10.3f} {3:>10.3f}".format(
+                count, scheduler_type, push, pop))
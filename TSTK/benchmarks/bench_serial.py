@@ -0,0 +1,137 @@
+"""Benchmark of the serial dispatcher on a pty pair.
+
+Usage
+    python benchmarks/bench_serial.py
+
+Run from the TSTK directory.  A writer process plays the system: it
+writes frames of 64 bytes to the master side of a pty, in chunks of 16
+bytes paced at the baud rate, with a gap of 96 characters between the
+frames.  The serial dispatcher reads the slave side with gap framing.
+A pty does not slow down to the baud rate itself, hence the pacing.
+Because the chunks arrive at once, followed by silence, the dispatcher
+uses a gap of two chunks (32 characters) instead of 3.5 characters.
+
+For 115200 and 921600 baud it compares reading one byte per wake-up
+(what the dispatcher used to do), batched reads of everything that is
+available, and batched reads on the reader thread.  It reports the
+frames that came through (merged frames make this lower), the reads per
+frame, the latency from the end of a frame to its forwarding, and the
+CPU time per frame.
+"""
+import os
+import sys
+import multiprocessing
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import serial
+
+import dispatcher
+
+FRAMES = 200
+FRAME_SIZE = 64
+CHUNK = 16
+GAP_CHARACTERS = 6 * CHUNK
+
+
+def writer(master, baudrate, ends):
+    """Write the frames, paced at the baud rate, and report the time
+    each frame was written completely.
+    """
+    character = 10.0 / baudrate
+    frame = bytes(range(FRAME_SIZE))
+    times = []
+    time.sleep(0.2)
+    for unused in range(FRAMES):
+        for start in range(0, FRAME_SIZE, CHUNK):
+            os.write(master, frame[start:start + CHUNK])
+            time.sleep(CHUNK * character)
+        times.append(time.monotonic_ns())
+        time.sleep(GAP_CHARACTERS * character)
+    ends.send(times)
+
+
+class OneByteSerialDispatcher(dispatcher.SerialDispatcher):
+    """Reads one byte per wake-up, like the old dispatcher."""
+    def read_available(self, link):
+        return self.buffer.fill(lambda view: link.readinto(view[:1]))
+
+
+def bench(dispatcher_class, baudrate, thread):
+    """Run the dispatcher against the writer.
+
+    :returns: frames, reads per frame, mean and maximum latency in us,
+              CPU time per frame in us.
+    """
+    master, slave = os.openpty()
+    tty.setraw(master)
+    a_dispatcher = dispatcher_class("serial", 0)
+    a_dispatcher.logger.disabled = True
+    a_dispatcher.serial_device = os.ttyname(slave)
+    os.close(slave)
+    a_dispatcher.serial_baudrate = baudrate
+    a_dispatcher.serial_bytesize = 8
+    a_dispatcher.serial_parity = serial.PARITY_NONE
+    a_dispatcher.serial_stopbits = serial.STOPBITS_ONE
+    a_dispatcher.command_listen_port = 29301
+    a_dispatcher.message_forward_port = 29302
+    a_dispatcher.use_reader_thread = thread
+    a_dispatcher.gap_characters = 2 * CHUNK
+    received = []
+    a_dispatcher.forward = lambda connection_id, message: received.append(
+            time.monotonic_ns())
+    reads = [0]
+    fill = a_dispatcher.buffer.fill
+    def counting_fill(read_into):
+        reads[0] += 1
+        return fill(read_into)
+    a_dispatcher.buffer.fill = counting_fill
+    a_dispatcher.create_sockets()
+
+    receiver, sender = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=writer,
+                                      args=(master, baudrate, sender))
+    process.start()
+    cpu = time.process_time()
+    deadline = time.monotonic() + 30
+    while not receiver.poll() and time.monotonic() < deadline:
+        events = a_dispatcher.poll_sockets(min(a_dispatcher.timeout, 100))
+        a_dispatcher.after_poll(events)
+    ends = receiver.recv()
+    # The last frame ends after the gap.
+    stop = time.monotonic() + 0.1
+    while time.monotonic() < stop:
+        events = a_dispatcher.poll_sockets(min(a_dispatcher.timeout, 10))
+        a_dispatcher.after_poll(events)
+    cpu = time.process_time() - cpu
+    process.join()
+    a_dispatcher.shutdown()
+    a_dispatcher.context.destroy(linger=0)
+    os.close(master)
+
+    latencies = [(done - end) / 1000.0 for end, done in zip(ends, received)]
+    return (len(received), reads[0] / FRAMES,
+            sum(latencies) / max(1, len(latencies)), max(latencies or [0]),
+            cpu / FRAMES * 1e6)
+
+
+def main():
+    print("{0:>7} {1:<9} {2:>7} {3:>11} {4:>10} {5:>10} {6:>9}".format(
+        "baud", "reads", "frames", "reads/frame", "mean us", "max us",
+        "cpu us"))
+    for baudrate in (115200, 921600):
+        for name, dispatcher_class, thread in (
+                ("one byte", OneByteSerialDispatcher, False),
+                ("batched", dispatcher.SerialDispatcher, False),
+                ("thread", dispatcher.SerialDispatcher, True)):
+            frames, reads, mean, maximum, cpu = bench(dispatcher_class,
+                                                      baudrate, thread)
+            print("{0:>7} {1:<9} {2:>7} {3:>11.1f} {4:>10.0f} {5:>10.0f} "
+                  "{6:>9.0f}".format(baudrate, name, frames, reads, mean,
+                                     maximum, cpu))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark of the serializers for the links to the simulators.
+
+Usage
+    python benchmarks/bench_serializer.py
+
+Run from the TSTK directory.  For every serializer it sends messages
+over an inproc PUSH/PULL pair of zmq sockets and reports the messages
+per second and the bytes on the wire per message.  The messages are a
+small message object and a 1 kB bytes payload; the raw serializer only
+sends the payload.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+import serializer
+
+MESSAGES = 20000
+
+
+@serializer.register_message_class
+class Message(object):
+    """A typical message from a simulator."""
+    def __init__(self, message_id, fields):
+        self.message_id = message_id
+        self.fields = fields
+
+
+def wire_size(a_serializer, obj):
+    """Bytes on the wire for one message: tag frame and payload."""
+    return len(a_serializer.tag) + len(a_serializer.dumps(obj))
+
+
+def bench(a_serializer, obj, sender, receiver):
+    """Send MESSAGES messages and receive them.
+
+    :returns: messages per second.
+    """
+    start = time.perf_counter()
+    for unused in range(MESSAGES):
+        a_serializer.send(sender, obj)
+        a_serializer.recv(receiver)
+    return MESSAGES / (time.perf_counter() - start)
+
+
+def main():
+    context = zmq.Context()
+    receiver = context.socket(zmq.PULL)
+    receiver.bind("inproc://bench")
+    sender = context.socket(zmq.PUSH)
+    sender.connect("inproc://bench")
+
+    payload = bytes(range(256)) * 4
+    message = Message(17, {"train":"IC 1234", "track":4, "speed":80.5,
+                           "doors":[True, False, True]})
+    print("msgpack package: {0}".format(
+        "installed" if serializer.msgpack is not None
+        else "not installed, pure Python codec"))
+    print("{0:<10} {1:<8} {2:>12} {3:>10}".format(
+        "serializer", "message", "msgs/s", "bytes"))
+    for name in ("pickle", "msgpack", "raw"):
+        a_serializer = serializer.get_serializer(name)
+        for label, obj in (("object", message), ("1kB", payload)):
+            if a_serializer.raw and label == "object":
+                continue
+            rate = bench(a_serializer, obj, sender, receiver)
+            print("{0:<10} {1:<8} {2:>12.0f} {3:>10}".format(
+                name, label, rate, wire_size(a_serializer, obj)))
+
+    sender.close(linger=0)
+    receiver.close(linger=0)
+    context.term()
+
+
+if __name__ == '__main__':
+    main()
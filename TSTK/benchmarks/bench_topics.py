@@ -0,0 +1,95 @@
+"""Benchmark of topic-filtered subscriptions.
+
+Usage
+    python benchmarks/bench_topics.py
+
+Run from the TSTK directory.  A dispatcher publishes 100000 pickled
+messages with 50 different message ids, an interface has a callback for
+one of them.  Without a topic the interface receives and unpickles every
+message and drops most of them in do_callbacks(); with the topic of the
+simulator it subscribes to the one message id and zmq drops the rest.
+It reports the messages the interface received, its CPU time and the
+wall time until the last message arrived.
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+import dispatcher
+import simulatorinterface
+
+MESSAGES = 100000
+IDS = 50
+COMMAND_PORT = 29801
+MESSAGE_PORT = 29802
+
+
+class Message(object):
+    def __init__(self, message_id, value=None):
+        self.message_id = message_id
+        self.value = value
+
+
+def publish(a_dispatcher):
+    for number in range(MESSAGES):
+        a_dispatcher.forward(1, Message(number % IDS))
+    a_dispatcher.forward(1, Message(0, "end"))
+
+
+def bench(topic):
+    """Publish the messages to an interface with or without topic.
+
+    :returns: messages received, CPU time and wall time in seconds.
+    """
+    a_dispatcher = dispatcher.Dispatcher("tcp", 0)
+    a_dispatcher.logger.disabled = True
+    a_dispatcher.repeater_socket = a_dispatcher.context.socket(zmq.PUB)
+    a_dispatcher.repeater_socket.setsockopt(zmq.SNDHWM, 0)
+    a_dispatcher.repeater_socket.bind("tcp://127.0.0.1:{0}"
+                                      .format(MESSAGE_PORT))
+    context = zmq.Context()
+    interface = simulatorinterface.SimulatorInterface(
+            "tcp", 0, context, COMMAND_PORT, MESSAGE_PORT, topic=topic)
+    link = interface.message_link
+    link.setsockopt(zmq.RCVHWM, 0)
+    done = []
+    interface.set_callback(0, lambda message: message.value == "end" and
+                                             done.append(True))
+    time.sleep(0.3)
+
+    received = 0
+    thread = threading.Thread(target=publish, args=(a_dispatcher,))
+    start = time.perf_counter()
+    cpu = time.thread_time()
+    thread.start()
+    while not done:
+        if link.poll(1000):
+            interface.on_message(link, None)
+            received += 1
+    cpu = time.thread_time() - cpu
+    elapsed = time.perf_counter() - start
+    thread.join()
+    link.close(linger=0)
+    interface.command_link.close(linger=0)
+    context.term()
+    a_dispatcher.repeater_socket.close(linger=0)
+    a_dispatcher.context.term()
+    return received, cpu, elapsed
+
+
+def main():
+    print("{0:<10} {1:>9} {2:>8} {3:>8}".format(
+        "interface", "received", "cpu s", "wall s"))
+    for name, topic in (("no topic", None), ("topic", "tcp-0")):
+        received, cpu, elapsed = bench(topic)
+        print("{0:<10} {1:>9} {2:>8.2f} {3:>8.2f}".format(
+            name, received, cpu, elapsed))
+
+
+if __name__ == '__main__':
+    main()
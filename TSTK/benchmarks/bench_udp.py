@@ -0,0 +1,126 @@
+"""Benchmark of the UDP dispatcher at high packet rates.
+
+Usage
+    python benchmarks/bench_udp.py
+
+Run from the TSTK directory.  A sender process offers 64 byte datagrams
+at 20000, 50000 and 100000 packets per second, in bursts every
+millisecond.  The dispatcher runs its poll loop in this process and a
+thread counts what arrives at the player side.  It compares one
+datagram per wake-up, each pickled and forwarded on its own, with the
+batched path, with the pickle and the raw serializer.  It reports the
+datagrams that reached the player and the zmq messages it took.
+Datagrams the dispatcher does not read in time are dropped by the
+kernel.
+"""
+import os
+import sys
+import multiprocessing
+import socket
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+
+import dispatcher
+import serializer
+
+DURATION = 2.0
+SIZE = 64
+COMMAND_PORT = 29401
+MESSAGE_PORT = 29402
+
+
+def sender(address, rate):
+    """Send datagrams at the rate for DURATION seconds."""
+    a_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    data = b"x" * SIZE
+    per_burst = max(1, rate // 1000)
+    start = time.monotonic()
+    bursts = int(DURATION * 1000)
+    for burst in range(bursts):
+        for unused in range(per_burst):
+            a_socket.sendto(data, address)
+        delay = start + (burst + 1) / 1000.0 - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    a_socket.close()
+
+
+class SingleUDPDispatcher(dispatcher.UDPDispatcher):
+    """Reads and forwards one datagram per wake-up."""
+    def read_datagrams(self, a_socket):
+        data, address = a_socket.recvfrom(self.max_datagram_size)
+        self.forward(self.peer_id(address), self.decode(data))
+
+
+def counter(context, counts, stop):
+    """Count the datagrams and zmq messages that reach the player."""
+    link = context.socket(zmq.SUB)
+    link.connect("tcp://localhost:{0}".format(MESSAGE_PORT))
+    link.setsockopt(zmq.SUBSCRIBE, b"")
+    while not stop.is_set():
+        if link.poll(50):
+            frames = link.recv_multipart(copy=False)
+            counts[0] += (len(frames) - 1) // 3
+            counts[1] += 1
+    link.close(linger=0)
+
+
+def bench(dispatcher_class, serializer_name, rate):
+    """Offer datagrams at the rate.
+
+    :returns: datagrams sent, received by the player and zmq messages.
+    """
+    a_dispatcher = dispatcher_class("udp", 0)
+    a_dispatcher.logger.disabled = True
+    a_dispatcher.accept_address = "127.0.0.1"
+    a_dispatcher.listen_port = 0
+    a_dispatcher.command_listen_port = COMMAND_PORT
+    a_dispatcher.message_forward_port = MESSAGE_PORT
+    a_dispatcher.serializer = serializer.get_serializer(serializer_name)
+    a_dispatcher.create_sockets()
+    address = a_dispatcher.accept_socket.getsockname()
+
+    context = zmq.Context()
+    counts = [0, 0]
+    stop = threading.Event()
+    thread = threading.Thread(target=counter, args=(context, counts, stop))
+    thread.start()
+    time.sleep(0.3)
+
+    process = multiprocessing.Process(target=sender, args=(address, rate))
+    process.start()
+    end = time.monotonic() + DURATION + 0.5
+    while time.monotonic() < end:
+        a_dispatcher.poll_sockets(10)
+    process.join()
+    time.sleep(0.2)
+    stop.set()
+    thread.join()
+    context.term()
+    a_dispatcher.accept_socket.close()
+    a_dispatcher.context.destroy(linger=0)
+    sent = max(1, rate // 1000) * int(DURATION * 1000)
+    return sent, counts[0], counts[1]
+
+
+def main():
+    print("{0:>7} {1:<16} {2:>8} {3:>9} {4:>8} {5:>9}".format(
+        "rate", "dispatch", "sent", "received", "lost %", "zmq msgs"))
+    for rate in (20000, 50000, 100000):
+        for name, dispatcher_class, serializer_name in (
+                ("single pickle", SingleUDPDispatcher, "pickle"),
+                ("batched pickle", dispatcher.UDPDispatcher, "pickle"),
+                ("batched raw", dispatcher.UDPDispatcher, "raw")):
+            sent, received, messages = bench(dispatcher_class,
+                                             serializer_name, rate)
+            print("{0:>7} {1:<16} {2:>8} {3:>9} {4:>8.1f} {5:>9}".format(
+                rate, name, sent, received, 100.0 * (sent - received) / sent,
+                messages))
+
+
+if __name__ == '__main__':
+    main()
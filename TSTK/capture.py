@@ -0,0 +1,683 @@
+# vi: spell spl=en
+
+"""Capture of the traffic of a simulator, and replay of a capture.
+
+With the ``Capture`` setting a dispatcher writes every frame it
+receives from and sends to the system in a capture file.  The file is
+memory mapped and only appended to, so writing a frame is a copy into
+memory; the operating system writes the pages to disk.  Each frame has
+the monotonic time in nanoseconds at which it passed, see
+:data:`logpipeline.TRAFFIC_RECORD`.
+
+A :class:`Replay` plays the frames of a capture again, with the times
+between them divided by a speed, or as fast as possible:
+
+* through a dispatcher, as if the system sent them, to reproduce what
+  the player saw: the ``Replay`` and ``ReplaySpeed`` settings, or
+  :meth:`dispatcher.Dispatcher.replay`.
+* from the scenario player, to send what the system received to the
+  system under test::
+
+      replay = Replay(CaptureReader(path), lambda connection_id, data:
+                          interface.send(data, connection_id),
+                      speed=10, direction=SENT)
+      player.add_steps(replay.steps())
+
+Next to a capture the writer keeps an index, in ``<capture>.index``:
+the offset of every 64th frame by time, and the offsets of the frames
+of each message id, without pickled data.  A :class:`CaptureReader` uses it to find, for
+instance, the frames with message id 12 between two times without
+reading the rest of the capture::
+
+    with CaptureReader(path) as reader:
+        for time_ns, connection_id, direction, data in reader.frames(
+                message_id=12, start=t1, end=t2):
+            ...
+
+A capture without an index, or written further after its index, is
+indexed with :meth:`CaptureReader.build_index`.
+"""
+#-----------------------------------------------------------
+import array
+import bisect
+import collections
+import fcntl
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+from logpipeline import TRAFFIC_RECORD, RECEIVED
+#-----------------------------------------------------------
+
+#: start of a capture file
+CAPTURE_MAGIC = b"TSTKCAP1"
+#: the magic and the length of the valid part of the file
+CAPTURE_HEADER = struct.Struct('<8sQ')
+
+#: start of a capture index
+INDEX_MAGIC = b"TSTKIDX2"
+#: the magic, the end of the capture that is indexed, the frames between
+#: two entries of the time index, the number of entries of the time
+#: index and the number of offsets of the message id index.  The arrays
+#: follow, then the rest of the index as JSON.
+INDEX_HEADER = struct.Struct('<8sQQQQ')
+
+_pack_record = TRAFFIC_RECORD.pack_into
+_pack_end = struct.Struct('<Q').pack_into
+_unpack_time = struct.Struct('<Q').unpack_from
+_END_OFFSET = len(CAPTURE_MAGIC)
+
+
+class CaptureException(Exception):
+    """Base class for capture exceptions"""
+    pass
+
+
+def _close_map(a_map):
+    """Close a memory map, or leave it to be unmapped by the views of
+    it that are still referenced, when they are gone."""
+    try:
+        a_map.close()
+    except BufferError:
+        pass
+
+
+def _lock(capture_file, path):
+    """Lock a capture file for its writer.
+
+    :raises: CaptureException if another writer has it.
+    """
+    try:
+        fcntl.flock(capture_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        capture_file.close()
+        raise CaptureException("{0} is written by another process"
+                               .format(path))
+
+
+def index_path(path):
+    """The path of the index of a capture."""
+    return path + '.index'
+
+
+def _index_key(message_id):
+    """The message id as it is kept in the index: numbers and strings
+    as they are, other ids as their string."""
+    if isinstance(message_id, (int, str)):
+        return message_id
+    return str(message_id)
+
+
+class CaptureIndex(object):
+    """ The index of a capture while it is built.
+
+    :param stride: the frames between two entries of the time index.
+    :type stride: int
+    """
+    def __init__(self, stride=64):
+        self.stride = stride
+        #: the number of frames
+        self.count = 0
+        #: the end of the indexed frames in the capture
+        self.end = CAPTURE_HEADER.size
+        #: the time and the offset of every stride-th frame
+        self.times = array.array('Q')
+        self.offsets = array.array('Q')
+        #: the offsets of the frames by message id
+        self.ids = {}
+        #: the time of the last frame
+        self.last_time = 0
+        #: whether the times of the frames never decrease.  A capture
+        #: that is continued after a reboot or clock step is not.
+        self.ordered = True
+
+    def add(self, time_ns, offset, end, message_id=None):
+        """Index a frame.
+
+        :param time_ns: the time of the frame.
+        :param offset: the offset of the frame in the capture.
+        :param end: the end of the frame in the capture.
+        :param message_id: the message id of the frame, None if it has
+                           none.
+        """
+        if self.count % self.stride == 0:
+            self.times.append(time_ns)
+            self.offsets.append(offset)
+        if time_ns < self.last_time:
+            self.ordered = False
+        self.last_time = time_ns
+        self.count += 1
+        self.end = end
+        if message_id is not None:
+            message_id = _index_key(message_id)
+            offsets = self.ids.get(message_id)
+            if offsets is None:
+                offsets = self.ids[message_id] = array.array('Q')
+            offsets.append(offset)
+
+    def write(self, path):
+        """Write the index next to the capture, replacing the old one.
+
+        :param path: the capture file.
+        """
+        directory = []
+        id_offsets = array.array('Q')
+        for message_id, offsets in self.ids.items():
+            directory.append((message_id, len(id_offsets), len(offsets)))
+            id_offsets.extend(offsets)
+        temporary = index_path(path) + '.new'
+        with open(temporary, 'wb') as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, self.end,
+                                               self.stride, len(self.times),
+                                               len(id_offsets)))
+            for values in (self.times, self.offsets, id_offsets):
+                if sys.byteorder == 'big':
+                    values = array.array('Q', values)
+                    values.byteswap()
+                index_file.write(values.tobytes())
+            index_file.write(json.dumps(
+                    {'count':self.count, 'last_time':self.last_time,
+                     'ordered':self.ordered, 'ids':directory}).encode())
+        os.replace(temporary, index_path(path))
+
+    @classmethod
+    def load(cls, path):
+        """Read the index of a capture to add to it.
+
+        :param path: the capture file.
+        :returns: the index, None if there is no index.
+        """
+        try:
+            with open(index_path(path), 'rb') as index_file:
+                data = index_file.read()
+        except FileNotFoundError:
+            return None
+        index = _IndexView(data)
+        loaded = cls(index.stride)
+        loaded.count = index.count
+        loaded.end = index.end
+        loaded.last_time = index.last_time
+        loaded.ordered = index.ordered
+        loaded.times = array.array('Q', index.times)
+        loaded.offsets = array.array('Q', index.offsets)
+        for message_id, (start, count) in index.directory.items():
+            loaded.ids[message_id] = array.array(
+                    'Q', index.id_offsets[start:start + count])
+        index.release()
+        return loaded
+
+
+class _IndexView(object):
+    """ The arrays of an index file, without copying them.
+
+    :param data: the index file, bytes or a memory map.
+    :raises: CaptureException if it is not an index.
+    """
+    def __init__(self, data):
+        view = memoryview(data)
+        if len(view) < INDEX_HEADER.size:
+            raise CaptureException("Not a capture index")
+        magic, self.end, self.stride, count, id_count = (
+                INDEX_HEADER.unpack_from(view))
+        # The arrays are little endian, as the capture.
+        if magic != INDEX_MAGIC or sys.byteorder == 'big':
+            raise CaptureException("Not a capture index")
+        start = INDEX_HEADER.size
+        arrays = []
+        for length in (count, count, id_count):
+            arrays.append(view[start:start + 8 * length].cast('Q'))
+            start += 8 * length
+        self.times, self.offsets, self.id_offsets = arrays
+        try:
+            rest = json.loads(bytes(view[start:]))
+            self.count = rest['count']
+            self.last_time = rest['last_time']
+            self.ordered = rest['ordered']
+            #: the start and the number of the offsets of each message
+            #: id in id_offsets
+            self.directory = {message_id:(first, number) for
+                              message_id, first, number in rest['ids']}
+        except (ValueError, KeyError, TypeError) as err:
+            for a_view in arrays + [view]:
+                a_view.release()
+            raise CaptureException("Not a capture index") from err
+        self._views = arrays + [view]
+
+    def release(self):
+        """Release the views of the data."""
+        for view in self._views:
+            view.release()
+
+
+class CaptureWriter(object):
+    """ Appends frames to a memory mapped capture file.
+
+    The file grows in steps of ``chunk_size`` bytes and is cut to the
+    frames that were written when it is closed.  The header holds the
+    end of the frames, so the file can be read while it is written.
+
+    The writer locks the file, there is only one writer at a time.  A
+    new capture replaces the file of an older one instead of cutting it,
+    as readers may still have it mapped.
+
+    :param path: the capture file.
+    :type path: string
+    :param append: add to an existing capture instead of replacing it.
+                   The monotonic times of another run do not continue
+                   those of the frames before.
+    :type append: bool
+    :param chunk_size: the bytes the file grows at a time.
+    :type chunk_size: int
+    :param stride: the frames between two entries of the time index.
+    :type stride: int
+    :raises: CaptureException if the file is not a capture, or another
+             writer has it.
+    """
+    def __init__(self, path, append=False, chunk_size=1 << 20, stride=64):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b')
+        _lock(self._file, path)
+        exists = os.fstat(self._file.fileno()).st_size > 0
+        if exists and not append:
+            temporary = path + '.new'
+            new_file = open(temporary, 'w+b')
+            _lock(new_file, path)
+            os.replace(temporary, path)
+            self._file.close()
+            self._file = new_file
+            exists = False
+        if exists:
+            magic, self.end = CAPTURE_HEADER.unpack(
+                    self._file.read(CAPTURE_HEADER.size))
+            if magic != CAPTURE_MAGIC:
+                self._file.close()
+                raise CaptureException("{0} is not a capture".format(path))
+        else:
+            self.end = CAPTURE_HEADER.size
+        #: the index of the frames
+        self.index = CaptureIndex.load(path) if exists else None
+        if self.index is None or self.index.end != self.end:
+            self.index = CaptureIndex(stride)
+            if exists:
+                _scan(self._file, self.end, self.index)
+        size = max(os.fstat(self._file.fileno()).st_size, self.end)
+        size = -(-(size + 1) // chunk_size) * chunk_size
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        CAPTURE_HEADER.pack_into(self._map, 0, CAPTURE_MAGIC, self.end)
+
+    def record(self, direction, connection_id, data, message_id=None):
+        """Append a frame.
+
+        :param direction: RECEIVED or SENT.
+        :param connection_id: the connection of the frame.
+        :type connection_id: int
+        :param data: the frame.
+        :param message_id: the message id of the frame for the index,
+                           None if it has none.
+        """
+        length = len(data)
+        offset = self.end
+        start = offset + TRAFFIC_RECORD.size
+        end = start + length
+        capture_map = self._map
+        if end > len(capture_map):
+            capture_map.resize(-(-end // self.chunk_size) * self.chunk_size)
+        time_ns = time.monotonic_ns()
+        _pack_record(capture_map, offset, time_ns, connection_id,
+                     direction, length)
+        capture_map[start:end] = data
+        self.end = end
+        _pack_end(capture_map, _END_OFFSET, end)
+        self.index.add(time_ns, offset, end, message_id)
+
+    def flush(self):
+        """Write the frames and the index to disk."""
+        self._map.flush()
+        self.index.write(self.path)
+
+    def close(self):
+        """Cut the file to the frames and close it."""
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.truncate(self.end)
+        self._file.close()
+        self.index.write(self.path)
+
+
+def _scan(capture_file, end, index, message_id=None):
+    """Index the frames of a capture file up to end.
+
+    :param message_id: function that returns the message id of the
+                       data of a frame, or None.
+    """
+    with mmap.mmap(capture_file.fileno(), 0,
+                   access=mmap.ACCESS_READ) as capture_map:
+        view = memoryview(capture_map)
+        offset = CAPTURE_HEADER.size
+        size = TRAFFIC_RECORD.size
+        try:
+            while offset + size <= end:
+                time_ns, unused, unused, length = (
+                        TRAFFIC_RECORD.unpack_from(view, offset))
+                start = offset + size
+                frame_id = None
+                if message_id is not None:
+                    data = view[start:start + length]
+                    frame_id = message_id(data)
+                    data.release()
+                index.add(time_ns, offset, start + length, frame_id)
+                offset = start + length
+        finally:
+            view.release()
+
+
+class CaptureReader(object):
+    """ Reads a capture file, also while it is written.
+
+    The capture and its index are memory mapped; the frames are read
+    when they are asked for.  The index is only used when it is up to
+    date with the capture.
+
+    :param path: the capture file.
+    :type path: string
+    :raises: CaptureException if it is not a capture.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as capture_file:
+            if os.fstat(capture_file.fileno()).st_size < CAPTURE_HEADER.size:
+                raise CaptureException("{0} is not a capture".format(path))
+            self._map = mmap.mmap(capture_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        self._index_map = None
+        #: the index, None if there is no index that is up to date
+        self.index = None
+        magic, unused = CAPTURE_HEADER.unpack_from(self._map)
+        if magic != CAPTURE_MAGIC:
+            self.close()
+            raise CaptureException("{0} is not a capture".format(path))
+        self._view = memoryview(self._map)
+        self._open_index()
+
+    def _open_index(self):
+        """Map the index, if it is up to date."""
+        try:
+            with open(index_path(self.path), 'rb') as index_file:
+                index_map = mmap.mmap(index_file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+        try:
+            index = _IndexView(index_map)
+        except CaptureException:
+            _close_map(index_map)
+            return
+        if index.end != self.end:
+            index.release()
+            _close_map(index_map)
+            return
+        self.index = index
+        self._index_map = index_map
+
+    @property
+    def end(self):
+        """The end of the frames that were written when the capture was
+        opened."""
+        return min(CAPTURE_HEADER.unpack_from(self._map)[1], len(self._map))
+
+    def build_index(self, message_id=None, stride=64):
+        """Index the capture and write the index next to it.
+
+        :param message_id: function that is called with the data of
+                           each frame and returns its message id, or
+                           None.  Without it only the time is indexed.
+        :param stride: the frames between two entries of the time index.
+        """
+        self._close_index()
+        index = CaptureIndex(stride)
+        with open(self.path, 'rb') as capture_file:
+            _scan(capture_file, self.end, index, message_id)
+        index.write(self.path)
+        self._open_index()
+
+    def message_ids(self):
+        """The message ids in the index, with their number of frames.
+
+        :returns: a dict of message id to number of frames.  Ids that
+                  are not numbers or strings are kept as strings.
+        """
+        self._require_index()
+        return {message_id:count for message_id, (unused, count)
+                in self.index.directory.items()}
+
+    def frames(self, direction=None, start=None, end=None,
+               message_id=None):
+        """The frames of the capture, in the order they were written.
+
+        With the index only the frames that are asked for are read.
+        The times are those of :func:`time.monotonic_ns` when the frame
+        was captured, see :attr:`first_time`.  When the times go back
+        in a capture that was continued, or there is no index, the
+        frames between the times are looked for in the whole capture.
+
+        :param direction: RECEIVED or SENT, None for both.
+        :param start: no frames before this time in ns.
+        :param end: no frames at or after this time in ns.
+        :param message_id: only the frames with this message id, needs
+                           the index.
+        :raises: CaptureException for a message id without an index.
+        :returns: a generator of ``(time_ns, connection_id, direction,
+                  data)`` tuples.  The data is a memoryview of the file,
+                  it keeps the file mapped while it is referenced, also
+                  after the reader is closed.
+        """
+        # The times can only be searched when they never decrease.
+        ordered = self.index is not None and self.index.ordered
+        if message_id is not None:
+            self._require_index()
+            offsets = self._id_offsets(message_id)
+        elif start is not None and ordered:
+            offsets = None
+            position = bisect.bisect_right(self.index.times, start) - 1
+            first = (self.index.offsets[position] if position >= 0
+                     else CAPTURE_HEADER.size)
+        else:
+            offsets = None
+            first = CAPTURE_HEADER.size
+        if offsets is not None:
+            if start is not None and ordered:
+                offsets = offsets[self._first_at(offsets, start):]
+            frames = (self._frame(offset)[0] for offset in offsets)
+        else:
+            frames = self._scan_frames(first)
+        for frame in frames:
+            if start is not None and frame[0] < start:
+                continue
+            if end is not None and frame[0] >= end:
+                if ordered:
+                    return
+                continue
+            if direction is None or frame[2] == direction:
+                yield frame
+
+    @property
+    def first_time(self):
+        """The time of the first frame in ns, None if there are none."""
+        if self.end < CAPTURE_HEADER.size + TRAFFIC_RECORD.size:
+            return None
+        return self._time_at(CAPTURE_HEADER.size)
+
+    def _require_index(self):
+        if self.index is None:
+            raise CaptureException("{0} has no index that is up to date"
+                                   .format(self.path))
+
+    def _id_offsets(self, message_id):
+        """The offsets of the frames of a message id."""
+        entry = self.index.directory.get(_index_key(message_id))
+        if entry is None:
+            return self.index.id_offsets[0:0]
+        return self.index.id_offsets[entry[0]:entry[0] + entry[1]]
+
+    def _first_at(self, offsets, start):
+        """The position of the first of the offsets of frames, in order
+        of time, with a time at or after start."""
+        low = 0
+        high = len(offsets)
+        while low < high:
+            middle = (low + high) // 2
+            if self._time_at(offsets[middle]) < start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _time_at(self, offset):
+        return _unpack_time(self._view, offset)[0]
+
+    def _frame(self, offset):
+        """The frame at an offset and the offset of the next frame."""
+        time_ns, connection_id, direction, length = (
+                TRAFFIC_RECORD.unpack_from(self._view, offset))
+        start = offset + TRAFFIC_RECORD.size
+        return ((time_ns, connection_id, direction,
+                 self._view[start:start + length]), start + length)
+
+    def _scan_frames(self, offset):
+        """The frames from an offset to the end."""
+        # Only the frames that were written when the reader was opened.
+        end = self.end
+        size = TRAFFIC_RECORD.size
+        while offset + size <= end:
+            frame, offset = self._frame(offset)
+            yield frame
+
+    def __iter__(self):
+        return self.frames()
+
+    def _close_index(self):
+        if self.index is not None:
+            self.index.release()
+            _close_map(self._index_map)
+            self.index = None
+            self._index_map = None
+
+    def close(self):
+        """Close the file.
+
+        The memoryviews of the frames that are still referenced, for
+        instance the last one of a loop over :meth:`frames` in a
+        ``with`` block, keep the file mapped until they are released or
+        collected.
+        """
+        self._close_index()
+        if getattr(self, '_view', None) is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            _close_map(self._map)
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *unused):
+        self.close()
+
+
+class Replay(object):
+    """ Plays the frames of a capture again.
+
+    :param reader: the capture.
+    :type reader: CaptureReader
+    :param send: function that is called with the connection id and the
+                 data of each frame.
+    :param speed: how many times faster than captured, 0 or None for as
+                  fast as possible.
+    :type speed: float
+    :param direction: the frames to play, RECEIVED for the frames from
+                      the system, SENT for those to the system.
+    """
+    def __init__(self, reader, send, speed=1.0, direction=RECEIVED):
+        self.reader = reader
+        self.send = send
+        self.speed = speed
+        self.direction = direction
+        #: the number of frames that were played
+        self.count = 0
+        # frames of the steps that are not executed yet
+        self._pending = collections.deque()
+
+    def schedule(self):
+        """The frames with the time to play them.
+
+        :returns: a generator of ``(offset_ns, connection_id, data)``
+                  tuples, the offset from the first frame.
+        """
+        first = None
+        for time_ns, connection_id, unused, data in self.reader.frames(
+                self.direction):
+            if first is None:
+                first = time_ns
+            if self.speed:
+                offset = int((time_ns - first) / self.speed)
+            else:
+                offset = 0
+            yield (offset, connection_id, data)
+
+    def run(self, wait=None, go_on=None):
+        """Play all frames, waiting in between.
+
+        :param wait: function that is called with the time to wait in
+                     milliseconds, for instance the poll method of the
+                     dispatcher; the default sleeps.  It may return
+                     early.
+        :param go_on: function that is called before each frame and
+                      after each wait; the replay stops when it returns
+                      False.  None to play all frames.
+        :returns: the number of frames played.
+        """
+        if wait is None:
+            wait = lambda timeout: time.sleep(timeout / 1000.0)
+        start = time.monotonic_ns()
+        for offset, connection_id, data in self.schedule():
+            if go_on is not None and not go_on():
+                break
+            remaining = start + offset - time.monotonic_ns()
+            while remaining > 0:
+                wait(-(-remaining // 1000000))
+                if go_on is not None and not go_on():
+                    return self.count
+                remaining = start + offset - time.monotonic_ns()
+            self.send(connection_id, data)
+            self.count += 1
+        return self.count
+
+    def steps(self):
+        """The frames as steps for the scenario player, see
+        :meth:`scenarioplayer.ScenarioPlayer.add_steps`.
+
+        Each step plays one frame, at its time after the steps are
+        added.  The player takes the steps one at a time, and the frame
+        of a step is read from the capture when the step is taken, so
+        the reader must stay open until the last step is executed.
+
+        :returns: a generator of ``(when, step)`` pairs.
+        """
+        for offset, connection_id, data in self.schedule():
+            self._pending.append((connection_id, bytes(data)))
+            yield (offset / 1e9, self.play_next)
+
+    def play_next(self):
+        """Play the frame of the next step."""
+        connection_id, data = self._pending.popleft()
+        self.send(connection_id, data)
+        self.count += 1
@@ -1,11 +1,12 @@
 import daemon
 import dispatcher
+import hub
 
 
 class TCPConnectionFactory(object):
     
     def get_daemon(self, dispatcher, name, simulator_id):
-        return daemon.TCPDaemon(get_dispatcher(name, simulator_id), name, 
+        return daemon.TCPDaemon(dispatcher, name, 
                                 simulator_id)
     
     def get_dispatcher(self, name, simulator_id):
@@ -13,8 +14,8 @@ class TCPConnectionFactory(object):
 
 class SerialConnectionFactory(object):
 
-    def get_daemon(self, dispatcher, name, connection_id):
-        return daemon.SerialDaemon(get_dispatcher(name, simulator_id), name, 
+    def get_daemon(self, dispatcher, name, simulator_id):
+        return daemon.SerialDaemon(dispatcher, name, 
                                    simulator_id)
     
     def get_dispatcher(self, name, simulator_id):
@@ -22,8 +23,8 @@ class SerialConnectionFactory(object):
 
 class UDPConnectionFactory(object):
 
-    def get_daemon(self, dispatcher, name, connection_id):
-        return daemon.UDPDaemon(get_dispatcher(name, simulator_id), name, 
+    def get_daemon(self, dispatcher, name, simulator_id):
+        return daemon.UDPDaemon(dispatcher, name, 
                                 simulator_id)
     
     def get_dispatcher(self, name, simulator_id):
@@ -31,8 +32,8 @@ class UDPConnectionFactory(object):
 
 class SoapConnectionFactory(object):
 
-    def get_daemon(self, dispatcher, name, connection_id):
-        return daemon.SoapDaemon(get_dispatcher(name, simulator_id), name, 
+    def get_daemon(self, dispatcher, name, simulator_id):
+        return daemon.SoapDaemon(dispatcher, name, 
                                 simulator_id)
     
     def get_dispatcher(self, name, simulator_id):
@@ -40,13 +41,21 @@ class SoapConnectionFactory(object):
 
 class HttpConnectionFactory(object):
 
-    def get_daemon(self, dispatcher, name, connection_id):
-        return daemon.HttpDaemon(get_dispatcher(name, simulator_id), name, 
+    def get_daemon(self, dispatcher, name, simulator_id):
+        return daemon.HttpDaemon(dispatcher, name, 
                                 simulator_id)
     
     def get_dispatcher(self, name, simulator_id):
         return dispatcher.HttpDispatcher(name, simulator_id)
 
+class HubConnectionFactory(object):
+
+    def get_daemon(self, dispatcher, name, simulator_id):
+        return daemon.HubDaemon(dispatcher, name, simulator_id)
+    
+    def get_dispatcher(self, name, simulator_id):
+        return hub.Hub(name, simulator_id)
+
 class ConnectionFactory(object):
     """ This connection factory will return the Dispatcher and Daemon
     of the requested type. This is the class to use if you want to 
@@ -57,7 +66,8 @@ class ConnectionFactory(object):
     connection_types = {"tcp":TCPConnectionFactory(),
                         "udp":UDPConnectionFactory(),
                         "serial":SerialConnectionFactory(),
-                        "http":HttpConnectionFactory()}
+                        "http":HttpConnectionFactory(),
+                        "hub":HubConnectionFactory()}
 
     def get_connection(self, connection_type):
         # return the correct connection type and get the daemon and dispatcher
@@ -7,6 +7,8 @@ class TISDaemon(Daemon):
     """Baseclass for all TIS daemons
     Contains the default parameter and logging handling.
     """
+    #: seconds start() waits for the dispatcher to create its sockets
+    ready_timeout = 30.0
 
     def __init__(self, dispatcher, name, daemon_id):
         errorlogfile = '/{0}_{1}.err'.format(name, daemon_id)
@@ -64,7 +66,7 @@ class TCPDaemon(TISDaemon):
         # Start simulator
         self.logger.info('Starting TCP simulator')
         # All the actual work is done by the dispatcher.
-        self.dispatcher.run(self.daemon_id)
+        self.dispatcher.run(self.notify_ready)
 
 class SerialDaemon(TISDaemon):
     """Class to turn Serial simulator into a server that runs in the
@@ -81,7 +83,7 @@ class SerialDaemon(TISDaemon):
         # Start simulator
         self.logger.info('Starting Serial simulator')
         # All the actual work is done by the dispatcher.
-        self.dispatcher.run(self.daemon_id)
+        self.dispatcher.run(self.notify_ready)
 
 class UDPDaemon(TISDaemon):
     """Class to turn UDP simulator into a server that runs in the
@@ -98,7 +100,7 @@ class UDPDaemon(TISDaemon):
         # Start simulator
         self.logger.info('Starting UDP simulator')
         # All the actual work is done by the dispatcher.
-        self.dispatcher.run(self.daemon_id)
+        self.dispatcher.run(self.notify_ready)
 
 class HttpDaemon(TISDaemon):
     """Class to turn Http simulator into a server that runs in the
@@ -115,11 +117,21 @@ class HttpDaemon(TISDaemon):
         # Start simulator
         self.logger.info('Starting Http simulator')
         # All the actual work is done by the dispatcher.
-        self.dispatcher.run(self.daemon_id)
-
-
-
-
-
+        self.dispatcher.run(self.notify_ready)
 
+class HubDaemon(TISDaemon):
+    """Class to turn a hub of simulators into a server that runs in the
+    background.
+    """
+    def __init__(self, daemon, name, daemon_id):
+        TISDaemon.__init__(self, daemon, name, daemon_id)
 
+    def run(self):
+        """Start the hub
+        """
+        # If we run, we want logging...
+        self.setup_logging()
+        # Start simulators
+        self.logger.info('Starting hub of simulators')
+        # All the actual work is done by the dispatchers of the hub.
+        self.dispatcher.run(self.notify_ready)
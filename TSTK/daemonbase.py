@@ -2,14 +2,93 @@
 From www.jejik.com/articles/2007/02/a_simple_unix_linux_daemon_in_python/
 License: Public Domain
 """
-import sys, os, time, atexit
-from signal import SIGTERM, SIGHUP
+import sys, os, time, atexit, select, socket
+from signal import SIGTERM, SIGKILL
+
+
+def read_pid(pidfile):
+    """The process ID in a pidfile, or None."""
+    try:
+        with open(pidfile, 'r') as pidf:
+            return int(pidf.read().strip())
+    except (IOError, ValueError):
+        return None
+
+
+def is_running(pid):
+    """Whether a process exists and has not exited; a zombie that its
+    parent has not waited for yet has exited.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open('/proc/%d/stat' % pid, 'r') as stat:
+            # The state follows the name, which is in parentheses.
+            return stat.read().rpartition(')')[2].split()[0] != 'Z'
+    except (IOError, IndexError):
+        return True
+
+
+def wait_for_exit(pid, timeout, first_delay=0.001, max_delay=0.05):
+    """Wait until a process has exited, checking with an exponential
+    backoff from first_delay up to max_delay seconds.
+
+    :returns: True when it exited, False when the timeout passed.
+    """
+    deadline = time.monotonic() + timeout
+    delay = first_delay
+    while is_running(pid):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+    return True
+
+
+def wait_ready(ready_fd, timeout):
+    """Wait until a daemon reports that it is ready, see
+    :meth:`Daemon.notify_ready`, and close the pipe.
+
+    :param ready_fd: the read end of the pipe of the daemon.
+    :returns: True when it is ready, False when it exited or the
+              timeout passed.
+    """
+    deadline = time.monotonic() + timeout
+    data = b""
+    try:
+        while not data.endswith(b"\n"):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, unused, unused = select.select([ready_fd], [], [],
+                                                     remaining)
+            if readable:
+                chunk = os.read(ready_fd, 64)
+                if not chunk:
+                    # Exited without a word.
+                    return False
+                data += chunk
+    finally:
+        os.close(ready_fd)
+    return data == b"READY=1\n"
+
 
 class Daemon( object ):
     """A generic daemon class.
 
     Usage: subclass the Daemon class and override the run() method.
     """
+    #: seconds stop() waits for the daemon to exit after SIGTERM before
+    #: it kills the daemon
+    stop_timeout = 5.0
+    #: seconds start() waits for the daemon to call notify_ready(), None
+    #: to return as soon as the daemon is forked
+    ready_timeout = None
 
     def __init__(self, pidfile, stdin='/dev/null', stdout='/dev/null',
             stderr='/dev/null'):
@@ -17,6 +96,8 @@ class Daemon( object ):
         self.stdout = stdout
         self.stderr = stderr
         self.pidfile = pidfile
+        #: write end of the pipe to the process that started the daemon
+        self.ready_fd = None
 
 
     def daemonize(self):
@@ -24,15 +105,26 @@ class Daemon( object ):
         Programming in the Unix Environment" for details.
         http://www.erlenstar.demon.co.uk/unix/faq_2.html#SEC16
         """
+        if self.ready_timeout is not None:
+            ready_read, self.ready_fd = os.pipe()
         try:
             pid = os.fork()
             if pid > 0:
-                # Exit first parent.
-                sys.exit(0)
+                # Exit first parent, once the daemon is ready.
+                if self.ready_fd is None:
+                    sys.exit(0)
+                os.close(self.ready_fd)
+                if wait_ready(ready_read, self.ready_timeout):
+                    sys.exit(0)
+                sys.stderr.write("Daemon not ready in %.1f s\n"
+                                 % self.ready_timeout)
+                sys.exit(1)
         except OSError as err:
             sys.stderr.write("fork #1 failed: %d (%s)\n" % (err.errno,
                 err.strerror))
             sys.exit(1)
+        if self.ready_fd is not None:
+            os.close(ready_read)
 
         # decouple from parent environment
         os.chdir("/")
@@ -53,9 +145,9 @@ class Daemon( object ):
         # redirect standard file descriptors
         sys.stdout.flush()
         sys.stderr.flush()
-        sin = file(self.stdin, 'r')
-        sout = file(self.stdout, 'a+')
-        serr = file(self.stderr, 'a+', 0)
+        sin = open(self.stdin, 'r')
+        sout = open(self.stdout, 'a+')
+        serr = open(self.stderr, 'a+')
         os.dup2(sin.fileno(), sys.stdin.fileno())
         os.dup2(sout.fileno(), sys.stdout.fileno())
         os.dup2(serr.fileno(), sys.stderr.fileno())
@@ -63,26 +155,41 @@ class Daemon( object ):
         # write pidfile
         atexit.register(self.delpid)
         pid = str(os.getpid())
-        file(self.pidfile,'w+').write("%s\n" % pid)
+        with open(self.pidfile, 'w+') as pidf:
+            pidf.write("%s\n" % pid)
+
+    def notify_ready(self):
+        """Report that the daemon is ready: start() returns, or systemd
+        continues when the daemon runs in the foreground with
+        ``Type=notify``.
+        """
+        if self.ready_fd is not None:
+            os.write(self.ready_fd, b"READY=1\n")
+            os.close(self.ready_fd)
+            self.ready_fd = None
+        address = os.environ.get('NOTIFY_SOCKET')
+        if address:
+            if address.startswith('@'):
+                # Abstract namespace.
+                address = '\0' + address[1:]
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notify:
+                notify.sendto(b"READY=1", address)
 
     def delpid(self):
         """Remove file with process ID"""
-        os.remove(self.pidfile)
+        try:
+            os.remove(self.pidfile)
+        except FileNotFoundError:
+            # stop() removed it already.
+            pass
 
 
     def status(self):
-        pids = [pid for pid in os.listdir('/proc') if pid.isdigit()]
-
-        try:
-            pidf = file(self.pidfile, 'r')
-            pid = int(pidf.read().strip())
-            pidf.close()
-        except IOError:
-            pid = None
+        pid = read_pid(self.pidfile)
 
         message = "Daemon " + sys.argv[0]
         if pid:
-            if pid in pids:
+            if is_running(pid):
                 message += " is running\n"
                 sys.stderr.write(message)
                 sys.exit(0)
@@ -98,14 +205,12 @@ class Daemon( object ):
 
     def start(self):
         """Start the daemon
+
+        With a :attr:`ready_timeout` the starting process exits once the
+        daemon calls :meth:`notify_ready`, with status 1 if it does not.
         """
         # Check for a pidfile to see if the daemon already runs.
-        try:
-            pidf = file(self.pidfile, 'r')
-            pid = int(pidf.read().strip())
-            pidf.close()
-        except IOError:
-            pid = None
+        pid = read_pid(self.pidfile)
 
         if pid:
             message = "pidfile %s already exists. Daemon already running?\n"
@@ -116,17 +221,15 @@ class Daemon( object ):
         self.daemonize()
         self.run()
 
-    def stop(self, restart=False):
+    def stop(self, restart=False, timeout=None):
         """Stop the daemon
+
+        Sends SIGTERM once and waits for the daemon to exit, for at most
+        timeout seconds, :attr:`stop_timeout` by default. A daemon that
+        is still running then is killed.
         """
         # Get the pid from pidfile.
-        try:
-            pidf = file(self.pidfile, 'r')
-            pid = int(pidf.read().strip())
-            pidf.close()
-        except IOError:
-            pid = None
-
+        pid = read_pid(self.pidfile)
 
         if not pid:
             if not restart :
@@ -134,21 +237,25 @@ class Daemon( object ):
                 sys.stderr.write(message % self.pidfile)
             return # not an error in a restart
 
+        if timeout is None:
+            timeout = self.stop_timeout
         # Try killing the daemon process
         try:
-            while 1:
-                os.kill(pid, SIGHUP)
-                time.sleep(1)
-                os.kill(pid, SIGTERM)
-                time.sleep(1)
+            os.kill(pid, SIGTERM)
+            if not wait_for_exit(pid, timeout):
+                sys.stderr.write("Daemon %d did not stop in %.1f s, killing "
+                                 "it\n" % (pid, timeout))
+                os.kill(pid, SIGKILL)
+                wait_for_exit(pid, timeout)
+        except ProcessLookupError:
+            pass
         except OSError as err:
-            err = str(err)
-            if err.find("No such process") > 0:
-                if os.path.exists(self.pidfile):
-                    os.remove(self.pidfile)
-            else:
-                print((str(err)))
-                sys.exit(1)
+            print((str(err)))
+            sys.exit(1)
+        try:
+            os.remove(self.pidfile)
+        except FileNotFoundError:
+            pass
 
 
     def restart(self):
@@ -1,131 +1,873 @@
+import collections
 import logging
 import signal
 import socket
 import configparser
-import importlib.machinery
+import importlib.util
 import serial
-import copy
+import itertools
+import select
+import threading
+import time
 
 import zmq
 
+from scenarioplayer import poll_key, POLLIN, NANOSECONDS
+from framing import (StreamBuffer, StreamFramer, configure_framer,
+                     FramingException)
+from serializer import (get_serializer, unpack_connection_id,
+                        pack_connection_id, simulator_topic, message_topic,
+                        SerializerException, BROADCAST, CONTROL)
+from responsetable import ResponseTable
+from endpoints import EndpointRegistry, bind_address
+from httpparser import RequestParser, HttpResponse, HttpException
+from logpipeline import (get_pipeline, HexDump, TrafficLog, TRAFFIC, ALIVE,
+                         RECEIVED, SENT)
+from capture import CaptureWriter, CaptureReader, Replay
+
+POLLOUT = int(zmq.POLLOUT)
+
+class DispatcherException(Exception):
+    """Base class for dispatcher exceptions"""
+    pass
+
+
 class Dispatcher(object):
     """ Superclass for all Dispatchers.
     This is the part of the simulator that handles the connections.
     """
+    #: signals that stop :meth:`run` gracefully
+    stop_signals = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+    #: time in ms to deliver the queued messages to the player when the
+    #: dispatcher stops
+    stop_linger = 100
+    #: bytes that may wait for a connection that does not read, before
+    #: it is closed
+    max_output = 4194304
+
     def __init__(self, dispatcher_type, dispatcher_id):
-        self.name = name
+        self.name = dispatcher_type
         self.dispatcher_id = dispatcher_id
         self.call_backs = {}
+        # call backs for writable sockets by poll key, see
+        # watch_writable()
+        self.write_call_backs = {}
+        # Counts the polls and the changes of call_backs, each entry
+        # holds the generation in which it was added.
+        self._generations = itertools.count()
         self.go_on = True
+        #: poll timeout in ms
+        self.timeout = 60000
+        self.poller = zmq.Poller()
+        #: instance of the message class of the system, None if the
+        #: data is forwarded as is
+        self.message = None
+        #: serializer for the links to the scenario player
+        self.serializer = get_serializer("pickle")
+        #: sockets of the connections with the system by connection id
+        self.connections = {}
+        #: connection ids by socket
+        self.connection_ids = {}
+        self._connection_counter = itertools.count(BROADCAST + 1)
+        #: cuts the data of the system into messages
+        self.framer = StreamFramer()
+        #: receive buffers by connection id
+        self.buffers = {}
+        #: data that waits until a connection can take it, by
+        #: connection id
+        self.output = {}
+        # connections to close once their output is sent
+        self._closing = set()
+        #: responses to send without the player
+        self.responses = ResponseTable()
+        #: name of the simulator, in topics and the endpoint registry
+        self.simulator_name = '{0}-{1}'.format(dispatcher_type,
+                                               dispatcher_id)
+        #: topic frame of the messages on the links with the player
+        self.topic = simulator_topic(self.simulator_name)
+        #: ports of the links with the player, None for free ports
+        self.command_listen_port = None
+        self.message_forward_port = None
+        #: zmq endpoints to bind the links with the player to, instead
+        #: of the ports
+        self.command_endpoint = None
+        self.message_endpoint = None
+        #: the command and message endpoints that were bound
+        self.endpoints = None
+        #: registry to announce the endpoints in, None to not announce
+        self.registry = None
+        self._announced = []
+        # topic frames by message id
+        self._topics = {}
+        #: the hub this dispatcher runs in, None if it runs on its own
+        self.hub = None
 
         logger = logging.getLogger('{0}_simulator'
                                         .format(dispatcher_type))
         logger.setLevel(logging.INFO)
-        logfile = '/tmp/test.log'
-        filehandler = logging.FileHandler(logfile)
-        filehandler.setLevel(logging.INFO)
-        formatter = logging.Formatter(
-                '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        filehandler.setFormatter(formatter)
-        logger.addHandler(filehandler)
+        # Dispatchers of the same type in a hub share the logger.
+        if not logger.handlers:
+            logfile = '/tmp/test.log'
+            filehandler = logging.FileHandler(logfile)
+            filehandler.setLevel(logging.INFO)
+            formatter = logging.Formatter(
+                    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            filehandler.setFormatter(formatter)
+            # The file is written on a thread of its own.
+            get_pipeline(logger, filehandler)
         self.logger = logger
+        #: the records of each pass of the loop, at most one a minute
+        self.log_limits = {'alive':{'rate':1 / 60.0, 'burst':1}}
+        self._apply_log_limits()
+        #: binary log or capture of the frames, None for no log
+        self.traffic_log = None
+        #: the capture to write when the dispatcher runs, and whether
+        #: to add to it
+        self.capture_path = None
+        self.capture_append = False
+        #: the traffic log to write when the dispatcher runs
+        self.traffic_log_path = None
+        #: capture to replay when the dispatcher runs, and its speed
+        self.replay_path = None
+        self.replay_speed = 1.0
         
         self.context = zmq.Context(1)
+        # write end of the socket pair that wakes up the poll on a
+        # signal
+        self._wakeup = None
+
+    # The unused parameters are signal and frame.
+    # pylint: disable=W0613
+    def control_c_handler(self, unused1, unused2):
+        """Controlled shutdown so we can cleanup.
+
+        Handles the :attr:`stop_signals`: :meth:`run` stops after the
+        current poll, which the signal ends right away.
 
-    def control_c_handler():
-        """Controlled shutdown so we can cleanup."""
+        :param unused1: signal, but is not used.
+        :param unused2: frame, but is not used.
+        """
         self.go_on = False
-        return False
 
-    def create_sockets(self, accept_socket):
+    def install_signal_handlers(self):
+        """Stop on the :attr:`stop_signals`, see
+        :meth:`control_c_handler`.
+
+        Python runs the handler in the main thread, between two calls
+        into C, so the poll would only see it when it times out.  The
+        signal is also written to a socket pair in the poller, which
+        ends the poll.  Only possible in the main thread.
+        """
+        wakeup_socket, self._wakeup = socket.socketpair()
+        wakeup_socket.setblocking(False)
+        self._wakeup.setblocking(False)
+        self.register(wakeup_socket, self.drain_wakeup)
+        signal.set_wakeup_fd(self._wakeup.fileno(),
+                             warn_on_full_buffer=False)
+        for signal_number in self.stop_signals:
+            signal.signal(signal_number, self.control_c_handler)
+
+    def drain_wakeup(self, a_socket):
+        """Read the signal numbers of the wake-up socket."""
+        try:
+            while a_socket.recv(64):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def close_sockets(self):
+        """Close the sockets of the system and the wake-up socket; the
+        zmq sockets are closed with the context.
+        """
+        for a_socket, unused, unused in list(self.call_backs.values()):
+            if not isinstance(a_socket, zmq.Socket):
+                self.unregister(a_socket)
+                if hasattr(a_socket, 'close'):
+                    a_socket.close()
+        if self._wakeup is not None:
+            signal.set_wakeup_fd(-1)
+            self._wakeup.close()
+            self._wakeup = None
+
+    def configure(self, entries):
+        """Read the settings that all dispatchers share.
+
+        :param entries: the section of the dispatcher in simulator.conf.
+        :type entries: configparser.SectionProxy
+        """
+        # path to the message class
+        message_path = entries.get('MessagePath')
+        if message_path is not None:
+            spec = importlib.util.spec_from_file_location('message',
+                                                          message_path)
+            message_module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(message_module)
+            self.message = message_module.Message()
+        # port to listen on for commands from the player, not needed in
+        # a hub.
+        self.command_listen_port = entries.get('CommandListenPort')
+        # port to forward messages to the player.
+        self.message_forward_port = entries.get('MessageForwardPort')
+        self.command_endpoint = entries.get('CommandEndpoint')
+        self.message_endpoint = entries.get('MessageEndpoint')
+        if 'EndpointRegistry' in entries:
+            # An empty value is the default registry.
+            self.registry = EndpointRegistry(entries['EndpointRegistry'])
+        if 'Topic' in entries:
+            self.simulator_name = entries['Topic']
+            self.topic = simulator_topic(self.simulator_name)
+        # Must be the same as the serializer of the simulator interface.
+        self.serializer = get_serializer(entries.get('Serializer', 'pickle'))
+        # LogRate.<category> and LogSample.<category>
+        for key, value in entries.items():
+            setting, dot, category = key.partition('.')
+            if dot and setting in ('lograte', 'logsample'):
+                limits = self.log_limits.setdefault(category, {})
+                if setting == 'lograte':
+                    limits['rate'] = float(value)
+                    limits.pop('burst', None)
+                else:
+                    limits['sample'] = int(value)
+        self._apply_log_limits()
+        # Opened when the dispatcher runs, see open_traffic_log().
+        # The capture wins over the traffic log.
+        self.capture_path = entries.get('Capture')
+        self.capture_append = entries.getboolean('CaptureAppend', False)
+        self.traffic_log_path = entries.get('TrafficLog')
+        self.replay_path = entries.get('Replay')
+        self.replay_speed = float(entries.get('ReplaySpeed', 1.0))
+        self.framer = configure_framer(entries, self.message)
+        self.max_output = int(entries.get('MaxOutput', self.max_output))
+
+    def open_traffic_log(self):
+        """Open the capture or the traffic log of the settings.
+
+        Called by :meth:`run`, in the process of the simulator.  The
+        commands that only build a dispatcher, ``stop`` and ``status``,
+        must not touch the files of the running simulator.
+
+        :raises: CaptureException if another process writes the capture.
+        """
+        if self.capture_path:
+            self.traffic_log = CaptureWriter(self.capture_path,
+                                             self.capture_append)
+        elif self.traffic_log_path:
+            self.traffic_log = TrafficLog(self.traffic_log_path)
+
+    def _apply_log_limits(self):
+        """Set the log_limits in the filter of the log pipeline."""
+        pipeline = get_pipeline(self.logger)
+        if pipeline is None:
+            return
+        for category, limits in self.log_limits.items():
+            pipeline.filter.limit(category, **limits)
+
+    def create_sockets(self, accept_socket, call_back_function=None):
+        """Create the links with the scenario player and watch the
+        socket of the system.
+
+        :param accept_socket: the socket the system connects to.
+        :param call_back_function: called when the socket of the system
+                                   is readable, the default is
+                                   :meth:`accept`.
+        """
+        # Add the sockets to the zmq poller and register the call backs.
+        self.accept_socket = accept_socket
+        self.register(accept_socket, call_back_function or self.accept)
+        self.create_player_links()
+
+    def create_player_links(self):
+        """Create the links with the scenario player.
+
+        In a hub the links of the hub are used.
+        """
+        if self.hub is not None:
+            # The hub receives the commands and passes them on by topic.
+            self.repeater_socket = self.hub.repeater_socket
+            return
         # Open a socket to listen for commands from the scenario player
-        address = "tcp://*:{0}".format(self.command_listen_port)
-        self.logger.info("Command subscription at {0}".format(address))
+        address = bind_address(self.command_endpoint,
+                               self.command_listen_port)
         command_socket  = self.context.socket(zmq.SUB)
         command_socket.bind(address)
-        command_socket.setsockopt(zmq.SUBSCRIBE, "")
-        
-        # Add the sockets to the zmq poller.
-        self.poller = zmq.Poller()
-        self.poller.register(accept_socket,  zmq.POLLIN)
-        self.poller.register(command_socket, zmq.POLLIN)
-
-        # Register the call backs.
-        self.call_backs[accept_socket.fileno()] = (accept_socket, self.accept)
-        self.call_backs[command_socket] = (command_socket, 
-                                           self.process_player_command)
+        command_socket.setsockopt(zmq.SUBSCRIBE, b"")
+        self.register(command_socket, self.process_player_command)
+        command_address = command_socket.getsockopt_string(
+                zmq.LAST_ENDPOINT)
+        self.logger.info("Command subscription at {0}"
+                         .format(command_address))
 
         # Not part of the poller
         # Message forwarding link to player
-        address = "tcp://*:{0}".format(self.message_forward_port)
-        self.logger.info("Publishing on " + address)
+        address = bind_address(self.message_endpoint,
+                               self.message_forward_port)
         self.repeater_socket = self.context.socket(zmq.PUB)
         self.repeater_socket.bind(address)
-    
+        message_address = self.repeater_socket.getsockopt_string(
+                zmq.LAST_ENDPOINT)
+        self.logger.info("Publishing on " + message_address)
+        self.endpoints = (command_address, message_address)
+        self.announce(self.simulator_name)
+
+    def announce(self, name):
+        """Announce the endpoints of the links with the player in the
+        registry, if there is one.
+
+        :param name: the name of the simulator.
+        """
+        if self.registry is not None:
+            self.registry.announce(name, *self.endpoints)
+            self._announced.append(name)
+
+    def withdraw(self):
+        """Remove the announced endpoints from the registry."""
+        for name in self._announced:
+            self.registry.withdraw(name)
+        self._announced = []
+
+    def use_context(self, context):
+        """Use another zmq context, before :meth:`create_sockets`.
+
+        With the context of the scenario player, the player can reach
+        the dispatcher over ``inproc://`` endpoints.
+
+        :param context: the zmq context.
+        """
+        # Nothing uses the own context yet.
+        self.context.term()
+        self.context = context
+
+    def join_hub(self, hub):
+        """Run in a hub: use its zmq context, poller and links with the
+        player.
+
+        Must be called before :meth:`create_sockets`.
+
+        :param hub: the hub.
+        :type hub: hub.Hub
+        """
+        self.hub = hub
+        self.use_context(hub.context)
+        self.poller = hub.poller
+        self.call_backs = hub.call_backs
+        self.write_call_backs = hub.write_call_backs
+        self._generations = hub._generations
+
     def accept(self, a_socket):
-        """Accept a connection from the system.
+        """Accept the pending connections from the system.
+
+        Every connection gets a new connection id.
+
+        :param a_socket: the listening socket, in non-blocking mode.
+        """
+        while True:
+            try:
+                system_socket, address = a_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                break
+            # A client that does not read must not stop the others.
+            system_socket.setblocking(False)
+            connection_id = next(self._connection_counter)
+            self.connections[connection_id] = system_socket
+            self.connection_ids[system_socket] = connection_id
+            self.buffers[connection_id] = StreamBuffer()
+            self.logger.info('Connection %s from %s', connection_id, address)
+            # Register this socket too so we look for incoming data
+            self.register(system_socket, self.process_message)
+
+    def close_connection(self, connection_id):
+        """Forget and close a connection with the system.
+
+        :param connection_id: the id of the connection.
+        :type connection_id: int
+        """
+        system_socket = self.connections.pop(connection_id)
+        del self.connection_ids[system_socket]
+        del self.buffers[connection_id]
+        self.output.pop(connection_id, None)
+        self._closing.discard(connection_id)
+        self.unregister(system_socket)
+        system_socket.close()
+        self.logger.info('Connection %s closed', connection_id)
+
+    def register(self, a_socket, call_back_function):
+        """Watch a socket and call the call back when data arrives.
+
+        :param a_socket: socket, zmq socket or file handle to watch.
+        :param call_back_function: function that is called with the
+        socket as parameter.
+        :type call_back_function: function
+        """
+        self.poller.register(a_socket, zmq.POLLIN)
+        self.call_backs[poll_key(a_socket)] = (
+                a_socket, call_back_function, next(self._generations))
+
+    def unregister(self, a_socket):
+        """Stop watching a socket.
+
+        :param a_socket: socket, zmq socket or file handle to forget.
+        """
+        self.poller.unregister(a_socket)
+        del self.call_backs[poll_key(a_socket)]
+        self.write_call_backs.pop(poll_key(a_socket), None)
+
+    def watch_writable(self, a_socket, call_back_function):
+        """Also call a call back when a registered socket can be
+        written, until :meth:`unwatch_writable`.
+
+        :param a_socket: the registered socket.
+        :param call_back_function: function that is called with the
+        socket as parameter.
+        :type call_back_function: function
+        """
+        self.poller.modify(a_socket, zmq.POLLIN | zmq.POLLOUT)
+        self.write_call_backs[poll_key(a_socket)] = call_back_function
+
+    def unwatch_writable(self, a_socket):
+        """Stop calling the call back for a writable socket.
+
+        :param a_socket: the registered socket.
         """
-        system_socket, address = a_socket.accept()
-        self.logger.info('Connection from ' + str(address))
-        # Register this socket too so we look for incoming data
-        self.poller.register(system_socket, zmq.POLLIN)
-        self.call_backs[system_socket.fileno()] = (
-                system_socket, self.process_message)
-        self.system_socket = system_socket
+        self.poller.modify(a_socket, zmq.POLLIN)
+        del self.write_call_backs[poll_key(a_socket)]
 
     def process_player_command(self, a_socket):
         """ Process a command from the scenario player.
         """
-        # receive the command
-        command = a_socket.recv_pyobj()
-        self.logger.info('received command from scenario player: {0}'
-                         .format(type(command)))
-        self.system_socket.send(self.message.to_message(command))
+        # receive the command, the topic is for a hub.
+        frames = a_socket.recv_multipart(copy=False)
+        self.process_command(frames[1:])
+
+    def process_command(self, frames):
+        """ Process the frames of a command from the scenario player.
+
+        An invalid command, for instance of a player with another
+        serializer, is logged and dropped.
+
+        :param frames: the connection id, tag and payload frames.
+        :type frames: list of zmq.Frame
+        """
+        try:
+            if len(frames) != 3:
+                raise SerializerException("Command has {0} frames"
+                                          .format(len(frames)))
+            connection_id = unpack_connection_id(frames[0].bytes)
+            if connection_id == CONTROL:
+                command = self.serializer.control_serializer.from_frames(
+                        frames[1], frames[2])
+            else:
+                command = self.serializer.from_frames(frames[1], frames[2])
+        except SerializerException as err:
+            self.logger.warning('Invalid command from scenario player '
+                                'dropped: %s', err)
+            return
+        if connection_id == CONTROL:
+            self.control(command)
+            return
+        self.logger.info('received command from scenario player: %s',
+                         type(command), extra=TRAFFIC)
+        self.send_to_system(connection_id, self.encode(command))
+
+    def control(self, command):
+        """Carry out a control command of the player.
+
+        :param command: the name of a method of the dispatcher that
+                        may be called by the player, followed by its
+                        arguments.
+        :type command: tuple
+        """
+        commands = {'set_response':self.set_response,
+                    'remove_response':self.remove_response,
+                    'clear_responses':self.clear_responses,
+                    'ping':self.ping}
+        # msgpack sends tuples as lists.
+        if isinstance(command, list):
+            command = tuple(command)
+        if not isinstance(command, tuple) or not command:
+            self.logger.warning('Invalid control command %r', command)
+            return
+        function = commands.get(command[0])
+        if function is None:
+            self.logger.warning('Unknown control command %s', command[0])
+            return
+        function(*command[1:])
+
+    def ping(self, token):
+        """Answer a ping of an interface with a ready reply, see
+        :meth:`simulatorinterface.SimulatorInterface.wait_ready`.  Once
+        the reply arrives both links with the player are connected.
+
+        :param token: the token of the ping, returned in the reply.
+        """
+        self.repeater_socket.send_multipart(
+                [message_topic(self.topic, CONTROL),
+                 pack_connection_id(CONTROL)]
+                + list(self.serializer.control_serializer.to_frames(
+                        ('ready', token))))
+
+    def set_response(self, rule):
+        """Add a rule to the response table.
+
+        :param rule: the rule.
+        :type rule: responsetable.ResponseRule
+        """
+        rule.data = self.encode(rule.response)
+        self.responses.add(rule)
+        self.logger.info('Response rule for %s', rule.key)
+
+    def remove_response(self, key):
+        """Remove a rule from the response table.
+
+        :param key: the key of the rule.
+        """
+        if not self.responses.remove(key):
+            self.logger.warning('No response rule for %s', key)
+
+    def clear_responses(self):
+        """Remove all rules from the response table."""
+        self.responses.clear()
+
+    def answer(self, connection_id, data, message):
+        """Send the response of the rule that matches a message, if
+        any.
+
+        Only called when the response table is not empty.
+
+        :param connection_id: the id of the connection of the message.
+        :param data: the bytes of the message.
+        :param message: the decoded message.
+        :returns: True if the message must be forwarded to the player.
+        """
+        rule = self.responses.match(data, message)
+        if rule is None:
+            return True
+        self.send_to_system(connection_id, rule.data)
+        return rule.forward
+
+    def send_to_system(self, connection_id, data):
+        """Send data to one or all connections with the system.
+
+        :param connection_id: the id of the connection, or BROADCAST for
+                              all connections.
+        :type connection_id: int
+        :param data: the data to send.
+        :type data: bytes
+        """
+        if connection_id == BROADCAST:
+            targets = list(self.connections.items())
+        elif connection_id in self.connections:
+            targets = [(connection_id, self.connections[connection_id])]
+        else:
+            self.logger.warning('No connection %s, command dropped',
+                                connection_id)
+            return
+        for target_id, system_socket in targets:
+            if self.traffic_log is not None:
+                self.traffic_log.record(SENT, target_id, data)
+            self.send_to_connection(target_id, system_socket, data)
+
+    def send_to_connection(self, connection_id, system_socket, data):
+        """Send data to a connection without waiting for it.
+
+        What the socket does not take now waits in :attr:`output` and
+        is sent when the socket can be written, see
+        :meth:`flush_output`.  A connection with more than
+        :attr:`max_output` bytes waiting does not read, it is closed.
+
+        :param connection_id: the id of the connection.
+        :type connection_id: int
+        :param system_socket: the socket of the connection.
+        :param data: the data to send.
+        :type data: bytes
+        """
+        output = self.output.get(connection_id)
+        if output is not None:
+            if len(output) + len(data) > self.max_output:
+                self.logger.warning('Connection %s does not read, %d bytes '
+                                    'waiting, closed', connection_id,
+                                    len(output) + len(data))
+                self.close_connection(connection_id)
+            else:
+                output += data
+            return
+        try:
+            sent = system_socket.send(data)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError as err:
+            self.logger.warning('Connection %s failed: %s',
+                                connection_id, err)
+            self.close_connection(connection_id)
+            return
+        if sent < len(data):
+            self.output[connection_id] = bytearray(memoryview(data)[sent:])
+            self.watch_writable(system_socket, self.flush_output)
+
+    def flush_output(self, system_socket):
+        """Send the data that waits for a connection that can be
+        written again, see :meth:`send_to_connection`.
+
+        :param system_socket: the socket of the connection.
+        """
+        connection_id = self.connection_ids[system_socket]
+        output = self.output[connection_id]
+        try:
+            sent = system_socket.send(output)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as err:
+            self.logger.warning('Connection %s failed: %s',
+                                connection_id, err)
+            self.close_connection(connection_id)
+            return
+        del output[:sent]
+        if not output:
+            del self.output[connection_id]
+            self.unwatch_writable(system_socket)
+            if connection_id in self._closing:
+                self.close_connection(connection_id)
+
+    def close_after_output(self, connection_id):
+        """Close a connection once the data that waits for it is sent.
+
+        :param connection_id: the id of the connection.
+        :type connection_id: int
+        """
+        if connection_id in self.output:
+            self._closing.add(connection_id)
+        else:
+            self.close_connection(connection_id)
     
     def process_message(self, a_socket):
-        """ Receive and forward a message from the system """
-        self.logger.info( 'Data from the system' )
-        # We do not know beforehand how big the blob is.
-        data = a_socket.recv( 2048 )
-        if data == "" :
+        """ Receive and forward the messages from the system """
+        connection_id = self.connection_ids[a_socket]
+        buffer = self.buffers[connection_id]
+        try:
+            count = buffer.recv_into(a_socket)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, FramingException) as err:
+            self.logger.warning('Connection %s failed: %s',
+                                connection_id, err)
+            count = 0
+        if not count:
             # Connection was closed, so unregister and close the socket.
-            self.poller.unregister(a_socket)
-            del self.call_backs[a_socket.fileno()]
-            a_socket.close()
-            self.system_socket = None
-        else :
-            a_message = message.from_message(data)
-            self.logger.info('Copying data to player')
-            self.repeater_socket.send_pyobj(a_message)
+            self.close_connection(connection_id)
+            return
+        try:
+            for frame in buffer.frames(self.framer):
+                message = self.decode(frame)
+                if self.traffic_log is not None:
+                    self.traffic_log.record(
+                            RECEIVED, connection_id, frame,
+                            getattr(message, 'message_id', None))
+                if (not self.responses or
+                        self.answer(connection_id, frame, message)):
+                    self.forward(connection_id, message)
+        except FramingException as err:
+            self.logger.warning('Connection %s sent an invalid frame: %s',
+                                connection_id, err)
+            self.close_connection(connection_id)
+
+    def inject(self, connection_id, frame):
+        """Handle a frame as if the system sent it, for instance a frame
+        of a capture.
+
+        :param connection_id: the id of the connection of the frame.
+        :type connection_id: int
+        :param frame: the frame.
+        """
+        message = self.decode(frame)
+        if not self.responses or self.answer(connection_id, frame, message):
+            self.forward(connection_id, message)
+
+    def replay(self, path, speed=1.0):
+        """Play the frames the system sent in a capture, see
+        :mod:`capture`.  Commands of the player are handled while
+        waiting for the next frame, and a stop signal ends the replay.
+
+        :param path: the capture file.
+        :type path: string
+        :param speed: how many times faster than captured, 0 for as fast
+                      as possible.
+        :type speed: float
+        :returns: the number of frames played.
+        """
+        with CaptureReader(path) as reader:
+            count = Replay(reader, self.inject, speed).run(
+                    self.poll_sockets, lambda: self.go_on)
+        self.logger.info('Replayed %d frames of %s', count, path)
+        return count
+
+    def forward(self, connection_id, message):
+        """Forward a message from the system to the player.
+
+        :param connection_id: the id of the connection the message came
+                              from, BROADCAST if there are no separate
+                              connections.
+        :type connection_id: int
+        :param message: the message.
+        """
+        self.repeater_socket.send_multipart(
+                [self.message_topic(message),
+                 pack_connection_id(connection_id)]
+                + list(self.serializer.to_frames(message)),
+                copy=self.serializer.raw)
+
+    def forward_batch(self, messages):
+        """Forward several messages to the player in as few zmq
+        messages as possible.
+
+        A zmq message has one topic, so each run of messages with the
+        same message id becomes one zmq message.
+
+        :param messages: ``(connection_id, message)`` tuples, see
+                         :meth:`forward`.
+        :type messages: list
+        """
+        # Raw payloads point into a receive buffer that is reused.
+        raw = self.serializer.raw
+        frames = None
+        for connection_id, message in messages:
+            topic = self.message_topic(message)
+            if frames is None or topic != frames[0]:
+                if frames is not None:
+                    self.repeater_socket.send_multipart(frames, copy=raw)
+                frames = [topic]
+            frames.append(pack_connection_id(connection_id))
+            frames.extend(self.serializer.to_frames(message))
+        if frames is not None:
+            self.repeater_socket.send_multipart(frames, copy=raw)
+
+    def message_topic(self, message):
+        """The topic frame of a message for the player: the topic of
+        the simulator followed by the message id, if there is one.
+
+        :param message: the message.
+        :returns: the topic frame.
+        """
+        message_id = getattr(message, 'message_id', None)
+        if message_id is None:
+            return self.topic
+        topic = self._topics.get(message_id)
+        if topic is None:
+            topic = message_topic(self.topic, message_id)
+            # Do not grow without bounds if the ids are not a fixed set.
+            if len(self._topics) < 1024:
+                self._topics[message_id] = topic
+        return topic
+
+    def decode(self, data):
+        """Turn data from the system into the message for the player.
+
+        With the raw serializer, or without a message class, the data
+        is forwarded as is, as bytes for the other serializers.
+
+        :param data: a frame of data from the system.  It is only valid
+                     during the call, a message that keeps it must copy
+                     it.
+        :type data: memoryview
+        """
+        if self.serializer.raw:
+            return data
+        if self.message is None:
+            return bytes(data)
+        return self.message.from_message(data)
+
+    def encode(self, command):
+        """Turn a command from the player into data for the system.
+
+        :param command: the command from the player.
+        """
+        if self.serializer.raw or self.message is None:
+            return command
+        return self.message.to_message(command)
     
-    def run(self):
-        # Catch any Control-C
-        signal.signal(signal.SIGINT, self.control_c_handler)
+    def run(self, ready=None):
+        """Create the sockets and handle the events until a stop signal
+        arrives, see :meth:`install_signal_handlers`.
+
+        :param ready: called without arguments once the sockets are
+                      created and the endpoints announced, for instance
+                      :meth:`daemonbase.Daemon.notify_ready`.
+        """
+        # Catch any Control-C, and stop with SIGTERM and SIGHUP too.
+        self.install_signal_handlers()
+        self.open_traffic_log()
         self.create_sockets()
+        self.logger.info("Ready")
+        if ready is not None:
+            ready()
+        if self.replay_path:
+            self.replay(self.replay_path, self.replay_speed)
         
         while self.go_on :
-            # Note that poller uses fileno() as the key for non-zmq sockets.
-            socks = dict(self.poller.poll(60000)) # Timeout in ms, 1 minute
-            for socket_key in self.call_backs.copy() : 
-                    # Need copy here cause we might modify the call_backs
-                    # while in the call back functions.
-                if socket_key in socks and socks[socket_key] == zmq.POLLIN:
-                    if socket_key in self.call_backs: 
-                        cbp = self.call_backs[socket_key]
-                        function =  cbp[1]
-                        function(cbp[0])
-
-            self.logger.info("Still alive")
-            self.run(socks)
+            events = self.poll_sockets(self.timeout)
+            self.logger.info("Still alive", extra=ALIVE)
+            self.after_poll(events)
         self.logger.info("Stopping")
-        self.context.term()
+        self.withdraw()
+        self.shutdown()
+        if self.traffic_log is not None:
+            self.traffic_log.close()
+        self.close_sockets()
+        # term() would wait for the sockets that are still open.
+        self.context.destroy(linger=self.stop_linger)
+        self.logger.info("Stopped")
+
+    def poll_sockets(self, timeout):
+        """Wait for events and call the call backs of the ready sockets.
+
+        Only the ready sockets are looked at.  A call back may register
+        or unregister sockets: an unregistered socket is skipped, and a
+        socket that is registered during this round waits for the next
+        poll, also when it reuses the file number of a closed socket.
+
+        :param timeout: maximum time to wait, in milliseconds.
+        :returns: the events returned by the poller.
+        """
+        generation = next(self._generations)
+        call_backs = self.call_backs
+        # Note that poller uses fileno() as the key for non-zmq sockets.
+        events = self.poller.poll(timeout)
+        for socket_key, event in events:
+            cbp = call_backs.get(socket_key)
+            if cbp is None or cbp[2] > generation:
+                continue
+            if event & POLLIN:
+                cbp[1](cbp[0])
+            if event & POLLOUT:
+                write_call_back = self.write_call_backs.get(socket_key)
+                if write_call_back is not None:
+                    write_call_back(cbp[0])
+        return events
+
+    def shutdown(self):
+        """Called when the dispatcher stops, before the zmq context is
+        terminated.
+
+        Subclasses can override this to stop their threads and close
+        their sockets.
+        """
+        pass
+
+    def after_poll(self, events):
+        """Called after every poll, with the events of the poll.
+
+        Subclasses can override this, for instance to detect the end
+        of a message when a poll times out.
+
+        :param events: list of ``(socket, event)`` tuples, empty after
+        a time out.
+        """
+        pass
 
 #------------------------------------------------------------------------------
 
 class TCPDispatcher(Dispatcher):
     """ Dispatcher subclass for TCP connections"""
     def __init__(self, dispatcher_type, dispatcher_id):
-        Dispatcher.__init__(self, name, dispatcher_id)
+        Dispatcher.__init__(self, dispatcher_type, dispatcher_id)
         
         config = configparser.ConfigParser()
         config.read('simulator.conf')
@@ -134,21 +876,13 @@ class TCPDispatcher(Dispatcher):
 
         if (dispatcher_section) in config.sections():
             entries = config[dispatcher_section]
-            # path to the message class
-            self.message_path = entries['MessagePath']
-            if message_path is not None:
-                loader = importlib.machinery.SourceFileLoader('message',
-                                                              message_path)
-                message_module = loader.exec_module('message')
-                message = message_module.Message()
+            self.configure(entries)
             # address and port to listen on for messages from the system
             self.accept_address = entries['AcceptAddress']
-            self.listen_port = entries['ListenPort']
-            
-            # port to listen on for commands from the player.
-            self.command_listen_port = entries['CommandListenPort']
-            # port to forward messages to the player.
-            self.message_forward_port = entries['MessageForwardPort']
+            self.listen_port = int(entries['ListenPort'])
+            # length of the queue of connections that are not accepted
+            # yet
+            self.backlog = int(entries.get('Backlog', socket.SOMAXCONN))
                         
         else:
             self.logger.critical('no valid tcp section found in config file')
@@ -165,24 +899,48 @@ class TCPDispatcher(Dispatcher):
                          .format(str(self.accept_address)))
         self.logger.info("Listening on port {0}".format(str(self.listen_port)))
         accept_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        accept_socket.bind((self.accept_address, self.port))        
-        # Only handle one connection at a time.
-        accept_socket.listen(1)
+        accept_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        accept_socket.bind((self.accept_address, self.listen_port))
+        accept_socket.listen(self.backlog)
+        # accept() takes all pending connections at once.
+        accept_socket.setblocking(False)
 
         # Let the superclass finish the creation of the rest of the 
         # sockets, because it is the same.
         Dispatcher.create_sockets(self, accept_socket)
 
-    def run(self):
-        # TCP dispatcher has no extra steps to add to the default loop.
-        # We will just exit this method.
-        pass
-
 #------------------------------------------------------------------------------
 
 
+def character_time(baudrate, bytesize, parity, stopbits):
+    """The time it takes to send one character over a serial link.
+
+    :param baudrate: the baud rate.
+    :type baudrate: int
+    :param bytesize: the number of data bits.
+    :type bytesize: int
+    :param parity: one of the serial.PARITY_* values.
+    :param stopbits: the number of stop bits.
+    :type stopbits: int, float
+    :returns: the time in nanoseconds.
+    """
+    bits = 1 + bytesize + stopbits
+    if parity != serial.PARITY_NONE:
+        bits += 1
+    return int(bits * NANOSECONDS / baudrate)
+
+
 class SerialDispatcher(Dispatcher):
-    """ Dispatcher subclass for Serial connections"""
+    """ Dispatcher subclass for Serial connections
+
+    A serial link has no message boundaries.  By default a frame ends
+    when no byte arrives for ``GapCharacters`` character times, 3.5 as
+    in Modbus RTU.  The gap is calculated from the ``BaudRate``,
+    ``ByteSize``, ``Parity`` and ``StopBits`` settings.  With another
+    ``Framing`` setting, such as "delimiter" or "length", a frame is
+    forwarded as soon as it is complete and the gap only throws away an
+    incomplete frame, so the next frame starts in sync.
+    """
     SERIAL_PARITY = {'none':serial.PARITY_NONE , 'even':serial.PARITY_EVEN ,
                      'odd':serial.PARITY_ODD , 'mark':serial.PARITY_MARK , 
                      'space':serial.PARITY_SPACE}
@@ -190,18 +948,25 @@ class SerialDispatcher(Dispatcher):
                       'onePointFive': serial.STOPBITS_ONE_POINT_FIVE, 
                       'two':serial.STOPBITS_TWO }
     default_timeout = 60000
+    #: default gap that ends a frame, in characters
+    default_gap_characters = 3.5
 
     def __init__(self, dispatcher_type, dispatcher_id):
         Dispatcher.__init__(self, dispatcher_type, dispatcher_id)
         
         self.repeater_socket = None
-        self.poller = None
-        self.call_backs = None
         self.serial_link = None
-        self.timeout = default_timeout
+        self.timeout = self.default_timeout
         
-        self.receiving = False
-        self.blob = ""
+        #: receive buffer for the serial link
+        self.buffer = StreamBuffer(4096)
+        #: gap that ends a frame, in characters
+        self.gap_characters = self.default_gap_characters
+        # monotonic time of the last read in ns, None between frames
+        self._last_read = None
+        #: read the serial link on a thread, see start_reader()
+        self.use_reader_thread = False
+        self._reader = None
         
         config = configparser.ConfigParser()
         config.read('simulator.conf')
@@ -210,29 +975,30 @@ class SerialDispatcher(Dispatcher):
 
         if (dispatcher_section) in config.sections():
             entries = config[dispatcher_section]
-            # path to the message class
-            self.message_path = entries['MessagePath']
-            if message_path is not None:
-                loader = importlib.machinery.SourceFileLoader('message',
-                                                              message_path)
-                message_module = loader.exec_module('message')
-                message = message_module.Message()
+            self.configure(entries)
             # Settings for the serial link to the system.
             self.serial_device = entries['Device']
             self.serial_baudrate = int(entries['BaudRate'])
             self.serial_bytesize = int(entries['ByteSize']) 
-            self.serial_parity = SERIAL_PARITY.get(entries['Parity'])
-            self.serial_stopbits = SERIAL_STOPBITS.get(entries['StopBits'])
-
-            # port to listen on for commands from the player.
-            self.command_listen_port = entries['CommandListenPort']
-            # port to forward messages to the player.
-            self.message_forward_port = entries['MessageForwardPort']
+            self.serial_parity = self.SERIAL_PARITY.get(entries['Parity'])
+            self.serial_stopbits = self.SERIAL_STOPBITS.get(
+                    entries['StopBits'])
+            self.gap_characters = float(entries.get(
+                    'GapCharacters', self.default_gap_characters))
+            self.use_reader_thread = entries.getboolean('ReaderThread',
+                                                        False)
                         
         else:
             self.logger.critical('no valid serial section '
                                  'found in config file')
 
+    @property
+    def gap(self):
+        """The gap that ends a frame, in nanoseconds."""
+        return int(self.gap_characters * character_time(
+                self.serial_baudrate, self.serial_bytesize,
+                self.serial_parity, self.serial_stopbits))
+
     def create_sockets(self):
         """ Create the socket to the scenario player and set up the
             serial link to the system
@@ -240,101 +1006,228 @@ class SerialDispatcher(Dispatcher):
         self.logger.info('Creating sockets for {0} {1}'
                          .format(self.name, self.dispatcher_id))
         # Setup a serial link to listen to the system 
-        self.logger.info("Opening serial device {0} ".format(serial_device))
-        self.serial_link = serial.Serial(serial_device, serial_baudrate,
-                                         serial_parity, serial_bytesize,
-                                         serial_stopbits)
-        
-        # Open a socket to listen for commands from the scenario player
-        address = "tcp://*:{0}".format(self.command_listen_port)
-        self.logger.info("Command subscription at {0}".format(address))
-        command_socket  = self.context.socket(zmq.SUB)
-        command_socket.bind(address)
-        command_socket.setsockopt(zmq.SUBSCRIBE, "")
+        self.logger.info("Opening serial device {0} "
+                         .format(self.serial_device))
+        # Reads return what is available, the poller waits for data.
+        self.serial_link = serial.Serial(self.serial_device,
+                                         baudrate=self.serial_baudrate,
+                                         bytesize=self.serial_bytesize,
+                                         parity=self.serial_parity,
+                                         stopbits=self.serial_stopbits,
+                                         timeout=0)
+        self._gap = self.gap
+        self.logger.info("Frame gap %d us", self._gap // 1000)
         
-        # Add the sockets to the zmq poller.
-        self.poller = zmq.Poller()
+        # Add the sockets to the zmq poller and register the call backs.
+        if self.use_reader_thread:
+            self.start_reader()
+        elif(self.serial_link):
+            self.register(self.serial_link, self.read_message)
+        self.create_player_links()
 
-        if(self.serial_link):
-            self.poller.register(self.serial_link, zmq_POLLIN)
-            # Register callback
-            self.call_backs[self.serial_link.fileno()] = (self.serial_link, 
-                                                          self.read_message)
-        self.poller.register(command_socket, zmq.POLLIN)
+    def read_message(self, link):
+        """Read the available bytes from the system
+        """
+        self.receive(link, self.process_message)
+        self.timeout = self._poll_timeout(self.check_gap(None))
 
-        # Register the call backs.
-        self.call_backs[command_socket] = (command_socket, 
-                                           self.process_player_command)
+    def receive(self, link, emit):
+        """Read all bytes that are available and emit the complete
+        frames.
 
-        # Not part of the poller
-        # Message forwarding link to player
-        address = "tcp://*:{0}".format(self.message_forward_port)
-        self.logger.info("Publishing on " + address)
-        self.repeater_socket = self.context.socket(zmq.PUB)
-        self.repeater_socket.bind(address)
+        :param link: the serial link.
+        :param emit: function that is called with each frame.
+        """
+        try:
+            self.read_available(link)
+        except FramingException as err:
+            self.logger.warning('Dropping data: %s', err)
+            self.buffer.clear()
+            return
+        except serial.SerialException as err:
+            self.logger.error('Serial link failed: %s', err)
+            if self._reader is None:
+                self.unregister(link)
+            else:
+                self._reader_stop.set()
+            return
+        self._last_read = time.monotonic_ns()
+        if not isinstance(self.framer, StreamFramer):
+            # Emit the complete frames right away.
+            try:
+                for frame in self.buffer.frames(self.framer):
+                    emit(frame)
+            except FramingException as err:
+                self.logger.warning('Invalid frame: %s', err)
+                self.buffer.clear()
+            if not len(self.buffer):
+                self._last_read = None
 
-    def read_message(self, link):
-        """Read one or more bytes from the system
-        """
-        # We do not know beforehand how big the blob is and data might come in
-        # parts, mostly one character at a time, sometimes a few more.
-        blob = handle.read()
-        self.blob += blob
-        # Set timeout to a low value.  We should receive a new byte within
-        # this period otherwise we assume it is the end of the message.  If we
-        # make this too high, there will be a delay in processing the message.
-        # The baud rate is 57600 so a single character takes
-        # 8/57600 == 0.000138 seconds == 0.138 milliseconds
-        # So 10ms should be enough.
-        self.timeout = 10    # in ms
-        self.receiving = True
+    def read_available(self, link):
+        """Read everything the serial link has, in as few reads as
+        possible.
+
+        :param link: the serial link.
+        :returns: the number of bytes read.
+        """
+        total = 0
+        waiting = link.in_waiting
+        while waiting:
+            total += self.buffer.fill(
+                    lambda view: link.readinto(view[:waiting]))
+            waiting = link.in_waiting
+        return total
+
+    def check_gap(self, emit):
+        """End the frame when the gap has passed.
+
+        :param emit: function that is called with the frame, None to
+                     leave the check for later.
+        :returns: the time left until the gap has passed in ns, or None
+                  if no frame is being received.
+        """
+        if self._last_read is None:
+            return None
+        remaining = self._last_read + self._gap - time.monotonic_ns()
+        if remaining > 0 or emit is None:
+            return remaining
+        if isinstance(self.framer, StreamFramer):
+            emit(self.buffer.view[self.buffer.start:self.buffer.end])
+        else:
+            self.logger.warning('Dropping %d bytes of an incomplete '
+                                'frame', len(self.buffer))
+        self.buffer.clear()
+        self._last_read = None
+        return None
+
+    def _poll_timeout(self, remaining):
+        """The poll timeout in ms for the time left until the gap."""
+        if remaining is None:
+            # Set timeout back to a high value, so we not waste CPU
+            # cycles.
+            return self.default_timeout
+        # Round up, the poller counts in milliseconds.
+        return max(0, -(-remaining // 1000000))
     
-    def process_message(self):
-        """Receive and forward a message from the system.
+    def process_message(self, frame):
+        """Forward a frame from the system.
+
+        :param frame: the frame.
+        :type frame: memoryview
         """
-        self.logger.info('Received a full message from the system')
-        self.logger.info(",".join(map(lambda x: hex(ord(x)), self.blob)))
-        a_message = self.message.from_message( self.blob )
-        self.logger.info('Copying data to player')
-        self.repeater_socket.send_pyobj(a_message)
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('Received a full message from the system: %s',
+                             HexDump(frame), extra=TRAFFIC)
+        message = self.decode(frame)
+        if self.traffic_log is not None:
+            self.traffic_log.record(RECEIVED, BROADCAST, frame,
+                                    getattr(message, 'message_id', None))
+        if not self.responses or self.answer(BROADCAST, frame, message):
+            self.forward(BROADCAST, message)
 
-        self.blob = ""
+    def process_reader_frame(self, a_socket):
+        """Forward a frame from the reader thread."""
+        self.process_message(a_socket.recv(copy=False).buffer)
     
-    def process_player_command(self, a_socket):
-        """ Process a command from the scenario player.
+    def send_to_system(self, connection_id, data):
+        """Write data to the serial link, there is only one connection.
+
+        See :meth:`Dispatcher.send_to_system`.
         """
-        # receive the command
-        command = a_socket.recv_pyobj()
-        self.logger.info('received command from scenario player: {0}'
-                         .format(type(command)))
-        self.serial_link.write(self.message.to_message(command))
-
-    def run(self, socks):
-        if len(socks) == 0 and self.receiving :
-                # We were in the process of receiving data from OBIS.
-                # We did not receive any new bytes, so we assume it's
-                # the end of the message.
-                self.process_message()
-                self.receiving = False
-
-                # Set timeout back to a high value, so we not waste CPU
-                # cycles.
-                self.timeout = default_timeout
-                self.blob = "" # Reset the message buffer
-        elif len(socks) == 0 and self.timeout == default_timeout :
-                self.logger.info("Nothing happened for a long time.")
-        else:
-            pass
+        if self.traffic_log is not None:
+            self.traffic_log.record(SENT, BROADCAST, data)
+        self.serial_link.write(data)
 
-        self.logger.info('Stopping')
-        self.context.term()
+    def after_poll(self, events):
+        """End the frame when the gap has passed.
+
+        Other events, such as commands from the player, do not delay
+        the end of the frame.
+        """
+        if self._reader is not None:
+            return
+        if self._last_read is None and len(events) == 0:
+            self.logger.info("Nothing happened for a long time.",
+                             extra=ALIVE)
+        self.timeout = self._poll_timeout(self.check_gap(
+                self.process_message))
+
+    def start_reader(self):
+        """Read the serial link on a thread of its own.
+
+        The thread frames the data and passes the frames to the poll
+        loop over an inproc socket, so the reads and the gap timing do
+        not wait for the poll loop.
+        """
+        address = "inproc://serial-reader-{0}".format(id(self))
+        frames_socket = self.context.socket(zmq.PAIR)
+        frames_socket.bind(address)
+        reader_socket = self.context.socket(zmq.PAIR)
+        reader_socket.connect(address)
+        self._reader_stop = threading.Event()
+        self._reader = threading.Thread(
+                target=self._read_serial, args=(reader_socket,),
+                name="serial-reader", daemon=True)
+        self._reader_sockets = (frames_socket, reader_socket)
+        self.register(frames_socket, self.process_reader_frame)
+        self._reader.start()
+
+    def _read_serial(self, reader_socket):
+        """Loop of the reader thread."""
+        link = self.serial_link
+        def emit(frame):
+            # The buffer is reused, so zmq has to copy the frame.
+            reader_socket.send(frame, copy=True)
+        while not self._reader_stop.is_set():
+            remaining = self.check_gap(emit)
+            if remaining is None:
+                # Wake up now and then to see if we must stop.
+                timeout = 0.1
+            else:
+                timeout = remaining / NANOSECONDS
+            if select.select([link], [], [], timeout)[0]:
+                self.receive(link, emit)
+
+    def shutdown(self):
+        """Stop the reader thread and close the serial link."""
+        if self._reader is not None:
+            self._reader_stop.set()
+            self._reader.join()
+            self._reader = None
+            for a_socket in self._reader_sockets:
+                a_socket.close(linger=0)
+        if self.serial_link is not None:
+            self.serial_link.close()
 
 #------------------------------------------------------------------------------
 
 class UDPDispatcher(Dispatcher):
-    """ Dispatcher subclass for UDP connections"""
+    """ Dispatcher subclass for UDP connections
+
+    Every wake-up drains all waiting datagrams, up to ``BatchSize``, into
+    one preallocated buffer of ``BufferSize`` bytes, and forwards them
+    to the player as one batch.  Each sender address is a connection,
+    so the player can reply to a sender with its connection id.  Of
+    more than ``MaxPeers`` senders the one that was quiet the longest
+    is forgotten.
+    """
+    #: largest UDP payload
+    max_datagram_size = 65535
+    #: senders to remember
+    max_peers = 4096
+
     def __init__(self, dispatcher_type, dispatcher_id):
         Dispatcher.__init__(self, dispatcher_type, dispatcher_id)
+
+        #: maximum number of datagrams per batch
+        self.batch_size = 256
+        #: size of the receive buffer
+        self.buffer_size = 1048576
+        #: sender addresses by connection id
+        self.peers = {}
+        #: connection ids by sender address, the last active sender
+        #: last
+        self.peer_ids = collections.OrderedDict()
         
         config = configparser.ConfigParser()
         config.read('simulator.conf')
@@ -343,21 +1236,14 @@ class UDPDispatcher(Dispatcher):
 
         if (dispatcher_section) in config.sections():
             entries = config[dispatcher_section]
-            # path to the message class
-            self.message_path = entries['MessagePath']
-            if message_path is not None:
-                loader = importlib.machinery.SourceFileLoader('message',
-                                                              message_path)
-                message_module = loader.exec_module('message')
-                message = message_module.Message()
+            self.configure(entries)
             # address and port to listen on for messages from the system
             self.accept_address = entries['AcceptAddress']
-            self.listen_port = entries['ListenPort']
-            
-            # port to listen on for commands from the player.
-            self.command_listen_port = entries['CommandListenPort']
-            # port to forward messages to the player.
-            self.message_forward_port = entries['MessageForwardPort']
+            self.listen_port = int(entries['ListenPort'])
+            self.batch_size = int(entries.get('BatchSize', self.batch_size))
+            self.buffer_size = int(entries.get('BufferSize',
+                                               self.buffer_size))
+            self.max_peers = int(entries.get('MaxPeers', self.max_peers))
                         
         else:
             self.logger.critical('no valid udp section found in config file')
@@ -368,109 +1254,328 @@ class UDPDispatcher(Dispatcher):
         """
         self.logger.info('Creating sockets for {0} {1}'
                          .format(self.name, self.dispatcher_id))
-        # Open an UDP socket to listen for new connections 
-        # from the system.
         self.logger.info("Listening on address {0}"
                          .format(str(self.accept_address)))
         self.logger.info("Listening on port {0}".format(str(self.listen_port)))
-        address = "udp://{0}:{1}".format(accept_address, listen_port)
-        accept_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        accept_socket.bind((self.accept_address, self.listen_port))
+        self.receive_buffer = bytearray(max(self.buffer_size,
+                                            self.max_datagram_size))
+        self.receive_view = memoryview(self.receive_buffer)
+        datagram_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        datagram_socket.bind((self.accept_address, self.listen_port))
+        # read_datagrams() reads until there is nothing left.
+        datagram_socket.setblocking(False)
         # Let the superclass finish the creation of the rest of the 
         # sockets, because it is the same.
-        Dispatcher.create_sockets(self, accept_socket)
+        Dispatcher.create_sockets(self, datagram_socket, self.read_datagrams)
 
-    def run(self):
-        pass
+    def read_datagrams(self, a_socket):
+        """Read the waiting datagrams and forward them as one batch.
+
+        The datagrams are stored one after the other in the receive
+        buffer, as long as there is room for a datagram of the maximum
+        size.
+        """
+        view = self.receive_view
+        limit = len(view) - self.max_datagram_size
+        offset = 0
+        batch = []
+        while offset <= limit and len(batch) < self.batch_size:
+            try:
+                count, address = a_socket.recvfrom_into(view[offset:])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as err:
+                # For instance an ICMP error of an earlier reply.  The
+                # next poll reads the rest.
+                self.logger.warning('Receive failed: %s', err)
+                break
+            data = view[offset:offset + count]
+            offset += count
+            connection_id = self.peer_id(address)
+            message = self.decode(data)
+            if self.traffic_log is not None:
+                self.traffic_log.record(RECEIVED, connection_id, data,
+                                        getattr(message, 'message_id', None))
+            if (not self.responses or
+                    self.answer(connection_id, data, message)):
+                batch.append((connection_id, message))
+        if batch:
+            self.forward_batch(batch)
+
+    def peer_id(self, address):
+        """The connection id of a sender address, a new one for a new
+        sender.
+        """
+        peer_ids = self.peer_ids
+        connection_id = peer_ids.get(address)
+        if connection_id is not None:
+            peer_ids.move_to_end(address)
+            return connection_id
+        connection_id = next(self._connection_counter)
+        peer_ids[address] = connection_id
+        self.peers[connection_id] = address
+        self.logger.info('Datagrams from %s are connection %s',
+                         address, connection_id)
+        if len(peer_ids) > self.max_peers:
+            old_address, old_id = peer_ids.popitem(last=False)
+            del self.peers[old_id]
+            self.logger.info('Connection %s of %s forgotten', old_id,
+                             old_address)
+        return connection_id
+
+    def send_to_system(self, connection_id, data):
+        """Send a datagram to one or all senders.
+
+        See :meth:`Dispatcher.send_to_system`.
+        """
+        if connection_id == BROADCAST:
+            addresses = list(self.peers.values())
+        elif connection_id in self.peers:
+            addresses = [self.peers[connection_id]]
+        else:
+            self.logger.warning('No sender %s, command dropped',
+                                connection_id)
+            return
+        for address in addresses:
+            if self.traffic_log is not None:
+                self.traffic_log.record(SENT, self.peer_ids[address], data)
+            try:
+                self.accept_socket.sendto(data, address)
+            except OSError as err:
+                self.logger.warning('Sending to %s failed: %s', address, err)
 
 
 #------------------------------------------------------------------------------
 
-class HttpDispatcher(Dispatcher):
-    """ Dispatcher subclass for Http connections"""
+class HttpDispatcher(TCPDispatcher):
+    """ Dispatcher subclass for HTTP/1.1 connections
+
+    The system connects as a client.  Connections stay open between
+    requests (keep-alive) and may send the next requests before the
+    responses of the earlier ones (pipelining).  Every request is
+    forwarded to the player as an :class:`httpparser.HttpRequest` with
+    a new ``request_id``.  The player answers with the
+    :class:`httpparser.HttpResponse` of :meth:`HttpRequest.response`,
+    in any order; the responses of a connection are sent in the order
+    of its requests.
+    """
+    #: default largest request line and headers
+    max_header_size = 65536
+    #: default largest request body
+    max_body_size = 16777216
+
     def __init__(self, dispatcher_type, dispatcher_id):
-        Dispatcher.__init__(self, dispatcher_type, dispatcher_id)
-        
-        config = configparser.ConfigParser()
-        config.read('simulator.conf')
-        dispatcher_section = ('dispatcher-{0}-{1}'
-                                  .format(dispatcher_type, dispatcher_id))
+        TCPDispatcher.__init__(self, dispatcher_type, dispatcher_id)
+        #: request parsers by connection id
+        self.parsers = {}
+        #: requests without a sent response by connection id, in order,
+        #: each an ``[request, response]`` list
+        self.pending = {}
+        #: connection ids by request id
+        self.request_connections = {}
+        self._request_counter = itertools.count(1)
 
-        if (dispatcher_section) in config.sections():
-            entries = config[dispatcher_section]
-            # path to the message class
-            self.message_path = entries['MessagePath']
-            if message_path is not None:
-                loader = importlib.machinery.SourceFileLoader('message',
-                                                              message_path)
-                message_module = loader.exec_module('message')
-                message = message_module.Message()
-            # address and port to listen on for messages from the system
-            self.accept_address = entries['AcceptAddress']
-            self.listen_port = entries['ListenPort']
-            
-            # port to listen on for commands from the player.
-            self.command_listen_port = entries['CommandListenPort']
-            # port to forward messages to the player.
-            self.message_forward_port = entries['MessageForwardPort']
-                        
-        else:
-            self.logger.critical('no valid http section found in config file')
+    def configure(self, entries):
+        """Read the settings of the dispatcher, also ``MaxHeaderSize``
+        and ``MaxBodySize``.
+        """
+        TCPDispatcher.configure(self, entries)
+        self.max_header_size = int(entries.get('MaxHeaderSize',
+                                               self.max_header_size))
+        self.max_body_size = int(entries.get('MaxBodySize',
+                                             self.max_body_size))
 
-    def create_sockets(self):
-        """ Create the UDP sockets between the system and the 
-            Scenario player
+    def accept(self, a_socket):
+        """Accept the pending connections, each with its own parser."""
+        known = set(self.connections)
+        TCPDispatcher.accept(self, a_socket)
+        for connection_id in self.connections.keys() - known:
+            # Responses are small and sent one by one; do not let them
+            # wait for the acknowledgement of the previous one.
+            self.connections[connection_id].setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.parsers[connection_id] = RequestParser(
+                    self.max_header_size, self.max_body_size)
+            self.pending[connection_id] = collections.deque()
+
+    def close_connection(self, connection_id):
+        """Close a connection and forget its requests."""
+        TCPDispatcher.close_connection(self, connection_id)
+        del self.parsers[connection_id]
+        for request, unused in self.pending.pop(connection_id):
+            del self.request_connections[request.request_id]
+
+    def process_message(self, a_socket):
+        """ Receive requests from the system and forward them to the
+        player.
         """
-        self.logger.info('Creating sockets for {0} {1}'
-                         .format(self.name, self.dispatcher_id))
-        # Open an UDP socket to listen for new connections 
-        # from the system.
-        self.logger.info("Listening on address {0}"
-                         .format(str(self.accept_address)))
-        self.logger.info("Listening on port {0}".format(str(self.listen_port)))
-        address = "{0}:{1}".format(accept_address, listen_port)
-        accept_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        accept_socket.bind((self.accept_address, self.listen_port))
-        # Let the superclass finish the creation of the rest of the 
-        # sockets, because it is the same.
-        Dispatcher.create_sockets(self, accept_socket)
+        connection_id = self.connection_ids[a_socket]
+        buffer = self.buffers[connection_id]
+        try:
+            count = buffer.recv_into(a_socket)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, FramingException) as err:
+            self.logger.warning('Connection %s failed: %s',
+                                connection_id, err)
+            count = 0
+        if not count:
+            self.close_connection(connection_id)
+            return
+        if connection_id in self._closing:
+            # The last response is still being sent.
+            buffer.clear()
+            return
+        pending = self.pending[connection_id]
+        if pending and not pending[-1][0].keep_alive:
+            # The connection closes after the last response.
+            buffer.clear()
+            return
+        batch = []
+        try:
+            for request in self.parsers[connection_id].requests(buffer):
+                request.request_id = next(self._request_counter)
+                if self.traffic_log is not None:
+                    self.traffic_log.record(RECEIVED, connection_id,
+                                            request.body, request.message_id)
+                pending.append([request, None])
+                self.request_connections[request.request_id] = (
+                        connection_id)
+                if (not self.responses or
+                        self.answer(connection_id, request.body, request)):
+                    batch.append((connection_id, request))
+                if connection_id not in self.connections:
+                    # Closed by the response.
+                    break
+                if not request.keep_alive:
+                    buffer.clear()
+                    break
+        except HttpException as err:
+            self.logger.warning('Connection %s sent an invalid request: '
+                                '%s', connection_id, err)
+            error = HttpResponse(status=400)
+            self.send_data(connection_id, error.to_bytes(False))
+            if connection_id in self.connections:
+                self.close_after_output(connection_id)
+        if batch:
+            self.forward_batch(batch)
+
+    def answer(self, connection_id, data, message):
+        """Answer a request from the response table.
+
+        The response of the rule is the response of this request,
+        whatever its request_id.  See :meth:`Dispatcher.answer`.
+        """
+        rule = self.responses.match(data, message)
+        if rule is None:
+            return True
+        if not isinstance(rule.data, HttpResponse):
+            self.logger.warning('Response rule %s is not an HttpResponse',
+                                rule.key)
+            return True
+        self.pending[connection_id][-1][1] = rule.data
+        self.send_responses(connection_id)
+        return rule.forward
 
-    def process_messsage(self, a_socket):
-        """ Method to process a HTTP request from the system.
+    def inject(self, connection_id, frame):
+        """Forward the body of a request as if the system sent it.
 
-        :param a_socket: the socket on which the message arrives.
-        :type a_socket: socket
+        There is no request to answer, so the response table is not
+        used.  See :meth:`Dispatcher.inject`.
         """
-        self.logger.info('HTTP Request')
-        if self.http_request == None:
-            self.http_request = Message()
+        self.forward(connection_id, self.decode(frame))
+
+    def send_to_system(self, connection_id, response):
+        """Send the response of the player.
 
-        self.logger.info('Parsing request')
-        if self.http_request.from_message(a_socket):
-            self.logger.info('Waiting for more data')
+        The response goes to the connection of its request.  A response
+        without a request_id answers the oldest request without a
+        response of the connection.
+
+        :param connection_id: the id of the connection, only used for
+                              responses without a request_id.
+        :type connection_id: int
+        :param response: the response.
+        :type response: HttpResponse
+        """
+        if not isinstance(response, HttpResponse):
+            self.logger.warning('Command %s is not an HttpResponse, '
+                                'dropped', type(response))
+            return
+        if response.request_id is not None:
+            connection_id = self.request_connections.get(
+                    response.request_id)
+            if connection_id is None:
+                self.logger.warning('No request %s, response dropped',
+                                    response.request_id)
+                return
+            for entry in self.pending[connection_id]:
+                if entry[0].request_id == response.request_id:
+                    entry[1] = response
+                    break
         else:
-            # We received the full request.
-            # Send a reply and close the connection.
-            a_socket.send( "HTTP/1.1 200 OK\n" )
-            self.logger.info('Complete request received.')
-            self.poller.unregister(a_socket)
-            del self.call_backs[ a_socket.fileno() ]
-            a_socket.close()
-            self.client_socket = None
-            self.logger.info('Forwarding request to player')
-            self.forward_socket.send_pyobj(self.http_request)
-            self.http_request = None
-
-    def run(self):
-        # Clean-up
-        if self.forward_socket is not None:
-            self.forward_socket.close()
-        if self.command_socket is not None:
-            self.command_socket.close()
-        if self.accept_socket is not None:
-            self.accept_socket.close()
-        if self.client_socket is not None:
-            self.client_socket.close()
+            for entry in self.pending.get(connection_id, ()):
+                if entry[1] is None:
+                    entry[1] = response
+                    break
+            else:
+                self.logger.warning('No request waits on connection %s, '
+                                    'response dropped', connection_id)
+                return
+        self.send_responses(connection_id)
 
+    def send_responses(self, connection_id):
+        """Send the responses of a connection that are next in line.
 
+        :param connection_id: the id of the connection.
+        :type connection_id: int
+        """
+        pending = self.pending[connection_id]
+        data = []
+        keep_alive = True
+        while pending and pending[0][1] is not None:
+            request, response = pending.popleft()
+            del self.request_connections[request.request_id]
+            keep_alive = request.keep_alive
+            data.append(response.to_bytes(keep_alive))
+            if not keep_alive:
+                break
+        if data:
+            self.send_data(connection_id, b"".join(data))
+        if not keep_alive and connection_id in self.connections:
+            self.close_after_output(connection_id)
+
+    def send_data(self, connection_id, data):
+        """Send data to a connection, see
+        :meth:`Dispatcher.send_to_connection`.
+
+        :param connection_id: the id of the connection.
+        :type connection_id: int
+        :param data: the data.
+        :type data: bytes
+        """
+        if self.traffic_log is not None:
+            self.traffic_log.record(SENT, connection_id, data)
+        self.send_to_connection(connection_id,
+                                self.connections[connection_id], data)
 
+
+def get_dispatcher(dispatcher_type, dispatcher_id):
+    """ Function to get a dispatcher of a specific type.
+
+    :param dispatcher_type: The type of dispatcher to return, one of
+    "tcp", "udp", "serial" or "http".
+    :type dispatcher_type: string
+    :param dispatcher_id: The id of the dispatcher.
+    :raises: DispatcherException for an unknown type.
+    :returns: A new dispatcher, configured from simulator.conf.
+    """
+    dispatchers = {"tcp":TCPDispatcher,
+                   "udp":UDPDispatcher,
+                   "serial":SerialDispatcher,
+                   "http":HttpDispatcher}
+    dispatcher = dispatchers.get(dispatcher_type.lower())
+    if dispatcher is None:
+        raise DispatcherException("Unknown dispatcher type {0}"
+                                  .format(dispatcher_type))
+    return dispatcher(dispatcher_type, dispatcher_id)
@@ -0,0 +1,171 @@
+# vi: spell spl=en
+
+"""Endpoints of the simulators and a registry to find them.
+
+A dispatcher binds its links with the player to zmq endpoints: by
+default ``tcp://*:<port>`` with the ``CommandListenPort`` and
+``MessageForwardPort`` settings, or the ``CommandEndpoint`` and
+``MessageEndpoint`` settings.  These can use any transport:
+
+* ``tcp://*:*`` lets the system pick free ports.
+* ``ipc:///tmp/tcp-0-command`` for processes on the same host, without
+  the cost of the TCP loopback.
+* ``inproc://tcp-0-command`` for a dispatcher in the process of the
+  player; it must use the zmq context of the player, see
+  :meth:`dispatcher.Dispatcher.use_context`.
+
+With the ``EndpointRegistry`` setting a dispatcher announces the
+endpoints it bound, under the name of its simulator, in an
+:class:`EndpointRegistry`.  A hub announces each of its simulators.  The
+player resolves the name, see
+:meth:`testsystem.TestSystem.add_simulator_interface`, so it does not
+need to know the ports.
+"""
+#-----------------------------------------------------------
+import json
+import os
+import tempfile
+import time
+#-----------------------------------------------------------
+
+
+class EndpointException(Exception):
+    """Base class for endpoint exceptions"""
+    pass
+
+
+def bind_address(endpoint=None, port=None):
+    """The address to bind a link with the player to.
+
+    :param endpoint: a zmq endpoint, it goes before the port.
+    :type endpoint: string
+    :param port: a TCP port, None or 0 for a free port.
+    :returns: the zmq endpoint.
+    """
+    if endpoint:
+        return endpoint
+    if not port or int(port) == 0:
+        return "tcp://*:*"
+    return "tcp://*:{0}".format(port)
+
+
+def connect_address(endpoint):
+    """The address to connect to a link with a simulator.
+
+    :param endpoint: a TCP port on the local host, or a zmq endpoint as
+                     it was bound.  A wildcard address is replaced by
+                     the local host.
+    :type endpoint: int or string
+    :returns: the zmq endpoint.
+    """
+    if isinstance(endpoint, int) or '://' not in endpoint:
+        return "tcp://localhost:{0}".format(endpoint)
+    if endpoint.startswith("tcp://"):
+        host, colon, port = endpoint[6:].rpartition(':')
+        if host in ('*', '0.0.0.0', '[::]', '::'):
+            return "tcp://localhost:{0}".format(port)
+    return endpoint
+
+
+class EndpointRegistry(object):
+    """Registry of the endpoints of the simulators on this host.
+
+    Each simulator has a small JSON file in a directory, which is
+    replaced atomically.  An entry of a process that is gone is
+    ignored.
+
+    :param directory: the directory of the registry, the default is
+                      the ``TSTK_ENDPOINTS`` environment variable or
+                      ``tstk-endpoints`` in the temporary directory.
+                      Test systems that run side by side with
+                      simulators of the same name use different
+                      directories.
+    :type directory: string
+    """
+    def __init__(self, directory=None):
+        if not directory:
+            directory = os.environ.get('TSTK_ENDPOINTS') or os.path.join(
+                    tempfile.gettempdir(), 'tstk-endpoints')
+        self.directory = directory
+
+    def _path(self, name):
+        if not name or '/' in name or name.startswith('.'):
+            raise EndpointException("Invalid simulator name {0!r}"
+                                    .format(name))
+        return os.path.join(self.directory, name + '.json')
+
+    def announce(self, name, command_endpoint, message_endpoint):
+        """Announce the endpoints of a simulator.
+
+        :param name: the name of the simulator, for instance "tcp-0".
+        :param command_endpoint: the endpoint the player sends commands
+                                 to.
+        :param message_endpoint: the endpoint the player receives
+                                 messages from.
+        """
+        path = self._path(name)
+        os.makedirs(self.directory, exist_ok=True)
+        entry = {'command':command_endpoint, 'message':message_endpoint,
+                 'pid':os.getpid()}
+        temporary = '{0}.{1}'.format(path, os.getpid())
+        with open(temporary, 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(temporary, path)
+
+    def withdraw(self, name):
+        """Remove the entry of a simulator of this process.
+
+        :param name: the name of the simulator.
+        """
+        path = self._path(name)
+        entry = self._read(path)
+        if entry is not None and entry.get('pid') == os.getpid():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def resolve(self, name, timeout=0):
+        """Find the endpoints of a simulator.
+
+        :param name: the name of the simulator.
+        :param timeout: how long to wait for the simulator to announce
+                        itself, in seconds.
+        :raises: EndpointException if there is no entry.
+        :returns: the command and the message endpoint, ready to
+                  connect to.
+        """
+        path = self._path(name)
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while True:
+            entry = self._read(path)
+            if entry is not None and _alive(entry.get('pid')):
+                return (connect_address(entry['command']),
+                        connect_address(entry['message']))
+            if time.monotonic() >= deadline:
+                raise EndpointException("Simulator {0} is not registered"
+                                        " in {1}".format(name,
+                                                         self.directory))
+            time.sleep(min(delay, max(0, deadline - time.monotonic())))
+            delay = min(2 * delay, 0.1)
+
+    def _read(self, path):
+        try:
+            with open(path) as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+
+def _alive(pid):
+    """True if a process with the pid exists."""
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
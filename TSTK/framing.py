@@ -0,0 +1,338 @@
+# vi: spell spl=en
+
+"""Framing of the byte streams from the system.
+
+A stream socket delivers bytes, not messages: one read can hold part of
+a message or several messages.  A :class:`StreamBuffer` collects the
+bytes of one connection and a framer cuts them into frames:
+
+* ``stream``: everything that was read is one frame, the behaviour
+  without framing.
+* ``fixed``: frames of a fixed size.
+* ``delimiter``: frames that end with a delimiter, for instance
+  ``b"\\r\\n"``.
+* ``length``: frames that start with a length field.
+* ``message``: the message class reports where a frame ends, see
+  :class:`MessageFramer`.
+
+The buffer reads straight into a preallocated ``bytearray`` with
+``recv_into`` and returns the frames as ``memoryview`` slices of it, so
+there are no copies per read.  A frame is only valid until the next
+read into the buffer.
+"""
+#-----------------------------------------------------------
+import codecs
+import struct
+#-----------------------------------------------------------
+
+
+class FramingException(Exception):
+    """Base class for framing exceptions"""
+    pass
+
+
+class StreamBuffer(object):
+    """Receive buffer of one stream.
+
+    The buffer starts small, so many idle connections take little
+    memory.  It grows while the reads fill it, up to ``read_size``, and
+    for a frame that does not fit, up to ``max_size``.
+
+    :param size: the initial size of the buffer.
+    :param max_size: the largest frame that is accepted.
+    :param read_size: the size up to which full reads grow the buffer.
+    """
+    def __init__(self, size=4096, max_size=16777216, read_size=65536):
+        self.max_size = max_size
+        self.read_size = read_size
+        #: the buffer, valid data is ``buffer[start:end]``
+        self.buffer = bytearray(size)
+        #: memoryview on the buffer
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        #: where a framer stopped looking for the end of the frame at
+        #: start, so it does not look at the same bytes again
+        self.searched = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def recv_into(self, a_socket):
+        """Read from a socket into the buffer.
+
+        :param a_socket: the socket.
+        :returns: the number of bytes read, 0 at the end of the stream.
+        """
+        return self.fill(a_socket.recv_into)
+
+    def fill(self, read_into):
+        """Read into the buffer.
+
+        :param read_into: function that reads into a writable buffer
+                          and returns the number of bytes read, such as
+                          ``socket.recv_into`` or ``Serial.readinto``.
+        :returns: the number of bytes read.
+        """
+        if self.end == len(self.buffer):
+            self._make_room()
+        free = len(self.buffer) - self.end
+        count = read_into(self.view[self.end:])
+        if count:
+            self.end += count
+            if count == free and len(self.buffer) < self.read_size:
+                # More data than room, read more at a time.
+                size = min(2 * len(self.buffer), self.read_size,
+                           self.max_size)
+                if size > len(self.buffer):
+                    self._grow(size)
+        return count or 0
+
+    def frames(self, framer):
+        """Cut the complete frames from the buffer.
+
+        :param framer: the framer.
+        :returns: iterator over the frames, as memoryviews.
+        """
+        while self.start < self.end:
+            found = framer.next_frame(self)
+            if found is None:
+                break
+            frame_start, frame_end, next_start = found
+            self.start = next_start
+            yield self.view[frame_start:frame_end]
+        if self.start == self.end:
+            # Start at the front again, that is cheaper than moving.
+            self.start = self.end = self.searched = 0
+
+    def clear(self):
+        """Drop the data in the buffer."""
+        self.start = self.end = self.searched = 0
+
+    def _make_room(self):
+        """Make room at the end of a full buffer."""
+        length = self.end - self.start
+        if self.start >= length:
+            # Move the incomplete frame to the front, the two parts do
+            # not overlap.
+            self.buffer[:length] = self.view[self.start:self.end]
+        else:
+            if length >= self.max_size:
+                raise FramingException("Frame larger than {0} bytes"
+                                       .format(self.max_size))
+            size = len(self.buffer)
+            if not self.start:
+                size = min(2 * size, self.max_size)
+            self._grow(size)
+            return
+        self.searched = max(self.searched - self.start, 0)
+        self.start = 0
+        self.end = length
+
+    def _grow(self, size):
+        """Move the data to a new buffer of a size."""
+        length = self.end - self.start
+        # A new buffer; the old one might still be exported by the
+        # frames of the last read.
+        buffer = bytearray(size)
+        buffer[:length] = self.view[self.start:self.end]
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.searched = max(self.searched - self.start, 0)
+        self.start = 0
+        self.end = length
+
+
+class StreamFramer(object):
+    """Each read is a frame."""
+    def next_frame(self, stream):
+        """Find the first frame in a stream buffer.
+
+        :param stream: the buffer, its data is never empty.
+        :type stream: StreamBuffer
+        :returns: a ``(frame_start, frame_end, next_start)`` tuple of
+                  positions in the buffer, or None if the frame is not
+                  complete.
+        """
+        return (stream.start, stream.end, stream.end)
+
+
+class FixedSizeFramer(object):
+    """Frames of a fixed size.
+
+    :param size: the size of a frame.
+    """
+    def __init__(self, size):
+        if size < 1:
+            raise FramingException("Frame size must be positive")
+        self.size = size
+
+    def next_frame(self, stream):
+        """See :meth:`StreamFramer.next_frame`"""
+        end = stream.start + self.size
+        if end > stream.end:
+            return None
+        return (stream.start, end, end)
+
+
+class DelimiterFramer(object):
+    """Frames that end with a delimiter.
+
+    :param delimiter: the delimiter.
+    :type delimiter: bytes
+    :param strip: leave the delimiter out of the frame.
+    :type strip: bool
+    """
+    def __init__(self, delimiter=b"\n", strip=False):
+        if not delimiter:
+            raise FramingException("Empty delimiter")
+        self.delimiter = delimiter
+        self.strip = strip
+
+    def next_frame(self, stream):
+        """See :meth:`StreamFramer.next_frame`
+
+        Only the bytes that arrived since the last call are searched,
+        and the end of the delimiter before them.
+        """
+        position = stream.buffer.find(
+                self.delimiter,
+                max(stream.start, stream.searched - len(self.delimiter) + 1),
+                stream.end)
+        if position < 0:
+            stream.searched = stream.end
+            return None
+        end = position + len(self.delimiter)
+        return (stream.start, position if self.strip else end, end)
+
+
+class LengthPrefixFramer(object):
+    """Frames with a length field.
+
+    The frame is ``offset`` bytes, the length field of ``size`` bytes
+    and ``length + adjust`` more bytes.
+
+    :param size: the size of the length field, 1, 2, 4 or 8.
+    :param byte_order: "big" or "little".
+    :param offset: the position of the length field in the frame.
+    :param adjust: added to the length field, for instance ``-4`` if
+                   the length includes a 4 byte header.
+    :param strip: leave the bytes up to and including the length field
+                  out of the frame.
+    :type strip: bool
+    """
+    _formats = {1:'B', 2:'H', 4:'I', 8:'Q'}
+
+    def __init__(self, size=4, byte_order="big", offset=0, adjust=0,
+                 strip=False):
+        if size not in self._formats:
+            raise FramingException("Invalid length field size {0}"
+                                   .format(size))
+        self.header = struct.Struct(
+                ('>' if byte_order == "big" else '<') + self._formats[size])
+        self.offset = offset
+        self.adjust = adjust
+        self.strip = strip
+
+    def next_frame(self, stream):
+        """See :meth:`StreamFramer.next_frame`"""
+        header_end = stream.start + self.offset + self.header.size
+        if header_end > stream.end:
+            return None
+        length = self.header.unpack_from(stream.buffer,
+                                         header_end - self.header.size)[0]
+        end = header_end + length + self.adjust
+        if end < header_end:
+            raise FramingException("Invalid frame length {0}"
+                                   .format(length))
+        if end > stream.end:
+            return None
+        return (header_end if self.strip else stream.start, end, end)
+
+
+class MessageFramer(object):
+    """The message class finds the end of a frame.
+
+    The message class implements ``frame_length(data)``.  ``data`` is a
+    memoryview on the received bytes, which start with a frame.  It
+    returns the length of the frame, or None if it can not tell yet.
+    A frame is only returned once all its bytes have arrived.
+
+    :param message: instance of the message class.
+    """
+    def __init__(self, message):
+        if not hasattr(message, 'frame_length'):
+            raise FramingException("The message class has no "
+                                   "frame_length()")
+        self.message = message
+
+    def next_frame(self, stream):
+        """See :meth:`StreamFramer.next_frame`"""
+        length = self.message.frame_length(
+                stream.view[stream.start:stream.end])
+        if length is None:
+            return None
+        if length < 1:
+            raise FramingException("Invalid frame length {0}"
+                                   .format(length))
+        end = stream.start + length
+        if end > stream.end:
+            return None
+        return (stream.start, end, end)
+
+
+def get_framer(framing_type, **kwargs):
+    """ Function to get a framer of a specific type.
+
+    :param framing_type: The type of framer to return, one of
+    "stream", "fixed", "delimiter", "length" or "message".
+    :type framing_type: string
+    :param kwargs: Extra arguments for the framer.
+    :raises: FramingException for an unknown type.
+    :returns: A new framer of the specified type.
+    """
+    framers = {"stream":StreamFramer,
+               "fixed":FixedSizeFramer,
+               "delimiter":DelimiterFramer,
+               "length":LengthPrefixFramer,
+               "message":MessageFramer}
+    framer = framers.get(framing_type)
+    if framer is None:
+        raise FramingException("Unknown framing type {0}"
+                               .format(framing_type))
+    return framer(**kwargs)
+
+
+def configure_framer(entries, message=None):
+    """ Function to get the framer from the section of a dispatcher in
+    simulator.conf.
+
+    The type comes from ``Framing``, the default is "stream".  The
+    other settings are ``FrameSize`` for "fixed", ``Delimiter`` (with
+    escapes such as ``\\r\\n``) and ``StripDelimiter`` for "delimiter",
+    and ``LengthSize``, ``ByteOrder``, ``LengthOffset``,
+    ``LengthAdjust`` and ``StripHeader`` for "length".
+
+    :param entries: the section of the dispatcher.
+    :type entries: configparser.SectionProxy
+    :param message: instance of the message class, for "message".
+    :returns: A new framer.
+    """
+    framing_type = entries.get('Framing', 'stream')
+    kwargs = {}
+    if framing_type == "fixed":
+        kwargs['size'] = int(entries['FrameSize'])
+    elif framing_type == "delimiter":
+        if 'Delimiter' in entries:
+            kwargs['delimiter'] = codecs.escape_decode(
+                    entries['Delimiter'].encode())[0]
+        kwargs['strip'] = entries.getboolean('StripDelimiter', False)
+    elif framing_type == "length":
+        kwargs['size'] = int(entries.get('LengthSize', 4))
+        kwargs['byte_order'] = entries.get('ByteOrder', 'big')
+        kwargs['offset'] = int(entries.get('LengthOffset', 0))
+        kwargs['adjust'] = int(entries.get('LengthAdjust', 0))
+        kwargs['strip'] = entries.getboolean('StripHeader', False)
+    elif framing_type == "message":
+        kwargs['message'] = message
+    return get_framer(framing_type, **kwargs)
@@ -0,0 +1,252 @@
+# vi: spell spl=en
+
+"""Incremental parser of HTTP/1.1 requests.
+
+The HTTP dispatcher reads the bytes of a connection into a
+:class:`framing.StreamBuffer` and a :class:`RequestParser` takes the
+complete requests out of it.  The parser keeps its state between reads,
+so a request can arrive in any number of pieces and one read can hold
+several pipelined requests.  Bodies are read by ``Content-Length`` or
+``Transfer-Encoding: chunked``.
+
+The scenario player gets each request as an :class:`HttpRequest` and
+answers it with an :class:`HttpResponse` that carries the
+``request_id`` of the request, see :meth:`HttpRequest.response`.
+"""
+#-----------------------------------------------------------
+from http import HTTPStatus
+#-----------------------------------------------------------
+
+
+class HttpException(Exception):
+    """Base class for HTTP exceptions"""
+    pass
+
+
+class HttpRequest(object):
+    """A request from the system.
+
+    The ``message_id`` is the path of the target without the query, so
+    the player can set a callback per path.
+    """
+    def __init__(self, method, target, version, headers, body=b""):
+        #: correlation id, set by the dispatcher
+        self.request_id = None
+        self.method = method
+        self.target = target
+        self.version = version
+        #: header values by lower case name
+        self.headers = headers
+        self.body = body
+        self.message_id = target.split('?', 1)[0]
+
+    @property
+    def keep_alive(self):
+        """True if the connection stays open after the response."""
+        connection = self.headers.get('connection', '').lower()
+        if self.version == "HTTP/1.0":
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def response(self, status=200, body=b"", headers=None):
+        """Create the response to this request.
+
+        :param status: the status code.
+        :type status: int
+        :param body: the body.
+        :type body: bytes
+        :param headers: extra headers.
+        :type headers: dict
+        :returns: an HttpResponse with the request_id of the request.
+        """
+        return HttpResponse(self.request_id, status, body, headers)
+
+    def __repr__(self):
+        return 'HttpRequest({0}, {1!r}, {2!r})'.format(
+                self.request_id, self.method, self.target)
+
+
+class HttpResponse(object):
+    """A response of the player.
+
+    :param request_id: the request_id of the request, None for the
+                       oldest request of the connection without a
+                       response.
+    :param status: the status code.
+    :type status: int
+    :param body: the body, the ``Content-Length`` header is added.
+    :type body: bytes
+    :param headers: extra headers.
+    :type headers: dict
+    """
+    def __init__(self, request_id=None, status=200, body=b"",
+                 headers=None):
+        self.request_id = request_id
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    def to_bytes(self, keep_alive=True):
+        """The response as it is sent to the system.
+
+        :param keep_alive: False to close the connection afterwards.
+        :type keep_alive: bool
+        """
+        try:
+            reason = HTTPStatus(self.status).phrase
+        except ValueError:
+            reason = ''
+        lines = ['HTTP/1.1 {0} {1}'.format(self.status, reason)]
+        for name, value in self.headers.items():
+            lines.append('{0}: {1}'.format(name, value))
+        lines.append('Content-Length: {0}'.format(len(self.body)))
+        if not keep_alive:
+            lines.append('Connection: close')
+        lines.append('\r\n')
+        return '\r\n'.join(lines).encode('latin-1') + bytes(self.body)
+
+
+class RequestParser(object):
+    """Parser of the requests on one connection.
+
+    :param max_header_size: the largest request line and headers.
+    :param max_body_size: the largest body.
+    """
+    def __init__(self, max_header_size=65536, max_body_size=16777216):
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        # the request of which the body is being read
+        self._request = None
+        self._body = None
+        # bytes left of the body or chunk, None while reading a chunk
+        # size line, -1 after the last chunk
+        self._remaining = 0
+        self._chunked = False
+        # bytes of the head that were searched for its end already
+        self._scanned = 0
+
+    def requests(self, stream):
+        """Take the complete requests out of a stream buffer.
+
+        :param stream: the buffer of the connection.
+        :type stream: framing.StreamBuffer
+        :raises: HttpException for an invalid request.
+        :returns: iterator over the requests.
+        """
+        while stream.start < stream.end:
+            if self._request is None:
+                if not self._read_head(stream):
+                    break
+            if not self._read_body(stream):
+                break
+            request = self._request
+            request.body = bytes(self._body)
+            self._request = self._body = None
+            yield request
+        if stream.start == stream.end:
+            stream.clear()
+
+    def _read_head(self, stream):
+        """Parse the request line and headers, if they are complete."""
+        search = max(stream.start, stream.start + self._scanned - 3)
+        position = stream.buffer.find(b"\r\n\r\n", search, stream.end)
+        if position < 0:
+            self._scanned = len(stream)
+            if self._scanned > self.max_header_size:
+                raise HttpException("Request head larger than {0} bytes"
+                                    .format(self.max_header_size))
+            return False
+        self._scanned = 0
+        head = bytes(stream.view[stream.start:position]).decode('latin-1')
+        stream.start = position + 4
+        lines = head.split('\r\n')
+        parts = lines[0].split(' ')
+        if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+            raise HttpException("Invalid request line {0!r}"
+                                .format(lines[0]))
+        headers = {}
+        for line in lines[1:]:
+            name, colon, value = line.partition(':')
+            if not colon or not name or name != name.strip():
+                raise HttpException("Invalid header {0!r}".format(line))
+            name = name.lower()
+            value = value.strip()
+            if name in headers:
+                value = headers[name] + ', ' + value
+            headers[name] = value
+        self._request = HttpRequest(parts[0], parts[1], parts[2], headers)
+        self._body = bytearray()
+        encoding = headers.get('transfer-encoding', '').lower()
+        self._chunked = encoding.endswith('chunked')
+        if self._chunked:
+            self._remaining = None
+        else:
+            try:
+                self._remaining = int(headers.get('content-length', 0))
+            except ValueError:
+                raise HttpException("Invalid Content-Length")
+            if self._remaining < 0:
+                raise HttpException("Invalid Content-Length")
+            self._check_size(self._remaining)
+        return True
+
+    def _read_body(self, stream):
+        """Read the body as far as it has arrived.
+
+        :returns: True if the body is complete.
+        """
+        if not self._chunked:
+            return self._take(stream)
+        while True:
+            if self._remaining is None:
+                # chunk size line, chunk extensions are ignored
+                position = stream.buffer.find(b"\r\n", stream.start,
+                                              stream.end)
+                if position < 0:
+                    return False
+                line = bytes(stream.view[stream.start:position])
+                stream.start = position + 2
+                try:
+                    size = int(line.split(b';', 1)[0], 16)
+                except ValueError:
+                    raise HttpException("Invalid chunk size {0!r}"
+                                        .format(line))
+                if size == 0:
+                    self._remaining = -1
+                else:
+                    self._check_size(size)
+                    # the chunk and its CRLF
+                    self._remaining = size + 2
+            elif self._remaining < 0:
+                # trailer lines, ignored, up to an empty line
+                position = stream.buffer.find(b"\r\n", stream.start,
+                                              stream.end)
+                if position < 0:
+                    return False
+                empty = position == stream.start
+                stream.start = position + 2
+                if empty:
+                    return True
+            else:
+                if not self._take(stream):
+                    return False
+                if self._body[-2:] != b"\r\n":
+                    raise HttpException("Chunk without CRLF")
+                del self._body[-2:]
+                self._remaining = None
+
+    def _take(self, stream):
+        """Move the remaining bytes of the body or chunk to the body.
+
+        :returns: True if all remaining bytes were there.
+        """
+        count = min(self._remaining, stream.end - stream.start)
+        self._body += stream.view[stream.start:stream.start + count]
+        stream.start += count
+        self._remaining -= count
+        return self._remaining == 0
+
+    def _check_size(self, size):
+        if len(self._body) + size > self.max_body_size:
+            raise HttpException("Body larger than {0} bytes"
+                                .format(self.max_body_size))
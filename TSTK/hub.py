@@ -0,0 +1,136 @@
+# vi: spell spl=en
+
+"""Many simulators in one process.
+
+Every simulator normally runs in a daemon of its own, with its own
+interpreter, zmq context and pair of ports for the player.  A hub runs
+the dispatchers of many simulators in one process and one event loop.
+The player reaches all of them over one pair of links; the topic frame
+of each message tells which simulator it is for or comes from, see
+:func:`serializer.simulator_topic`.
+
+The hub is configured in simulator.conf, for instance::
+
+    [dispatcher-hub-0]
+    CommandListenPort = 9000
+    MessageForwardPort = 9001
+    Simulators = tcp-0, tcp-1, serial-0
+
+Each simulator is configured in its own section, ``[dispatcher-tcp-0]``
+and so on, as when it runs on its own; its ``CommandListenPort`` and
+``MessageForwardPort`` are not used.  The topic of a simulator is its
+name, "tcp-0", or its ``Topic`` setting.  The player creates its
+simulator interfaces with the ports of the hub and the topic of the
+simulator.  A hosted simulator keeps its ``TrafficLog`` or ``Capture``
+but cannot ``Replay`` a capture: the replay would stop the event loop
+of all simulators.  The hub also takes the ``CommandEndpoint``,
+``MessageEndpoint`` and ``EndpointRegistry`` settings, see
+:mod:`endpoints`; it announces the endpoints of its links under the name
+of every simulator it hosts.
+"""
+#-----------------------------------------------------------
+import configparser
+
+from dispatcher import Dispatcher, get_dispatcher
+from endpoints import EndpointRegistry
+#-----------------------------------------------------------
+
+
+class Hub(Dispatcher):
+    """ Runs the dispatchers of many simulators in one event loop.
+
+    The hub is a dispatcher without a system of its own.  The hosted
+    dispatchers register their sockets in the poller of the hub and
+    publish on the message link of the hub.  The hub receives all
+    commands and passes each to the dispatcher of its topic.
+    """
+    #: poll timeout in ms when no dispatcher needs a shorter one
+    default_timeout = 60000
+
+    def __init__(self, dispatcher_type, dispatcher_id):
+        Dispatcher.__init__(self, dispatcher_type, dispatcher_id)
+        #: the hosted dispatchers by topic
+        self.dispatchers = {}
+
+        config = configparser.ConfigParser()
+        config.read('simulator.conf')
+        dispatcher_section = ('dispatcher-{0}-{1}'
+                                  .format(dispatcher_type, dispatcher_id))
+
+        if (dispatcher_section) in config.sections():
+            entries = config[dispatcher_section]
+            self.command_listen_port = entries.get('CommandListenPort')
+            self.message_forward_port = entries.get('MessageForwardPort')
+            self.command_endpoint = entries.get('CommandEndpoint')
+            self.message_endpoint = entries.get('MessageEndpoint')
+            if 'EndpointRegistry' in entries:
+                self.registry = EndpointRegistry(entries['EndpointRegistry'])
+            for name in entries['Simulators'].split(','):
+                simulator_type, simulator_id = name.strip().rsplit('-', 1)
+                self.add_dispatcher(get_dispatcher(simulator_type,
+                                                   simulator_id))
+        else:
+            self.logger.critical('no valid hub section found in config file')
+
+    def add_dispatcher(self, a_dispatcher):
+        """Host a dispatcher, before :meth:`create_sockets`.
+
+        :param a_dispatcher: the dispatcher.
+        :type a_dispatcher: Dispatcher
+        """
+        if a_dispatcher.topic in self.dispatchers:
+            self.logger.critical('Two simulators with topic %s',
+                                 a_dispatcher.topic)
+            return
+        if a_dispatcher.replay_path:
+            self.logger.error('Replay of %s is not possible in a hub, '
+                              'ignored', a_dispatcher.simulator_name)
+            a_dispatcher.replay_path = None
+        a_dispatcher.join_hub(self)
+        self.dispatchers[a_dispatcher.topic] = a_dispatcher
+
+    def open_traffic_log(self):
+        """Open the captures and traffic logs of the hub and of all
+        dispatchers."""
+        Dispatcher.open_traffic_log(self)
+        for a_dispatcher in self.dispatchers.values():
+            a_dispatcher.open_traffic_log()
+
+    def create_sockets(self):
+        """ Create the links with the player and the sockets of all
+        dispatchers
+        """
+        self.logger.info('Creating sockets for {0} {1}'
+                         .format(self.name, self.dispatcher_id))
+        self.create_player_links()
+        for a_dispatcher in self.dispatchers.values():
+            a_dispatcher.create_sockets()
+            self.announce(a_dispatcher.simulator_name)
+
+    def process_player_command(self, a_socket):
+        """ Pass a command of the player to the dispatcher of its topic.
+        """
+        frames = a_socket.recv_multipart(copy=False)
+        a_dispatcher = self.dispatchers.get(frames[0].bytes)
+        if a_dispatcher is None:
+            self.logger.warning('No simulator for topic %s, command '
+                                'dropped', frames[0].bytes)
+            return
+        a_dispatcher.process_command(frames[1:])
+
+    def after_poll(self, events):
+        """Let every dispatcher look at the poll, the shortest timeout
+        wins.
+        """
+        timeout = self.default_timeout
+        for a_dispatcher in self.dispatchers.values():
+            a_dispatcher.after_poll(events)
+            timeout = min(timeout, a_dispatcher.timeout)
+        self.timeout = timeout
+
+    def shutdown(self):
+        """Shut down all dispatchers and close their traffic logs."""
+        for a_dispatcher in self.dispatchers.values():
+            a_dispatcher.shutdown()
+            if a_dispatcher.traffic_log is not None:
+                a_dispatcher.traffic_log.close()
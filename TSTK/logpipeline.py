@@ -0,0 +1,323 @@
+# vi: spell spl=en
+
+"""Logging that stays off the hot path of the dispatchers.
+
+A dispatcher logs through a :class:`LogPipeline`: the logger only puts
+the records on a queue, and a thread formats and writes them.  The
+records are not formatted before they are queued, so a record that is
+never written costs almost nothing, and a :class:`CategoryFilter` drops
+records of busy categories before they are queued::
+
+    self.logger.info('Frame %s', HexDump(frame), extra=TRAFFIC)
+
+The filter passes one in ``sample`` records of a category, and at most
+``rate`` per second.  The next record of the category that passes tells
+how many were suppressed.  In simulator.conf, for instance::
+
+    LogRate.traffic = 100
+    LogSample.alive = 1000
+
+A :class:`TrafficLog` keeps the bytes the system sent and received in a
+compact binary file, apart from the text log, see :func:`read_traffic`.
+"""
+#-----------------------------------------------------------
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import struct
+import threading
+import time
+import weakref
+#-----------------------------------------------------------
+
+#: extra of the records of each message or command
+TRAFFIC = {'category':'traffic'}
+#: extra of the records of each pass of a poll loop
+ALIVE = {'category':'alive'}
+
+#: direction of a frame from the system
+RECEIVED = 0
+#: direction of a frame to the system
+SENT = 1
+
+#: start of a traffic log
+TRAFFIC_MAGIC = b"TSTK-traffic-1\n"
+#: header of a frame in a traffic log: monotonic time in ns, connection
+#: id, direction and length
+TRAFFIC_RECORD = struct.Struct('<QIBI')
+
+# the pipelines by logger name
+_pipelines = {}
+# the open traffic logs
+_traffic_logs = weakref.WeakSet()
+
+
+class LogPipelineException(Exception):
+    """Base class for log pipeline exceptions"""
+    pass
+
+
+class HexDump(object):
+    """ Formats bytes as hex, only when the record is written.
+
+    :param data: the bytes, they are copied.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = bytes(data)
+
+    def __str__(self):
+        return self.data.hex(',')
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """ Queues records without formatting them.
+
+    The message is formatted by the handlers of the writer thread.  The
+    arguments must not change in the meantime: buffers are copied, and
+    exceptions are formatted right away.
+    """
+    def prepare(self, record):
+        if record.exc_info or record.stack_info:
+            return logging.handlers.QueueHandler.prepare(self, record)
+        if isinstance(record.args, tuple):
+            record.args = tuple(bytes(arg) if isinstance(
+                                    arg, (memoryview, bytearray)) else arg
+                                for arg in record.args)
+        return record
+
+
+class CategoryFilter(logging.Filter):
+    """ Samples and rate limits the records per category.
+
+    The category of a record is its ``category`` attribute, see
+    :data:`TRAFFIC`.  Records without a category, or of a category
+    without limits, pass.
+    """
+    def __init__(self):
+        logging.Filter.__init__(self)
+        # [sample, rate, burst, count, tokens, time, suppressed] by
+        # category
+        self.limits = {}
+        self._lock = threading.Lock()
+
+    def limit(self, category, rate=None, burst=None, sample=1):
+        """Limit the records of a category.
+
+        :param category: the category.
+        :type category: string
+        :param rate: the maximum records per second, None for no limit.
+        :type rate: float
+        :param burst: the records that may pass at once, the default is
+                      a second worth of records.
+        :type burst: float
+        :param sample: pass one in this many records.
+        :type sample: int
+        """
+        if rate is not None and burst is None:
+            burst = max(1.0, rate)
+        with self._lock:
+            self.limits[category] = [int(sample), rate, burst, 0, burst,
+                                     time.monotonic(), 0]
+
+    def filter(self, record):
+        limit = self.limits.get(getattr(record, 'category', None))
+        if limit is None:
+            return True
+        with self._lock:
+            limit[3] += 1
+            if limit[3] < limit[0]:
+                limit[6] += 1
+                return False
+            limit[3] = 0
+            if limit[1] is not None:
+                now = time.monotonic()
+                limit[4] = min(limit[2],
+                               limit[4] + (now - limit[5]) * limit[1])
+                limit[5] = now
+                if limit[4] < 1:
+                    limit[6] += 1
+                    return False
+                limit[4] -= 1
+            suppressed = limit[6]
+            limit[6] = 0
+        if suppressed and isinstance(record.args, tuple):
+            msg = str(record.msg)
+            if not record.args:
+                # without arguments the message was never formatted
+                msg = msg.replace('%', '%%')
+            record.msg = '{0} [%d suppressed]'.format(msg)
+            record.args = record.args + (suppressed,)
+        return True
+
+
+class LogPipeline(object):
+    """ Writes the records of a logger on a thread of its own.
+
+    :param logger: the logger.
+    :type logger: logging.Logger
+    :param handlers: the handlers that write the records.
+    """
+    def __init__(self, logger, *handlers):
+        self.queue = queue.SimpleQueue()
+        #: the filter of the records before they are queued
+        self.filter = CategoryFilter()
+        self.handler = LazyQueueHandler(self.queue)
+        self.handler.addFilter(self.filter)
+        self.listener = logging.handlers.QueueListener(
+                self.queue, *handlers, respect_handler_level=True)
+        self.logger = logger
+        logger.addHandler(self.handler)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def restart(self):
+        """Start the thread again, with an empty queue, in a forked
+        child.
+        """
+        if self.listener._thread is None:
+            return
+        self.queue = queue.SimpleQueue()
+        self.handler.queue = self.listener.queue = self.queue
+        self.listener._thread = None
+        self.listener.start()
+
+    def stop(self):
+        """Write the queued records and stop the thread."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.logger.removeHandler(self.handler)
+        atexit.unregister(self.stop)
+
+
+def get_pipeline(logger, *handlers):
+    """ The pipeline of a logger, a new one with the handlers if it has
+    none.
+
+    :param logger: the logger.
+    :type logger: logging.Logger
+    :param handlers: the handlers that write the records.
+    :returns: the pipeline, None if there is none and no handlers are
+              given.
+    """
+    pipeline = _pipelines.get(logger.name)
+    if pipeline is None or pipeline.handler not in logger.handlers:
+        if not handlers:
+            return None
+        pipeline = LogPipeline(logger, *handlers)
+        _pipelines[logger.name] = pipeline
+    return pipeline
+
+
+class TrafficLog(object):
+    """ A binary log of the frames to and from the system.
+
+    The frames are copied and written on a thread of its own.  Each
+    frame is a :data:`TRAFFIC_RECORD` followed by the bytes.
+
+    :param path: the file to write, the frames are added to those
+                 that are in it.
+    :type path: string
+    :raises: LogPipelineException if the file is not a traffic log.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self._file = open(path, 'a+b')
+        self._file.seek(0)
+        magic = self._file.read(len(TRAFFIC_MAGIC))
+        if not magic:
+            self._file.write(TRAFFIC_MAGIC)
+        elif magic != TRAFFIC_MAGIC:
+            self._file.close()
+            raise LogPipelineException("{0} is not a traffic log"
+                                       .format(path))
+        # Not written twice by a forked child.
+        self._file.flush()
+        self._start()
+        atexit.register(self.close)
+        _traffic_logs.add(self)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._write,
+                                        name='traffic-log', daemon=True)
+        self._thread.start()
+
+    def restart(self):
+        """Start the thread again, with an empty queue, in a forked
+        child.
+        """
+        self.queue = queue.SimpleQueue()
+        self._start()
+
+    def record(self, direction, connection_id, data, message_id=None):
+        """Log a frame.
+
+        :param direction: RECEIVED or SENT.
+        :param connection_id: the connection of the frame.
+        :type connection_id: int
+        :param data: the frame.
+        :param message_id: not logged, for the same calls as
+                           :meth:`capture.CaptureWriter.record`.
+        """
+        self.queue.put((time.monotonic_ns(), connection_id, direction,
+                        bytes(data)))
+
+    def _write(self):
+        pack = TRAFFIC_RECORD.pack
+        write = self._file.write
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                break
+            write(pack(entry[0], entry[1], entry[2], len(entry[3])))
+            write(entry[3])
+            if self.queue.empty():
+                self._file.flush()
+        self._file.close()
+
+    def close(self):
+        """Write the queued frames and close the file."""
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+        atexit.unregister(self.close)
+        _traffic_logs.discard(self)
+
+
+def _after_fork():
+    """A forked child, such as a daemon, only has the thread that
+    forked: start the threads of the pipelines and traffic logs again.
+    """
+    for pipeline in list(_pipelines.values()):
+        pipeline.restart()
+    for traffic_log in list(_traffic_logs):
+        traffic_log.restart()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def read_traffic(path):
+    """ Read a traffic log.
+
+    :param path: the file.
+    :type path: string
+    :raises: LogPipelineException if it is not a traffic log.
+    :returns: a generator of ``(time_ns, connection_id, direction,
+              data)`` tuples.
+    """
+    with open(path, 'rb') as traffic_file:
+        if traffic_file.read(len(TRAFFIC_MAGIC)) != TRAFFIC_MAGIC:
+            raise LogPipelineException("{0} is not a traffic log"
+                                       .format(path))
+        while True:
+            header = traffic_file.read(TRAFFIC_RECORD.size)
+            if len(header) < TRAFFIC_RECORD.size:
+                return
+            time_ns, connection_id, direction, length = (
+                    TRAFFIC_RECORD.unpack(header))
+            yield (time_ns, connection_id, direction,
+                   traffic_file.read(length))
@@ -0,0 +1,114 @@
+# vi: spell spl=en
+
+"""Run test scenario's in parallel in a pool of processes.
+
+Normally a lab host runs one test script at a time, see
+:meth:`testsystem.TestSystem.kill_previous_script`.  The runner in
+this module starts every scenario in its own process with its own
+:class:`testsystem.TestSystem` and scenario player.  Each scenario
+gets its own lock namespace, so the scenario's do not kill each other.
+
+Each scenario also gets its own range of ports, but only for its
+simulator interfaces: they connect to ``port_base`` and the next port.
+The runner does not start or configure simulators, the dispatchers
+read their ports from simulator.conf.  So give every scenario its own
+simulators, or a hub, configured on the ports of its range.  A
+simulator cannot be shared by scenario's that run at the same time, a
+scenario that adds an interface on the ports of a simulator that
+another scenario uses fails, see
+:meth:`testsystem.TestSystem.claim_simulator`.
+
+A scenario is a function that takes the test system.  It adds the
+simulator interfaces, drivers and steps and returns.  The runner then
+plays the scenario.  The function must be defined at module level, so
+it can be passed to another process.
+"""
+#-----------------------------------------------------------
+import collections
+import os
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor
+
+import testsystem
+#-----------------------------------------------------------
+
+#: Result of a scenario.  ``passed`` is False if the scenario raised an
+#: exception, ``error`` then holds the formatted traceback.  ``value``
+#: is what the scenario function returned.  ``duration`` is the wall
+#: clock time in seconds.
+ScenarioResult = collections.namedtuple('ScenarioResult',
+        ['name', 'passed', 'value', 'error', 'duration', 'port_base'])
+
+
+def run_scenario(name, scenario, lock_namespace=None, port_base=None,
+                 engine="poller"):
+    """Set up a test system, let the scenario add its steps and play it.
+
+    :param name: The name of the scenario, also used for the test system.
+    :type name: string
+    :param scenario: Function that takes the test system.
+    :type scenario: function
+    :param lock_namespace: See :class:`testsystem.TestSystem`.
+    :type lock_namespace: string
+    :param port_base: See :class:`testsystem.TestSystem`.
+    :type port_base: int
+    :param engine: See :meth:`testsystem.TestSystem.add_scenario_player`.
+    :type engine: string
+    :returns: a :data:`ScenarioResult`.
+    """
+    start = time.monotonic()
+    test_system = testsystem.TestSystem(name, lock_namespace, port_base)
+    try:
+        test_system.add_scenario_player(engine=engine)
+        value = scenario(test_system)
+        test_system.play()
+    except Exception:
+        return ScenarioResult(name, False, None, traceback.format_exc(),
+                              time.monotonic() - start, port_base)
+    finally:
+        # The process might run more scenario's.
+        test_system.lock.close()
+        test_system.release_simulators()
+        if test_system.scenario_player is not None:
+            test_system.scenario_player.context.destroy(linger=0)
+    return ScenarioResult(name, True, value, None,
+                          time.monotonic() - start, port_base)
+
+
+def run_parallel(scenarios, processes=None, base_port=20000,
+                 ports_per_scenario=10, lock_namespace="parallel",
+                 engine="poller"):
+    """Run scenario's in parallel and collect the results.
+
+    :param scenarios: ``(name, scenario)`` pairs, see :func:`run_scenario`.
+    :type scenarios: iterable
+    :param processes: The number of processes, the default is the
+                      number of cores.
+    :type processes: int
+    :param base_port: The first port of the port ranges.  Scenario
+                      ``n`` gets the ports from
+                      ``base_port + n * ports_per_scenario``, for its
+                      simulator interfaces, see the module.
+    :type base_port: int
+    :param ports_per_scenario: The number of ports per scenario.
+    :type ports_per_scenario: int
+    :param lock_namespace: Prefix of the lock namespaces, scenario
+                           ``n`` uses ``<lock_namespace>-<n>``.
+    :type lock_namespace: string
+    :param engine: See :meth:`testsystem.TestSystem.add_scenario_player`.
+    :type engine: string
+    :returns: a list of :data:`ScenarioResult`, in the order of
+              ``scenarios``.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = []
+        for number, (name, scenario) in enumerate(scenarios):
+            futures.append(executor.submit(
+                run_scenario, name, scenario,
+                '{0}-{1}'.format(lock_namespace, number),
+                base_port + number * ports_per_scenario, engine))
+        return [future.result() for future in futures]
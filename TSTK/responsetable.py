@@ -0,0 +1,140 @@
+# vi: spell spl=en
+
+"""Responses that a dispatcher sends without the scenario player.
+
+Heartbeats and acknowledgements of the system need an answer, but not a
+decision of the player.  The player installs rules in the dispatcher,
+with :meth:`simulatorinterface.SimulatorInterface.set_response`.  A rule
+matches the ``message_id`` of a message, or a prefix of its bytes, and
+the dispatcher sends the response of the rule right away.  By default
+the message is still forwarded to the player, so the scenario can check
+it.
+
+The response is encoded once, when the rule is installed.  Matching is
+a dictionary lookup of the message id, then one lookup per prefix
+length, longest first.
+"""
+#-----------------------------------------------------------
+from serializer import register_message_class
+#-----------------------------------------------------------
+
+
+class ResponseTableException(Exception):
+    """Base class for response table exceptions"""
+    pass
+
+
+# Sent to the dispatcher on msgpack links too.
+@register_message_class
+class ResponseRule(object):
+    """A response of the dispatcher to the messages that match.
+
+    Give either a message id or a prefix.
+
+    :param response: the response, as the player would send it.
+    :param message_id: the ``message_id`` of the messages to answer.
+    :param prefix: the first bytes of the messages to answer.
+    :type prefix: bytes
+    :param forward: also forward the messages to the player.
+    :type forward: bool
+    """
+    def __init__(self, response, message_id=None, prefix=None,
+                 forward=True):
+        if (message_id is None) == (prefix is None):
+            raise ResponseTableException("A rule needs either a message "
+                                         "id or a prefix")
+        if prefix is not None and not prefix:
+            raise ResponseTableException("Empty prefix")
+        self.response = response
+        self.message_id = message_id
+        self.prefix = None if prefix is None else bytes(prefix)
+        self.forward = forward
+        #: the encoded response, set by the dispatcher
+        self.data = None
+
+    @property
+    def key(self):
+        """What the rule matches, the key to remove it."""
+        return rule_key(self.message_id, self.prefix)
+
+
+def rule_key(message_id=None, prefix=None):
+    """The key of the rule for a message id or a prefix.
+
+    :returns: a ``("message_id", message_id)`` or ``("prefix", prefix)``
+              tuple.
+    """
+    if prefix is not None:
+        return ("prefix", bytes(prefix))
+    return ("message_id", message_id)
+
+
+class ResponseTable(object):
+    """The rules of a dispatcher."""
+    def __init__(self):
+        #: rules by message id
+        self.by_id = {}
+        #: rules by prefix
+        self.by_prefix = {}
+        # the prefix lengths, longest first
+        self._lengths = []
+
+    def __len__(self):
+        return len(self.by_id) + len(self.by_prefix)
+
+    def add(self, rule):
+        """Add a rule, it replaces a rule with the same key.
+
+        :param rule: the rule.
+        :type rule: ResponseRule
+        """
+        if rule.prefix is None:
+            self.by_id[rule.message_id] = rule
+        else:
+            self.by_prefix[rule.prefix] = rule
+            self._update_lengths()
+
+    def remove(self, key):
+        """Remove a rule.
+
+        :param key: the key of the rule, see :func:`rule_key`.
+        :returns: True if there was such a rule.
+        """
+        kind, value = key
+        table = self.by_prefix if kind == "prefix" else self.by_id
+        if table.pop(value, None) is None:
+            return False
+        if kind == "prefix":
+            self._update_lengths()
+        return True
+
+    def clear(self):
+        """Remove all rules."""
+        self.by_id.clear()
+        self.by_prefix.clear()
+        self._lengths = []
+
+    def match(self, data, message):
+        """Find the rule for a message.
+
+        A rule for the message id goes before a rule for a prefix, and
+        a longer prefix before a shorter one.
+
+        :param data: the bytes of the message.
+        :param message: the decoded message.
+        :returns: the rule, or None.
+        """
+        if self.by_id:
+            rule = self.by_id.get(getattr(message, 'message_id', None))
+            if rule is not None:
+                return rule
+        size = len(data)
+        for length in self._lengths:
+            if length <= size:
+                rule = self.by_prefix.get(bytes(data[:length]))
+                if rule is not None:
+                    return rule
+        return None
+
+    def _update_lengths(self):
+        self._lengths = sorted(set(map(len, self.by_prefix)), reverse=True)
@@ -11,11 +11,18 @@ import sys
 import os
 import zmq
 import re
+import weakref
 
-from queue             import PriorityQueue
-from inspect           import getargspec
+from inspect           import signature, Parameter
+from scheduler         import get_scheduler
 #-----------------------------------------------------------
 
+#: Nanoseconds per second, the scenario clock counts nanoseconds.
+NANOSECONDS = 1000000000
+
+#: zmq.POLLIN as plain integer, bit operations on the zmq flag enum are
+#: slow.
+POLLIN = int(zmq.POLLIN)
 
 class ScenarioPlayerException(Exception):
     """Base class for ScenarioPlayer exceptions"""
@@ -26,18 +33,39 @@ class TimeSpecException(Exception):
     pass
 
 class ScenarioPlayer(object):
-    """Stores and executes test scenario's"""
-    def __init__(self, test_system):
-        #: queue for the test steps
-        self.priority_queue = PriorityQueue()
+    """Stores and executes test scenario's
+
+    :param test_system: test system this scenario is part of.
+    :param scheduler: the scheduler that keeps the test steps, either
+    the name of a scheduler type (see :func:`scheduler.get_scheduler`)
+    or a scheduler object.
+    """
+    def __init__(self, test_system, scheduler="heap"):
+        #: scheduler for the test steps
+        if isinstance(scheduler, str):
+            scheduler = get_scheduler(scheduler)
+        self.scheduler = scheduler
+        #: monotonic time in ns at the start of the scenario
         self._start_time = None
 
+        #: Below this many nanoseconds before a deadline the player
+        #: stops sleeping in poll() and checks the sockets and the
+        #: clock in a busy loop.  poll() only has a resolution of a
+        #: millisecond.
+        self.spin_time = 1000000
+
+        #: lateness of the executed steps
+        self.lateness = LatenessHistogram()
+
         #: flag to indicate a scenario should be run or stopped
         self.runit = 1
 
         #: array with information about which function to call
         #: when data arrives at a particular socket.
         self.call_backs = {}
+        # Incremented on every change of call_backs, each entry holds
+        # the generation in which it was added.
+        self._generation = 0
         self.logger = logging.getLogger('ScenarioPlayer')
 
         #: test system this scenario is part of
@@ -73,9 +101,9 @@ class ScenarioPlayer(object):
         :param when: tells when it is to be executed.
 
         The steps in scenario are executed approximately at the time 
-        specified. If the time interval between two steps is large
-        (1 s or more) it will be a close approximation.  If the time 
-        interval is small (<0.1) the execution can be slightly delayed. 
+        specified, normally within a few microseconds.  A step is
+        delayed when the steps or call backs before it take longer
+        than the time in between.  See :attr:`lateness`.
         :type when: int, float, string
         :param step: a reference to a function that takes a
         single parameter, a reference to the scenario player.
@@ -107,93 +135,215 @@ class ScenarioPlayer(object):
         "when" values in the queue that are the same.
         :type priority: integer
         """
-        if not isinstance(when, int):
-            if not isinstance(when, float):
-                when = parse_timespec(when)
+        when = to_nanoseconds(when) + self._offset()
+
+        # Resolve how to call the step now, so executing it is a
+        # direct call.
+        self._push(when, priority, (step, self.step_arguments(step), None))
+
+
+    def add_periodic_step(self, interval, priority, step, start=0,
+                          end=None, count=None):
+        """Add a step that is executed repeatedly.
+
+        The step is executed at ``start``, ``start + interval``,
+        ``start + 2 * interval`` and so on.  Only the next occurrence
+        is kept in the scheduler, it is added when the previous one is
+        executed.  The times are computed from ``start``, so a late
+        occurrence does not delay the ones after it.
+
+        :param interval: time between two executions of the step.
+        :type interval: int, float, string
+        :param priority: See :meth:`add_step`.
+        :type priority: integer
+        :param step: See :meth:`add_step`.
+        :type step: function
+        :param start: time of the first execution, see ``when`` in
+        :meth:`add_step`.
+        :type start: int, float, string
+        :param end: no executions after this time, measured like
+        ``start``.  Without ``end`` and ``count`` the step repeats
+        until the scenario is stopped.
+        :type end: int, float, string
+        :param count: the maximum number of executions.
+        :type count: integer
+        """
+        interval = to_nanoseconds(interval)
+        if interval <= 0:
+            raise ScenarioPlayerException("Interval must be positive")
+        offset = self._offset()
+        first = to_nanoseconds(start) + offset
+        if end is not None:
+            end = to_nanoseconds(end) + offset
+        if (count is not None and count < 1) or (
+                end is not None and first > end):
+            return
+        arguments = self.step_arguments(step)
+        series = _periodic_series(first, interval, end, count, step,
+                                  arguments)
+        self._push(first, priority, (step, arguments, series))
+
+
+    def add_steps(self, steps, priority=1):
+        """Add a series of steps.
+
+        The steps are taken from ``steps`` one at a time, the next
+        step is only added to the scheduler when the previous one is
+        executed.  So ``steps`` can be a generator that describes a
+        long scenario without creating all the steps up front.
+
+        :param steps: ``(when, step)`` pairs, sorted on ``when``.  See
+        :meth:`add_step` for the meaning of ``when`` and ``step``.
+        :type steps: iterable
+        :param priority: See :meth:`add_step`.
+        :type priority: integer
+        """
+        series = _step_series(steps, self._offset(), self.step_arguments)
+        self._add_next(series, priority)
 
-        if not self._start_time is None:
-            # Scenario is running. Need to add an offset to the 
-            # delta_time to keep the queue properly sorted.
-            current_time = time.time()
-            offset = current_time - self._start_time
-            when = when + offset
 
-        self.priority_queue.put((when, priority, step))
+    def _offset(self):
+        """Return the offset to add to times passed to the add methods.
 
+        If the scenario is running, times are relative to the current
+        time, otherwise to the start of the scenario.
 
-    def execute_step(self, step):
+        :returns: the offset in nanoseconds.
+        """
+        if self._start_time is None:
+            return 0
+        # Scenario is running. Need to add an offset to the 
+        # delta_time to keep the queue properly sorted.
+        return time.monotonic_ns() - self._start_time
+
+
+    def _add_next(self, series, priority):
+        """Add the next step of a series to the scheduler, if any."""
+        for when, step, arguments in series:
+            self._push(when, priority, (step, arguments, series))
+            break
+
+
+    def _push(self, when, priority, item):
+        """Add an item to the scheduler.
+
+        All steps are added through this method, so a subclass can
+        react on new steps.
+        """
+        self.scheduler.push(when, priority, item)
+
+
+    def step_arguments(self, step):
+        """Return the arguments to call the given step with.
+
+        A step that takes a parameter is called with the test system,
+        other steps are called without arguments.  The signature of a
+        step is only inspected the first time, see
+        :func:`takes_test_system`.
+
+        :param step: a reference to a function.
+        :type step: function
+        :returns: a tuple with the arguments.
+        """
+        if takes_test_system(step):
+            return (self.test_system,)
+        return ()
+
+
+    def execute_step(self, step, arguments=None):
         """
         Execute the given step and log this.
         
         :param step:a reference to a function that takes a
         single parameter, a reference to the scenario player.
         :type step: function 
+        :param arguments: the arguments to call the step with, as
+        returned by :meth:`step_arguments`.  Looked up when not given.
+        :type arguments: tuple
+        :returns: the result of the step.
         """
-        argspec = getargspec(step)
+        if arguments is None:
+            arguments = self.step_arguments(step)
         # Execute the step
-        # Does the step require a parameter?
-        if len(argspec.args) > 0 and argspec.args[0] == 'self' :
-            if len(argspec.args) == 2:
-                step(self.test_system)
-            else :
-                step()
-        else:
-            if len(argspec.args) == 1:
-                step(self.test_system)
-            else :
-                step()
-        self.logger.info("executing " + str(step))
+        result = step(*arguments)
+        self.logger.info("executing %s", step)
+        return result
 
 
     def play(self):
         """
         Play the current scenario.
 
-        Uses select() to wait for passing of time until the next step 
+        Uses poll() to wait for passing of time until the next step 
         in the scenario and for events on the registered sockets or 
         other file handles.
+
+        The deadlines of the steps are fixed points on the scenario
+        clock, the monotonic time in nanoseconds since the start of the
+        scenario.
+        The first step is only looked at while waiting, it is taken
+        from the scheduler when it is actually executed.  So events on
+        the sockets do not move the steps around in the scheduler and
+        do not add to the timing error.
+
+        The last :attr:`spin_time` nanoseconds before a deadline are
+        spent in a busy loop, so steps are executed within a few
+        microseconds of their deadline.  How late each step was
+        executed is recorded in :attr:`lateness`.
         """
         self.runit = 1
-        self._start_time = time.time()
+        self._start_time = time.monotonic_ns()
         self.logger.info("starting scenario")
-        last_commit_time = time.time()
-        while (not self.priority_queue.empty()) and (self.runit):
+        while self.runit:
             # Next step in the scenario
-            (delta_time, step) = self.priority_queue.get()
+            entry = self.scheduler.peek()
+            if entry is None:
+                break
+            deadline = entry[0]
 
-            current_time = time.time()
             # When should the step fire?
-            expected_time = self._start_time + delta_time
-            # print expected_time, current_time
-            if (current_time >= expected_time):
-                self.execute_step(step)
+            remaining = deadline - (time.monotonic_ns() - self._start_time)
+            if remaining <= 0:
+                self.lateness.record(-remaining)
+                (deadline, priority, (step, arguments, series)) = (
+                        self.scheduler.pop())
+                if series is not None:
+                    # Keep a single entry per series in the scheduler.
+                    self._add_next(series, priority)
+                self.execute_step(step, arguments)
             else:
-                # This results in a dictionary that contains
-                # as a key the fileno to normal sockets, or
-                # the reference to a zmq socket.
-                # The value is the status  (zmq.POLLIN)
-                socks = dict(self.poller.poll( 
-                    1000*(expected_time - current_time)))
-                # Enough time has passed?
-                current_time = time.time()
-                if (current_time >= expected_time):
-                    self.execute_step(step)
-                else:
-                    # Put the step back in the queue, because handling 
-                    # of the filehandle event might add new events that
-                    # come before this event.
-                    delta_time = expected_time - current_time
-                    self.add_step(delta_time, step)
-                    # Handle the filehandle events
-                    for socket_key in self.call_backs.copy(): 
-                            # Need copy here cause we might modify 
-                            # the call_backs while in the call back
-                            # functions.
-                        if socket_key in socks and ( 
-                                socks[socket_key] == zmq.POLLIN):
-                            callb = self.call_backs[socket_key]
-                            function = callb[1]
-                            function(callb[0], self)
+                # Handling of these events might add new steps that
+                # come before the current first step, so the first
+                # step is looked up again afterwards.
+                # Sleep until spin_time before the deadline, after
+                # that only check for events.
+                self.poll_sockets(
+                    max(0, remaining - self.spin_time) // 1000000)
+
+
+    def poll_sockets(self, timeout):
+        """Wait for events on the registered sockets and call the call
+        backs of the sockets that are ready.
+
+        Only the ready sockets are looked at.  A call back may add or
+        remove sockets: a removed socket is skipped, and a socket that
+        is added during this round waits for the next poll, also when
+        it reuses the key of a removed socket.
+
+        :param timeout: maximum time to wait, in milliseconds.
+        :type timeout: int
+        """
+        generation = self._generation
+        call_backs = self.call_backs
+        # This results in a list of tuples that contain the fileno of
+        # normal sockets, or the reference to a zmq socket, and the
+        # status (zmq.POLLIN)
+        for socket_key, event in self.poller.poll(timeout):
+            callb = call_backs.get(socket_key)
+            if callb is None or callb[2] > generation:
+                continue
+            if event & POLLIN:
+                callb[1](callb[0], self)
 
 
     def stop(self):
@@ -218,16 +368,9 @@ class ScenarioPlayer(object):
         """
         self.logger.info("adding socket " + str(a_socket))
         self.poller.register(a_socket, zmq.POLLIN)
-        # This is needed because poller.poll returns
-        # a list with filenumbers for normal sockets andl
-        # references to zmq sockets.
-        try:
-            self.call_backs[a_socket.fileno()] = ( 
-                    a_socket, call_back_function)
-        except AttributeError:
-            # This handles zmq sockets.
-            self.call_backs[a_socket] = ( 
-                    a_socket, call_back_function)
+        self._generation += 1
+        self.call_backs[poll_key(a_socket)] = (
+                a_socket, call_back_function, self._generation)
 
     def remove_socket(self, a_socket):
         """Remove the given socket from the lost of socket to 
@@ -238,10 +381,189 @@ class ScenarioPlayer(object):
         """
         self.logger.info("removing socket " + str(a_socket))
         self.poller.unregister(a_socket)
-        try:
-            del self.call_backs[a_socket.fileno()]
-        except AttributeError:
-            del self.call_backs[a_socket]
+        self._generation += 1
+        del self.call_backs[poll_key(a_socket)]
+
+
+class LatenessHistogram(object):
+    """Histogram of the lateness of the executed steps.
+
+    The buckets grow in powers of two: bucket 0 counts steps that were
+    less than a microsecond late, bucket ``n`` the steps that were
+    between ``2 ** (n - 1)`` and ``2 ** n`` microseconds late.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all recorded values."""
+        #: number of steps per bucket
+        self.counts = []
+        #: number of recorded steps
+        self.count = 0
+        #: total lateness in nanoseconds
+        self.total = 0
+        #: the largest lateness in nanoseconds
+        self.maximum = 0
+
+    def record(self, lateness):
+        """Record the lateness of a step.
+
+        :param lateness: lateness in nanoseconds.
+        :type lateness: int
+        """
+        bucket = (lateness // 1000).bit_length()
+        counts = self.counts
+        if bucket >= len(counts):
+            counts.extend([0] * (bucket + 1 - len(counts)))
+        counts[bucket] += 1
+        self.count += 1
+        self.total += lateness
+        if lateness > self.maximum:
+            self.maximum = lateness
+
+    def mean(self):
+        """Return the mean lateness in nanoseconds."""
+        if not self.count:
+            return 0
+        return self.total / self.count
+
+    def percentile(self, percentage):
+        """Return an upper bound for the given percentile.
+
+        :param percentage: the percentile, between 0 and 100.
+        :returns: the upper bound, in nanoseconds, of the bucket that
+        holds the percentile.
+        """
+        wanted = self.count * percentage / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return min(self.maximum, 1000 * (1 << bucket))
+        return self.maximum
+
+    def buckets(self):
+        """Return the histogram.
+
+        :returns: a list of ``(upper bound in nanoseconds, count)``
+        tuples, one per bucket.
+        """
+        return [(1000 * (1 << bucket), count)
+                for bucket, count in enumerate(self.counts)]
+
+
+def _periodic_series(first, interval, end, count, step, arguments):
+    """Generate the occurrences of a periodic step after the first.
+
+    :returns: an iterator of ``(when, step, arguments)`` tuples.
+    """
+    number = 1
+    while count is None or number < count:
+        when = first + number * interval
+        if end is not None and when > end:
+            return
+        yield (when, step, arguments)
+        number += 1
+
+def _step_series(steps, offset, step_arguments):
+    """Generate the entries for the steps added with
+    :meth:`ScenarioPlayer.add_steps`.
+
+    :returns: an iterator of ``(when, step, arguments)`` tuples.
+    """
+    for when, step in steps:
+        yield (to_nanoseconds(when) + offset, step, step_arguments(step))
+
+
+#: The number of positional parameters of the steps, see
+#: :func:`takes_test_system`.  Weak references are used, so the cache
+#: does not keep the steps alive.
+_positional_counts = weakref.WeakKeyDictionary()
+
+def takes_test_system(step):
+    """Tell if a step must be called with the test system as parameter.
+
+    A step that takes at least one positional parameter gets the test
+    system.  For a bound method the instance does not count.  The
+    result is cached per function, bound methods share the entry of
+    the function they are bound to.
+
+    :param step: a reference to a function or other callable.
+    :returns: True if the step takes a parameter.
+    """
+    function = getattr(step, '__func__', step)
+    try:
+        count = _positional_counts[function]
+    except KeyError:
+        count = _count_positional(function)
+        _positional_counts[function] = count
+    except TypeError:
+        # Can not be weakly referenced, for instance a builtin.
+        count = _count_positional(function)
+    if function is not step:
+        # Bound method, the instance is passed by Python.
+        count -= 1
+    return count > 0
+
+def _count_positional(function):
+    """Count the positional parameters of a function.
+
+    A function that takes ``*args`` counts as taking one more.
+    """
+    try:
+        parameters = signature(function).parameters.values()
+    except ValueError:
+        # No signature available, call it without parameters.
+        return 0
+    count = 0
+    for parameter in parameters:
+        if parameter.kind in (Parameter.POSITIONAL_ONLY,
+                              Parameter.POSITIONAL_OR_KEYWORD,
+                              Parameter.VAR_POSITIONAL):
+            count += 1
+    return count
+
+
+def poll_key(a_socket):
+    """Return the key under which a zmq poller reports events for
+    the given socket.
+
+    This is needed because poller.poll returns a list with file
+    numbers for normal sockets and references to zmq sockets.  Note
+    that zmq sockets have a fileno() method too.
+
+    :param a_socket: socket or file handle registered with a poller.
+    :type a_socket: socket or zmq socket
+    """
+    if isinstance(a_socket, zmq.Socket):
+        return a_socket
+    try:
+        return a_socket.fileno()
+    except AttributeError:
+        # Already a file number.
+        return a_socket
+
+def to_seconds(when):
+    """Convert a time given as number or timespec to seconds.
+
+    :param when: a number of seconds or a string, see
+    :func:`parse_timespec`.
+    :type when: int, float, string
+    """
+    if not isinstance(when, int):
+        if not isinstance(when, float):
+            when = parse_timespec(when)
+    return when
+
+def to_nanoseconds(when):
+    """Convert a time given as number of seconds or timespec to an
+    integer number of nanoseconds.
+
+    :param when: See :func:`to_seconds`.
+    :type when: int, float, string
+    """
+    return int(round(to_seconds(when) * NANOSECONDS))
 
 def parse_timespec(timespec):
     """
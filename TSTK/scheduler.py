@@ -0,0 +1,283 @@
+# vi: spell spl=en
+
+"""Scheduler backends for the scenario player.
+
+A scheduler keeps the pending steps of a scenario ordered on their
+deadline.  Every backend offers the same small interface:
+
+* ``push(when, priority, item)`` adds an item,
+* ``peek()`` returns the first ``(when, priority, item)`` entry without
+  removing it, or ``None`` if the scheduler is empty,
+* ``pop()`` removes and returns the first entry,
+* ``len()`` and ``empty()`` tell how many items are pending.
+
+Entries with the same ``when`` are ordered on ``priority`` and after
+that on the order in which they were pushed.
+"""
+#-----------------------------------------------------------
+import heapq
+import itertools
+
+from queue             import PriorityQueue, Empty
+#-----------------------------------------------------------
+
+
+class SchedulerException(Exception):
+    """Base class for scheduler exceptions"""
+    pass
+
+
+class HeapScheduler(object):
+    """Scheduler based on a plain binary heap.
+
+    Insert and removal are O(log n).  This backend is not thread safe,
+    it is meant to be used from the thread that plays the scenario.
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def empty(self):
+        """Return True if there are no pending items."""
+        return not self._heap
+
+    def push(self, when, priority, item):
+        """Add an item to the scheduler.
+
+        :param when: deadline of the item.
+        :type when: int, float
+        :param priority: secondary priority for items with the same
+        deadline.
+        :type priority: integer
+        :param item: the item to schedule.
+        """
+        heapq.heappush(self._heap,
+                       (when, priority, next(self._counter), item))
+
+    def peek(self):
+        """Return the first entry without removing it.
+
+        :returns: a ``(when, priority, item)`` tuple, or None if the
+        scheduler is empty.
+        """
+        if not self._heap:
+            return None
+        when, priority, unused, item = self._heap[0]
+        return (when, priority, item)
+
+    def pop(self):
+        """Remove and return the first entry.
+
+        :raises: SchedulerException if the scheduler is empty.
+        :returns: a ``(when, priority, item)`` tuple.
+        """
+        if not self._heap:
+            raise SchedulerException("pop from an empty scheduler")
+        when, priority, unused, item = heapq.heappop(self._heap)
+        return (when, priority, item)
+
+
+class PriorityQueueScheduler(object):
+    """Scheduler based on the thread safe :class:`queue.PriorityQueue`.
+
+    This is the backend the scenario player always used.  Use it when
+    steps are added from other threads than the one that plays the
+    scenario.
+    """
+    def __init__(self):
+        self._queue = PriorityQueue()
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def empty(self):
+        """Return True if there are no pending items."""
+        return self._queue.empty()
+
+    def push(self, when, priority, item):
+        """See :meth:`HeapScheduler.push`"""
+        self._queue.put((when, priority, next(self._counter), item))
+
+    def peek(self):
+        """See :meth:`HeapScheduler.peek`"""
+        with self._queue.mutex:
+            if not self._queue.queue:
+                return None
+            when, priority, unused, item = self._queue.queue[0]
+        return (when, priority, item)
+
+    def pop(self):
+        """See :meth:`HeapScheduler.pop`"""
+        try:
+            when, priority, unused, item = self._queue.get_nowait()
+        except Empty:
+            raise SchedulerException("pop from an empty scheduler")
+        return (when, priority, item)
+
+
+class TimerWheelScheduler(object):
+    """Scheduler based on a hierarchical timer wheel.
+
+    The deadlines are rounded down to ticks of ``resolution``.  Each
+    level of the wheel has ``slots`` slots, a slot in level ``n``
+    covers ``slots ** n`` ticks.  Inserting an item and expiring it are
+    O(1), apart from the moves to a lower level when the wheel turns
+    (at most ``levels`` moves per item).  Items that are beyond the
+    range of the wheel are kept in an overflow heap.
+
+    Items that are due (their tick is at or before the current position
+    of the wheel) are kept in a small heap, so items within the same
+    tick still come out in the order of ``(when, priority)``.
+
+    The wheel only moves forward when the next entry is asked for, it
+    does not follow the clock.  An item with a deadline before the
+    current position of the wheel is simply due right away.
+    This backend is not thread safe.
+
+    :param resolution: the size of one tick, in the unit of the
+    deadlines.  The default is a millisecond on the nanosecond clock
+    of the scenario player.
+    :param slots: number of slots per level, must be a power of two.
+    :param levels: number of levels.
+    """
+    def __init__(self, resolution=1000000, slots=256, levels=4):
+        if slots & (slots - 1) or slots < 2:
+            raise SchedulerException("slots must be a power of two")
+        self.resolution = resolution
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._slots = slots
+        self._levels = [[[] for unused in range(slots)]
+                        for unused in range(levels)]
+        #: number of items per level
+        self._level_counts = [0] * levels
+        #: ticks beyond the range of the wheel
+        self._overflow = []
+        #: items that are due
+        self._ready = []
+        #: current position of the wheel in ticks
+        self._cursor = None
+        self._count = 0
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return self._count
+
+    def empty(self):
+        """Return True if there are no pending items."""
+        return self._count == 0
+
+    def push(self, when, priority, item):
+        """See :meth:`HeapScheduler.push`"""
+        entry = (when, priority, next(self._counter), item)
+        tick = int(when // self.resolution)
+        if self._cursor is None:
+            # Start the wheel just before the first item.
+            self._cursor = tick - 1
+        self._insert(tick, entry)
+        self._count += 1
+
+    def peek(self):
+        """See :meth:`HeapScheduler.peek`"""
+        if not self._ready:
+            if not self._count:
+                return None
+            self._advance()
+        when, priority, unused, item = self._ready[0]
+        return (when, priority, item)
+
+    def pop(self):
+        """See :meth:`HeapScheduler.pop`"""
+        if not self._ready:
+            if not self._count:
+                raise SchedulerException("pop from an empty scheduler")
+            self._advance()
+        when, priority, unused, item = heapq.heappop(self._ready)
+        self._count -= 1
+        return (when, priority, item)
+
+    def _insert(self, tick, entry):
+        """Put an entry in the ready heap or in the right slot."""
+        cursor = self._cursor
+        if tick <= cursor:
+            heapq.heappush(self._ready, entry)
+            return
+        bits = self._bits
+        shift = 0
+        for level, slots in enumerate(self._levels):
+            # The lowest level in which the tick shares all higher
+            # bits with the cursor.
+            if (tick >> (shift + bits)) == (cursor >> (shift + bits)):
+                slots[(tick >> shift) & self._mask].append((tick, entry))
+                self._level_counts[level] += 1
+                return
+            shift += bits
+        heapq.heappush(self._overflow, (tick, entry))
+
+    def _advance(self):
+        """Turn the wheel until there is at least one due item."""
+        bits = self._bits
+        mask = self._mask
+        while not self._ready:
+            for level, slots in enumerate(self._levels):
+                if not self._level_counts[level]:
+                    continue
+                shift = bits * level
+                current = (self._cursor >> shift) & mask
+                # Items in a level always lie after the cursor, in the
+                # current turn of that level.
+                for index in range(current + 1, self._slots):
+                    if slots[index]:
+                        break
+                else:
+                    raise SchedulerException("timer wheel is corrupt")
+                # Jump to the start of the slot and spread its items
+                # over the lower levels.
+                upper = (self._cursor >> (shift + bits)) << (shift + bits)
+                self._cursor = upper | (index << shift)
+                entries = slots[index]
+                slots[index] = []
+                self._level_counts[level] -= len(entries)
+                if level == 0:
+                    # All items in a slot of the lowest level have the
+                    # same tick, they are all due now.
+                    self._ready = [entry for unused, entry in entries]
+                    heapq.heapify(self._ready)
+                else:
+                    for tick, entry in entries:
+                        self._insert(tick, entry)
+                break
+            else:
+                # The wheel is empty, restart it at the first
+                # overflowing item.
+                tick, entry = heapq.heappop(self._overflow)
+                self._cursor = tick
+                heapq.heappush(self._ready, entry)
+                while self._overflow and self._overflow[0][0] >> (
+                        bits * len(self._levels)) == tick >> (
+                        bits * len(self._levels)):
+                    self._insert(*heapq.heappop(self._overflow))
+
+
+def get_scheduler(scheduler_type, **kwargs):
+    """ Function to get a scheduler of a specific type.
+
+    :param scheduler_type: The type of scheduler to return, one of
+    "heap", "queue" or "wheel".
+    :type scheduler_type: string
+    :param kwargs: Extra arguments for the scheduler.
+    :raises: SchedulerException for an unknown type.
+    :returns: A new scheduler of the specified type.
+    """
+    schedulers = {"heap":HeapScheduler,
+                  "queue":PriorityQueueScheduler,
+                  "wheel":TimerWheelScheduler}
+    scheduler = schedulers.get(scheduler_type)
+    if scheduler is None:
+        raise SchedulerException("Unknown scheduler type {0}"
+                                 .format(scheduler_type))
+    return scheduler(**kwargs)
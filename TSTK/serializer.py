@@ -0,0 +1,539 @@
+# vi: spell spl=en
+
+"""Serializers for the messages between the simulator interfaces and
+the dispatchers.
+
+Both sides of a link must use the same serializer.  A message is sent
+as two zmq frames: a one byte tag that names the serializer and the
+payload.  A receiver that gets a message with another tag raises a
+:class:`SerializerException`, so a mismatch in the configuration shows
+up right away.
+
+The available serializers are:
+
+* ``pickle``: any picklable object.  Compact, but tied to the Python
+  version.
+* ``msgpack``: the MessagePack format.  Plain data (None, bool, int,
+  float, str, bytes, lists, tuples and dicts) and the objects of the
+  message classes that are registered with
+  :func:`register_message_class`.  Uses the ``msgpack`` package if it
+  is installed, otherwise a pure Python implementation of the same
+  format.
+* ``raw``: bytes only, sent and received without copying.  The
+  dispatcher then forwards the data of the system as is and passes the
+  commands of the player to the system as is, without the message
+  class.
+
+On the links between a simulator interface and a dispatcher the tag is
+preceded by a frame with the id of the connection of the dispatcher the
+message came from or is meant for, see :func:`send_connection_id`.  A
+dispatcher can forward a batch of messages as one zmq message, the
+frames of the messages then follow each other.  The zmq message starts
+with a topic frame, see :func:`simulator_topic` and
+:func:`message_topic`; a batch only holds messages with the same topic.
+"""
+#-----------------------------------------------------------
+import pickle
+import struct
+
+import zmq
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+#-----------------------------------------------------------
+
+
+class SerializerException(Exception):
+    """Base class for serializer exceptions"""
+    pass
+
+
+#: connection id of commands for all connections of a dispatcher, and of
+#: messages from dispatchers that do not have separate connections
+BROADCAST = 0
+
+#: connection id of control messages of the player for a dispatcher
+#: itself, such as the rules of its response table.  They are sent with
+#: the serializer of the link, see :attr:`Serializer.control_serializer`.
+CONTROL = 0xFFFFFFFF
+
+#: ends the name of a simulator in a topic frame
+TOPIC_END = b"/"
+
+_CONNECTION_ID = struct.Struct('!I')
+
+def simulator_topic(name):
+    """The topic frame of a simulator.
+
+    Every message on the links between the player and the simulators
+    starts with a topic frame, so that one pair of links can carry the
+    messages of many simulators.  The name ends with :data:`TOPIC_END`,
+    so that a subscription to "tcp-1" does not match "tcp-10".
+
+    :param name: the name of the simulator, for instance "tcp-0".
+    :type name: string
+    :returns: the topic frame.
+    """
+    return name.encode() + TOPIC_END
+
+def message_topic(topic, message_id):
+    """The topic frame of the messages with a message id.
+
+    The message id follows the topic of the simulator, so a simulator
+    interface can subscribe to the message ids it has callbacks for.
+    Messages without a message id have the topic of the simulator.
+
+    :param topic: the topic frame of the simulator.
+    :type topic: bytes
+    :param message_id: the message id.
+    :returns: the topic frame.
+    """
+    return topic + str(message_id).encode() + TOPIC_END
+
+
+def send_connection_id(a_socket, connection_id, flags=0):
+    """Send the connection id frame that starts a message.
+
+    :param a_socket: the zmq socket.
+    :param connection_id: the id of the connection, or BROADCAST.
+    :type connection_id: int
+    :param flags: extra zmq flags, for instance zmq.NOBLOCK.
+    """
+    a_socket.send(pack_connection_id(connection_id), flags | zmq.SNDMORE)
+
+def recv_connection_id(a_socket, flags=0):
+    """Receive the connection id frame that starts a message.
+
+    :param a_socket: the zmq socket.
+    :param flags: extra zmq flags, for instance zmq.NOBLOCK.
+    :raises: SerializerException if the frame is not a connection id.
+    :returns: the connection id.
+    """
+    return unpack_connection_id(a_socket.recv(flags))
+
+def pack_connection_id(connection_id):
+    """The connection id frame for a connection id."""
+    return _CONNECTION_ID.pack(connection_id)
+
+def unpack_connection_id(frame):
+    """The connection id in a connection id frame.
+
+    :param frame: the frame.
+    :type frame: bytes
+    :raises: SerializerException if the frame is not a connection id.
+    """
+    if len(frame) != _CONNECTION_ID.size:
+        raise SerializerException("Message does not start with a "
+                                  "connection id")
+    return _CONNECTION_ID.unpack(frame)[0]
+
+
+class Serializer(object):
+    """Base class for the serializers.
+
+    Subclasses implement :meth:`dumps` and :meth:`loads` and set
+    ``tag``.
+    """
+    #: tag frame that identifies the serializer
+    tag = None
+    #: True if the payload is the raw data of the system
+    raw = False
+
+    def dumps(self, obj):
+        """Serialize an object.
+
+        :returns: a bytes-like object.
+        """
+        raise NotImplementedError
+
+    def loads(self, buf):
+        """Deserialize an object.
+
+        :param buf: the payload.
+        :type buf: bytes-like object
+        """
+        raise NotImplementedError
+
+    def send(self, a_socket, obj, flags=0):
+        """Send an object over a zmq socket.
+
+        :param a_socket: the zmq socket.
+        :param obj: the object to send.
+        :param flags: extra zmq flags, for instance zmq.NOBLOCK.
+        """
+        a_socket.send(self.tag, flags | zmq.SNDMORE)
+        a_socket.send(self.dumps(obj), flags, copy=False)
+
+    def recv(self, a_socket, flags=0):
+        """Receive an object from a zmq socket.
+
+        :param a_socket: the zmq socket.
+        :param flags: extra zmq flags, for instance zmq.NOBLOCK.
+        :raises: SerializerException if the message was sent with
+        another serializer.
+        :returns: the object.
+        """
+        frames = a_socket.recv_multipart(flags, copy=False)
+        if len(frames) != 2:
+            raise SerializerException("Message has {0} frames"
+                                      .format(len(frames)))
+        return self.from_frames(frames[0], frames[1])
+
+    @property
+    def control_serializer(self):
+        """The serializer of the control messages on a link with this
+        serializer, see :data:`CONTROL`: the same one."""
+        return self
+
+    def to_frames(self, obj):
+        """Serialize an object into its frames.
+
+        :returns: the tag and the payload.
+        """
+        return (self.tag, self.dumps(obj))
+
+    def from_frames(self, tag, payload):
+        """Deserialize an object from its frames.
+
+        :param tag: the tag frame.
+        :type tag: zmq.Frame
+        :param payload: the payload frame.
+        :type payload: zmq.Frame
+        :raises: SerializerException if the message was sent with
+        another serializer, or can not be deserialized.
+        :returns: the object.
+        """
+        if tag.bytes != self.tag:
+            raise SerializerException(
+                    "Message is not in {0} format".format(
+                        type(self).__name__))
+        try:
+            return self.loads(payload.buffer)
+        except SerializerException:
+            raise
+        except Exception as err:
+            # pickle raises about anything for a damaged message.
+            raise SerializerException("Invalid {0} message: {1!r}".format(
+                                          type(self).__name__, err)) from err
+
+
+class PickleSerializer(Serializer):
+    """Serializer based on pickle."""
+    tag = b'P'
+
+    def dumps(self, obj):
+        """See :meth:`Serializer.dumps`"""
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, buf):
+        """See :meth:`Serializer.loads`"""
+        return pickle.loads(buf)
+
+
+class RawSerializer(Serializer):
+    """Serializer that sends bytes as they are.
+
+    :meth:`recv` returns a memoryview on the received frame, there is
+    no copy of the data.
+    """
+    tag = b'R'
+    raw = True
+
+    def dumps(self, obj):
+        """See :meth:`Serializer.dumps`"""
+        if not isinstance(obj, (bytes, bytearray, memoryview)):
+            raise SerializerException("The raw serializer only sends "
+                                      "bytes, not {0}".format(type(obj)))
+        return obj
+
+    def loads(self, buf):
+        """See :meth:`Serializer.loads`"""
+        return buf
+
+    @property
+    def control_serializer(self):
+        """See :attr:`Serializer.control_serializer`: msgpack, the
+        control messages are not bytes."""
+        return MsgpackSerializer()
+
+    def send(self, a_socket, obj, flags=0):
+        """See :meth:`Serializer.send`
+
+        Only bytes are sent without a copy, the buffer behind a
+        bytearray or memoryview might be reused by the caller.
+        """
+        payload = self.dumps(obj)
+        a_socket.send(self.tag, flags | zmq.SNDMORE)
+        a_socket.send(payload, flags, copy=not isinstance(payload, bytes))
+
+
+#: MessagePack extension type for objects
+OBJECT_EXT_TYPE = 1
+
+# the classes the msgpack serializer sends and creates, by path
+_message_classes = {}
+
+
+def _class_path(cls):
+    return "{0}:{1}".format(cls.__module__, cls.__qualname__)
+
+
+def register_message_class(cls):
+    """Let the msgpack serializer send and receive the objects of a
+    class.  Both sides of a link must register it.
+
+    A received message can only name a registered class, so the data
+    on a link can not create other objects.  Can be used as a class
+    decorator.
+
+    :param cls: the class, its objects must have a ``__dict__``.
+    :returns: the class.
+    """
+    _message_classes[_class_path(cls)] = cls
+    return cls
+
+
+class MsgpackSerializer(Serializer):
+    """Serializer based on the MessagePack format.
+
+    An object that is not plain data is sent as an extension with the
+    path of its class and its ``__dict__``.  The class must be
+    registered with :func:`register_message_class`.  The receiver
+    creates the object without calling ``__init__``.  Tuples arrive as
+    lists.
+    """
+    tag = b'M'
+
+    def dumps(self, obj):
+        """See :meth:`Serializer.dumps`"""
+        if msgpack is not None:
+            return msgpack.packb(obj, default=self._encode_object,
+                                 use_bin_type=True)
+        out = bytearray()
+        _pack(obj, out, self._encode_object)
+        return out
+
+    def loads(self, buf):
+        """See :meth:`Serializer.loads`"""
+        if msgpack is not None:
+            return msgpack.unpackb(buf, ext_hook=self._decode_object,
+                                   raw=False, strict_map_key=False)
+        obj, offset = _unpack(memoryview(buf), 0, self._decode_object)
+        return obj
+
+    def _encode_object(self, obj):
+        """Turn an object into an extension."""
+        path = _class_path(type(obj))
+        if path not in _message_classes:
+            raise SerializerException("Can not serialize {0}, it is not "
+                                      "a registered message class"
+                                      .format(type(obj)))
+        data = self.dumps([path, obj.__dict__])
+        if msgpack is not None:
+            return msgpack.ExtType(OBJECT_EXT_TYPE, bytes(data))
+        return (OBJECT_EXT_TYPE, data)
+
+    def _decode_object(self, code, data):
+        """Turn an extension back into an object."""
+        if code != OBJECT_EXT_TYPE:
+            raise SerializerException("Unknown extension type {0}"
+                                      .format(code))
+        path, state = self.loads(data)
+        cls = _message_classes.get(path)
+        if cls is None:
+            raise SerializerException("Unknown message class {0!r}"
+                                      .format(path))
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        return obj
+
+
+def _pack(obj, out, default):
+    """Append the MessagePack encoding of obj to out."""
+    if obj is None:
+        out += b'\xc0'
+    elif obj is True:
+        out += b'\xc3'
+    elif obj is False:
+        out += b'\xc2'
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -0x20 <= obj < 0:
+            out += struct.pack('b', obj)
+        elif obj >= 0:
+            if obj <= 0xff:
+                out += struct.pack('>BB', 0xcc, obj)
+            elif obj <= 0xffff:
+                out += struct.pack('>BH', 0xcd, obj)
+            elif obj <= 0xffffffff:
+                out += struct.pack('>BI', 0xce, obj)
+            else:
+                out += struct.pack('>BQ', 0xcf, obj)
+        else:
+            if obj >= -0x80:
+                out += struct.pack('>Bb', 0xd0, obj)
+            elif obj >= -0x8000:
+                out += struct.pack('>Bh', 0xd1, obj)
+            elif obj >= -0x80000000:
+                out += struct.pack('>Bi', 0xd2, obj)
+            else:
+                out += struct.pack('>Bq', 0xd3, obj)
+    elif isinstance(obj, float):
+        out += struct.pack('>Bd', 0xcb, obj)
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        length = len(data)
+        if length < 0x20:
+            out.append(0xa0 | length)
+        elif length <= 0xff:
+            out += struct.pack('>BB', 0xd9, length)
+        elif length <= 0xffff:
+            out += struct.pack('>BH', 0xda, length)
+        else:
+            out += struct.pack('>BI', 0xdb, length)
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        length = len(obj)
+        if length <= 0xff:
+            out += struct.pack('>BB', 0xc4, length)
+        elif length <= 0xffff:
+            out += struct.pack('>BH', 0xc5, length)
+        else:
+            out += struct.pack('>BI', 0xc6, length)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        length = len(obj)
+        if length < 0x10:
+            out.append(0x90 | length)
+        elif length <= 0xffff:
+            out += struct.pack('>BH', 0xdc, length)
+        else:
+            out += struct.pack('>BI', 0xdd, length)
+        for item in obj:
+            _pack(item, out, default)
+    elif isinstance(obj, dict):
+        length = len(obj)
+        if length < 0x10:
+            out.append(0x80 | length)
+        elif length <= 0xffff:
+            out += struct.pack('>BH', 0xde, length)
+        else:
+            out += struct.pack('>BI', 0xdf, length)
+        for key, value in obj.items():
+            _pack(key, out, default)
+            _pack(value, out, default)
+    else:
+        code, data = default(obj)
+        length = len(data)
+        if length <= 0xff:
+            out += struct.pack('>BBb', 0xc7, length, code)
+        elif length <= 0xffff:
+            out += struct.pack('>BHb', 0xc8, length, code)
+        else:
+            out += struct.pack('>BIb', 0xc9, length, code)
+        out += data
+
+#: Formats of the fixed size MessagePack types, by type byte.
+_FIXED = {0xcc:'>B', 0xcd:'>H', 0xce:'>I', 0xcf:'>Q',
+          0xd0:'>b', 0xd1:'>h', 0xd2:'>i', 0xd3:'>q',
+          0xca:'>f', 0xcb:'>d'}
+
+#: Lengths of the fixext types, by type byte.
+_FIXEXT = {0xd4:1, 0xd5:2, 0xd6:4, 0xd7:8, 0xd8:16}
+
+def _unpack(buf, offset, ext_hook):
+    """Decode one MessagePack object from buf at offset.
+
+    :returns: the object and the offset after it.
+    """
+    byte = buf[offset]
+    offset += 1
+    if byte < 0x80:
+        return byte, offset
+    if byte >= 0xe0:
+        return byte - 0x100, offset
+    if 0xa0 <= byte <= 0xbf:
+        end = offset + (byte & 0x1f)
+        return str(buf[offset:end], 'utf-8'), end
+    if 0x90 <= byte <= 0x9f:
+        return _unpack_array(buf, offset, byte & 0x0f, ext_hook)
+    if 0x80 <= byte <= 0x8f:
+        return _unpack_map(buf, offset, byte & 0x0f, ext_hook)
+    if byte == 0xc0:
+        return None, offset
+    if byte == 0xc2:
+        return False, offset
+    if byte == 0xc3:
+        return True, offset
+    if byte in _FIXED:
+        fmt = _FIXED[byte]
+        return (struct.unpack_from(fmt, buf, offset)[0],
+                offset + struct.calcsize(fmt))
+    if byte in (0xd9, 0xda, 0xdb, 0xc4, 0xc5, 0xc6):
+        fmt = {0xd9:'>B', 0xda:'>H', 0xdb:'>I',
+               0xc4:'>B', 0xc5:'>H', 0xc6:'>I'}[byte]
+        length = struct.unpack_from(fmt, buf, offset)[0]
+        offset += struct.calcsize(fmt)
+        end = offset + length
+        if byte >= 0xd9:
+            return str(buf[offset:end], 'utf-8'), end
+        return bytes(buf[offset:end]), end
+    if byte in (0xdc, 0xdd, 0xde, 0xdf):
+        fmt = '>H' if byte in (0xdc, 0xde) else '>I'
+        length = struct.unpack_from(fmt, buf, offset)[0]
+        offset += struct.calcsize(fmt)
+        if byte in (0xdc, 0xdd):
+            return _unpack_array(buf, offset, length, ext_hook)
+        return _unpack_map(buf, offset, length, ext_hook)
+    if byte in (0xc7, 0xc8, 0xc9) or byte in _FIXEXT:
+        if byte in _FIXEXT:
+            length = _FIXEXT[byte]
+        else:
+            fmt = {0xc7:'>B', 0xc8:'>H', 0xc9:'>I'}[byte]
+            length = struct.unpack_from(fmt, buf, offset)[0]
+            offset += struct.calcsize(fmt)
+        code = struct.unpack_from('b', buf, offset)[0]
+        offset += 1
+        end = offset + length
+        return ext_hook(code, bytes(buf[offset:end])), end
+    raise SerializerException("Invalid MessagePack type 0x{0:02x}"
+                              .format(byte))
+
+def _unpack_array(buf, offset, length, ext_hook):
+    """Decode the items of an array."""
+    items = []
+    for unused in range(length):
+        item, offset = _unpack(buf, offset, ext_hook)
+        items.append(item)
+    return items, offset
+
+def _unpack_map(buf, offset, length, ext_hook):
+    """Decode the items of a map."""
+    items = {}
+    for unused in range(length):
+        key, offset = _unpack(buf, offset, ext_hook)
+        value, offset = _unpack(buf, offset, ext_hook)
+        items[key] = value
+    return items, offset
+
+
+def get_serializer(serializer_type):
+    """ Function to get a serializer of a specific type.
+
+    :param serializer_type: The type of serializer to return, one of
+    "pickle", "msgpack" or "raw".
+    :type serializer_type: string
+    :raises: SerializerException for an unknown type.
+    :returns: A new serializer of the specified type.
+    """
+    serializers = {"pickle":PickleSerializer,
+                   "msgpack":MsgpackSerializer,
+                   "raw":RawSerializer}
+    serializer = serializers.get(serializer_type)
+    if serializer is None:
+        raise SerializerException("Unknown serializer type {0}"
+                                  .format(serializer_type))
+    return serializer()
@@ -4,19 +4,26 @@ def start_simulator(sim_type, sim_id):
     """ This will start a new simulator daemon in a separate process.
     It has to run the soap daemon with python 2.7, because the used
     SOAP module is only available for python 2.7.
+
+    Returns once the simulator has created its sockets and can accept
+    traffic, see :meth:`daemonbase.Daemon.notify_ready`.  The links of
+    an interface are connected after
+    :meth:`simulatorinterface.SimulatorInterface.wait_ready`.
     
     :param sim_type: The type of simulator to start (eg. tcp, udp, etc)
     :type sim_type: string
     :param sim_id: The id to give to the simulator.
     :type sim_id: int
+    :returns: True when the simulator is ready, False when it did not
+              start.
     
     """
     if sim_type == "soap":
-        subprocess.Popen(["python2.7", "start_simulator.py", "restart",
-                          str(sim_type), str(sim_id)]).wait()
+        return subprocess.Popen(["python2.7", "start_simulator.py", "restart",
+                                 str(sim_type), str(sim_id)]).wait() == 0
     else:
-        subprocess.Popen(["python", "start_simulator.py", "restart",
-                          str(sim_type), str(sim_id)]).wait()
+        return subprocess.Popen(["python", "start_simulator.py", "restart",
+                                 str(sim_type), str(sim_id)]).wait() == 0
 
 def stop_simulator(sim_type, sim_id):
     """ This will stop an existing simulator daemon.
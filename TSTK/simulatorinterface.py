@@ -1,66 +1,387 @@
 import logging
+import os
+import time
 import zmq
-import copy
 import simulator
 
+from serializer import (get_serializer, pack_connection_id,
+                        unpack_connection_id, simulator_topic,
+                        message_topic,
+                        SerializerException, BROADCAST, CONTROL)
+from responsetable import ResponseRule, rule_key
+from endpoints import connect_address
+
+#: message id that matches all messages, see
+#: :meth:`SimulatorInterface.set_callback`
+ANY = object()
+
+
+class Subscription(object):
+    """ A callback set on a simulator interface """
+    __slots__ = ('key', 'call', 'active')
+
+    def __init__(self, key, call):
+        #: message id, or ANY
+        self.key = key
+        #: function that is called with the message
+        self.call = call
+        #: False once removed
+        self.active = True
+
+
+class SimulatorInterfaceException(Exception):
+    """Base class for simulator interface exceptions"""
+    pass
+
+
+def _ignore(message):
+    """ Stands in for a callback that is removed during dispatch """
+    pass
+
+
 class SimulatorInterface(object):
     """ A generic simulator interface for communication with the 
     corresponding simulator.
+
+    The ``topic`` is the name of the simulator, such as "tcp-0", see
+    :mod:`hub`.  With a topic the interface only subscribes to the
+    messages it has callbacks for: to the message ids of
+    :meth:`set_callback`, or to all messages of the simulator once
+    there is a callback for :data:`ANY` or a predicate.  zmq then drops
+    the other messages before they are received.  Without a topic the
+    interface receives all messages on the message port.
+
+    The ports are TCP ports on the local host, or zmq endpoints, for
+    instance from :meth:`endpoints.EndpointRegistry.resolve`.
     """
     
-    def __init__(self, name, sim_id, zmq_context):
+    def __init__(self, name, sim_id, zmq_context, command_port=9000,
+                 message_port=9001, serializer="pickle", topic=None):
         self.logger = logging.getLogger('simulatorinterface.{0}{1}'
                                         .format(name, str(sim_id)))
-        self.message_port = 9001
-        self.command_port = 9000
+        self.message_port = message_port
+        self.command_port = command_port
         self.message_link = zmq_context.socket(zmq.SUB)
-        self.message_link.connect("tcp://localhost:{0}"
-                                  .format(self.message_port))
-        self.message_link.setsockopt_string(zmq.SUBSCRIBE, "")
+        self.message_link.connect(connect_address(self.message_port))
+        #: topic frame of the simulator, empty to receive everything
+        #: that is published on the message port
+        self.topic = b"" if topic is None else simulator_topic(topic)
+        if not self.topic:
+            self.message_link.setsockopt(zmq.SUBSCRIBE, b"")
 
         self.command_link = zmq_context.socket(zmq.PUB)
-        self.command_link.connect("tcp://localhost:{0}"
-                                  .format(self.command_port))
+        self.command_link.connect(connect_address(self.command_port))
 
+        #: serializer for the links, the same as that of the dispatcher
+        self.serializer = get_serializer(serializer)
+        #: id of the connection of the dispatcher the message that is
+        #: being dispatched came from
+        self.connection_id = BROADCAST
+
+        #: the callbacks per message id, each a dict of subscription
+        #: to function that is used as an ordered set
         self.callbacks = {}
+        # the callbacks for all messages
+        self._wildcards = {}
+        # depth of nested do_callbacks() calls
+        self._dispatching = 0
+        # subscriptions set or removed during dispatch
+        self._pending = []
+        # token of the ping wait_ready() waits for the reply of
+        self._ping = None
 
-    def on_message(self, scenario_player):
-        """ Receive a message from the simulator
+    def on_message(self, a_socket, scenario_player):
+        """ Receive a message, or a batch of messages, from the simulator
 
+        :param a_socket: the message link
         :param scenario_player: unused
         """
-        message = self.message_link.recv_pyobj()
-        self.do_callbacks(message)
+        frames = a_socket.recv_multipart(copy=False)
+        if len(frames) % 3 != 1:
+            self.logger.warning('Message with %d frames dropped',
+                                len(frames))
+            return
+        # The topic frame is followed by one or more messages, a
+        # dispatcher can forward a batch of messages at once.
+        for index in range(1, len(frames), 3):
+            try:
+                self.connection_id = unpack_connection_id(
+                        frames[index].bytes)
+                if self.connection_id == CONTROL:
+                    self.on_control(
+                            self.serializer.control_serializer.from_frames(
+                                frames[index + 1], frames[index + 2]))
+                    continue
+                message = self.serializer.from_frames(frames[index + 1],
+                                                      frames[index + 2])
+            except SerializerException as err:
+                self.logger.warning('Invalid message dropped: %s', err)
+                continue
+            self.do_callbacks(message)
+
+    def on_control(self, reply):
+        """ Handle a control reply of the simulator, not a message for
+        the callbacks.
+
+        :param reply: A tuple of the name of the reply and its
+                      arguments.
+        """
+        # msgpack sends tuples as lists.
+        if (isinstance(reply, (tuple, list))
+                and tuple(reply) == ('ready', self._ping)):
+            self._ping = None
+
+    def wait_ready(self, timeout=10.0, interval=0.05):
+        """ Wait until the simulator answers a ping, so that both links
+        are connected.
+
+        zmq drops the commands that are sent before the simulator has
+        subscribed to the command link, and the simulator drops the
+        messages that are published before the interface has subscribed
+        to the message link.  The ping is sent again every interval
+        until the reply arrives.  Messages that arrive meanwhile go to
+        the callbacks.
+
+        :param timeout: How long to wait, in seconds.
+        :param interval: How long to wait for a reply before the ping
+                         is sent again, in seconds.
+        :raises: SimulatorInterfaceException if there is no reply.
+        """
+        token = self._ping = os.urandom(8)
+        reply_topic = message_topic(self.topic, CONTROL)
+        if self.topic:
+            self.message_link.setsockopt(zmq.SUBSCRIBE, reply_topic)
+        deadline = time.monotonic() + timeout
+        next_ping = 0
+        try:
+            while self._ping is not None:
+                now = time.monotonic()
+                if now >= deadline:
+                    self._ping = None
+                    raise SimulatorInterfaceException(
+                            "Simulator not ready in {0} s".format(timeout))
+                if now >= next_ping:
+                    self.send_control(('ping', token))
+                    next_ping = now + interval
+                if self.message_link.poll(
+                        (min(next_ping, deadline) - now) * 1000):
+                    self.on_message(self.message_link, None)
+        finally:
+            if self.topic:
+                self.message_link.setsockopt(zmq.UNSUBSCRIBE, reply_topic)
     
     def do_callbacks(self, message):
         """ Call the callbacks for the message
+
+        First the callbacks for the id of the message are called, then
+        the wildcard and predicate callbacks, each in the order in
+        which they were set.  A callback that is removed while the
+        message is dispatched is not called anymore, a callback that is
+        set meanwhile is called from the next message on.
         
         :param message: the message from the simulator to do the 
                         callbacks for
         """
-        if message.message_id in self.callbacks:
-            # Have to operate on a copy because the callback functions
-            # can modify the callback list.
-            for function in copy.copy(self.callbacks[message.message_id]):
-                function(message)
-    
-    def set_callback(self, message_id, function):
+        self._dispatching += 1
+        try:
+            # Raw data has no message id, only the callbacks for all
+            # messages get it.
+            functions = self.callbacks.get(getattr(message, 'message_id',
+                                                   None))
+            if functions:
+                # Removing a callback only replaces its function, so
+                # the dict can be iterated without a copy.
+                for function in functions.values():
+                    function(message)
+            if self._wildcards:
+                for function in self._wildcards.values():
+                    function(message)
+        finally:
+            self._dispatching -= 1
+            if not self._dispatching and self._pending:
+                self._apply_pending()
+
+    def set_callback(self, message_id, function, once=False):
         """ Add a callback function for a message
 
-        :param message_id: the message id
+        :param message_id: the message id, or :data:`ANY` for all
+                           messages
+        :param function: the function to add
+        :param once: remove the callback after its first call
+        :type once: bool
+        :returns: the subscription, to pass to :meth:`remove_callback`
+        """
+        subscription = Subscription(message_id, function)
+        if once:
+            def call_once(message):
+                self.remove_callback(subscription)
+                function(message)
+            subscription.call = call_once
+        return self._add(subscription)
+
+    def set_predicate_callback(self, predicate, function, once=False):
+        """ Add a callback function for the messages a predicate
+        accepts
+
+        :param predicate: function that is called with the message and
+                          returns True if the callback must be called
         :param function: the function to add
+        :param once: remove the callback after its first call
+        :type once: bool
+        :returns: the subscription, to pass to :meth:`remove_callback`
         """
-        if message_id in self.callbacks:
-            self.callbacks[message_id].append(function)
+        subscription = Subscription(ANY, None)
+        def call_if(message):
+            if predicate(message):
+                if once:
+                    self.remove_callback(subscription)
+                function(message)
+        subscription.call = call_if
+        return self._add(subscription)
+
+    def remove_callback(self, subscription):
+        """ Remove a callback.  Removing it twice is harmless.
+
+        :param subscription: the subscription returned when the
+                             callback was set
+        """
+        if not subscription.active:
+            return
+        subscription.active = False
+        key = subscription.key
+        if key is ANY:
+            table = self._wildcards
         else:
-            self.callbacks[message_id] = [function]
-    
-    def send(self, message):
+            table = self.callbacks.get(key)
+        if table is None or subscription not in table:
+            # Set during the dispatch, _apply_pending() skips it.
+            return
+        if self._dispatching:
+            # Changing a value is allowed while iterating.
+            table[subscription] = _ignore
+            self._pending.append(subscription)
+        else:
+            self._remove(table, subscription)
+
+    def _add(self, subscription):
+        """ Add a subscription, after the dispatch if there is one """
+        if self._dispatching:
+            self._pending.append(subscription)
+        else:
+            self._table(subscription.key)[subscription] = subscription.call
+        return subscription
+
+    def _table(self, key):
+        """ The table of callbacks for a message id or ANY, a new one
+        if there is none.
+        """
+        table = self._wildcards if key is ANY else self.callbacks.get(key)
+        if table is None:
+            table = self.callbacks[key] = {}
+        if not table:
+            self._subscribe(zmq.SUBSCRIBE, key)
+        return table
+
+    def _remove(self, table, subscription):
+        """ Remove a subscription from its table """
+        del table[subscription]
+        if not table:
+            if subscription.key is not ANY:
+                del self.callbacks[subscription.key]
+            self._subscribe(zmq.UNSUBSCRIBE, subscription.key)
+
+    def _subscribe(self, option, key):
+        """ Subscribe to, or unsubscribe from, the messages of a message
+        id or of ANY.
+
+        :param option: zmq.SUBSCRIBE or zmq.UNSUBSCRIBE.
+        :param key: the message id, or ANY
+        """
+        if not self.topic:
+            # Subscribed to everything.
+            return
+        if key is ANY:
+            topic = self.topic
+        else:
+            topic = message_topic(self.topic, key)
+        self.message_link.setsockopt(option, topic)
+
+    def _apply_pending(self):
+        """ Make the changes that were made during dispatch """
+        pending = self._pending
+        self._pending = []
+        for subscription in pending:
+            key = subscription.key
+            if key is ANY:
+                table = self._wildcards
+            else:
+                table = self.callbacks.get(key)
+            if subscription.active:
+                # Set during the dispatch.
+                self._table(key)[subscription] = subscription.call
+            elif table is not None and subscription in table:
+                # Removed during the dispatch.
+                self._remove(table, subscription)
+
+    def send(self, message, connection_id=BROADCAST):
         """ Send a message to the simulator
 
         :param message: The message to send to the simulator
+        :param connection_id: The connection of the simulator to send
+                              the message over, the default is all
+                              connections.  A callback can reply over
+                              the connection of the message it handles
+                              with ``connection_id=interface.connection_id``.
+        :type connection_id: int
+        """
+        self.command_link.send_multipart(
+                [self.topic, pack_connection_id(connection_id)]
+                + list(self.serializer.to_frames(message)))
+
+    def set_response(self, response, message_id=None, prefix=None,
+                     forward=True):
+        """ Let the simulator answer messages itself, without a
+        callback.
+
+        The simulator sends the response as soon as a message with the
+        message id, or that starts with the prefix, arrives.  A rule
+        for the same message id or prefix is replaced.
+
+        :param response: The response, as it would be sent with
+                         :meth:`send`.
+        :param message_id: The message id of the messages to answer.
+        :param prefix: The first bytes of the messages to answer,
+                       instead of a message id.
+        :type prefix: bytes
+        :param forward: Also forward the messages to the callbacks.
+        :type forward: bool
+        """
+        self.send_control(('set_response', ResponseRule(
+                response, message_id, prefix, forward)))
+
+    def remove_response(self, message_id=None, prefix=None):
+        """ Remove a rule set with :meth:`set_response`
+
+        :param message_id: The message id of the rule.
+        :param prefix: The prefix of the rule.
+        """
+        self.send_control(('remove_response', rule_key(message_id, prefix)))
+
+    def clear_responses(self):
+        """ Remove all rules set with :meth:`set_response` """
+        self.send_control(('clear_responses',))
+
+    def send_control(self, command):
+        """ Send a control command to the simulator itself
+
+        :param command: A tuple of the name of the command and its
+                        arguments.
+        :type command: tuple
         """
-        self.command_link.send_pyobj(message)
+        self.command_link.send_multipart(
+                [self.topic, pack_connection_id(CONTROL)]
+                + list(self.serializer.control_serializer.to_frames(
+                        command)))
 
 
 def get_simulator_interface(sim_interface_type):
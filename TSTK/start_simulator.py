@@ -25,5 +25,5 @@ if __name__ == "__main__":
         # Start the daemon and pass dispatcher to use.
         daemon.startup()
     else:
-        print "Usage: %s start|stop|restart|version <type> <id>" % sys.argv[0]
+        print("Usage: %s start|stop|restart|version <type> <id>" % sys.argv[0])
         sys.exit(2)
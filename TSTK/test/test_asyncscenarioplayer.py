@@ -0,0 +1,117 @@
+import unittest
+import asyncio
+import time
+import zmq
+import testsystem
+import asyncscenarioplayer
+
+
+class AsyncScenarioPlayerTestCase(unittest.TestCase):
+    """Tests for the asyncio engine in the asyncscenarioplayer module"""
+
+    def setUp(self):
+        self.test_system = testsystem.TestSystem("Foo")
+        self.test_system.add_scenario_player(engine="asyncio")
+        self.scenario_player = self.test_system.scenario_player
+
+    def tearDown(self):
+        # Release the lock, otherwise the next test system kills us.
+        self.test_system.lock.close()
+        self.scenario_player = None
+        self.test_system = None
+
+    def test_engine(self):
+        """Test that the asyncio engine is selected"""
+        self.assertIsInstance(self.scenario_player,
+                              asyncscenarioplayer.AsyncScenarioPlayer)
+
+    def test_add_step(self):
+        """Test that plain steps are executed in order, also steps
+        added while playing.
+        """
+        s = self.test_system
+        order = []
+        def three(test_system):
+            order.append(3)
+            test_system.add_step(0.01, lambda: order.append(4))
+        s.add_step(0.01, lambda: order.append(0))
+        s.add_step(0.03, three)
+        s.add_step(0.021, lambda: order.append(2))
+        s.add_step(0.02, lambda: order.append(1))
+        s.play()
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+        self.assertEqual(self.scenario_player.lateness.count, 5)
+
+    def test_async_steps(self):
+        """Test that coroutine steps run concurrently and the scenario
+        waits for them.
+        """
+        s = self.test_system
+        finished = []
+        async def slow(test_system):
+            await asyncio.sleep(0.05)
+            finished.append(time.monotonic())
+        start = time.monotonic()
+        s.add_step(0, slow)
+        s.add_step(0, slow)
+        s.add_periodic_step(0.01, lambda: None, count=3)
+        s.play()
+        self.assertEqual(len(finished), 2)
+        # Both waits overlapped.
+        self.assertLess(max(finished) - start, 0.09)
+
+    def test_socket_call_backs(self):
+        """Test plain and coroutine call backs on zmq sockets."""
+        player = self.scenario_player
+        receiver = player.context.socket(zmq.PULL)
+        receiver.bind("inproc://async")
+        sender = player.context.socket(zmq.PUSH)
+        sender.connect("inproc://async")
+        received = []
+        def on_message(a_socket, unused):
+            received.append(a_socket.recv())
+        async def on_message_async(a_socket, unused):
+            await asyncio.sleep(0)
+            received.append(a_socket.recv())
+        def send(count):
+            for unused in range(count):
+                sender.send(b"x")
+        def switch():
+            player.remove_socket(receiver)
+            player.add_socket(receiver, on_message_async)
+        player.add_socket(receiver, on_message)
+        self.test_system.add_step(0.01, lambda: send(10))
+        self.test_system.add_step(0.02, switch)
+        self.test_system.add_step(0.03, lambda: send(10))
+        self.test_system.add_step(0.05, lambda: None)
+        try:
+            self.test_system.play()
+        finally:
+            sender.close(linger=0)
+            receiver.close(linger=0)
+        self.assertEqual(len(received), 20)
+
+    def test_exception(self):
+        """Test that an exception in a step stops the scenario."""
+        s = self.test_system
+        executed = []
+        async def fail(test_system):
+            raise ValueError("step failed")
+        s.add_step(0.01, lambda: executed.append(0))
+        s.add_step(0.02, fail)
+        s.add_step(0.03, lambda: executed.append(1))
+        self.assertRaises(ValueError, s.play)
+        self.assertEqual(executed, [0])
+
+    def test_stop(self):
+        """Test that a scenario can be stopped by a step."""
+        s = self.test_system
+        executed = []
+        s.add_periodic_step(0.001, lambda: executed.append(None))
+        s.add_step(0.02, lambda test_system: test_system.stop())
+        s.play()
+        self.assertGreater(len(executed), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
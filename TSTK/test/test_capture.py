@@ -0,0 +1,372 @@
+import unittest
+import os
+import signal
+import tempfile
+import threading
+import time
+import zmq
+import capture
+import dispatcher
+import logpipeline
+import simulatorinterface
+import testsystem
+
+
+COMMAND_PORT = 29141
+MESSAGE_PORT = 29142
+
+
+class CaptureTestCase(unittest.TestCase):
+    """Tests for writing and reading captures"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "tcp-0.capture")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, direction=None):
+        """The connection ids, directions and data of the frames."""
+        with capture.CaptureReader(self.path) as reader:
+            return [(connection_id, frame_direction, bytes(data))
+                    for unused, connection_id, frame_direction, data
+                    in reader.frames(direction)]
+
+    def test_frames(self):
+        """Test that the frames are read back, also when the file
+        grows
+        """
+        writer = capture.CaptureWriter(self.path, chunk_size=64)
+        frames = [(number % 3, number % 2, bytes([number]) * number)
+                  for number in range(20)]
+        for connection_id, direction, data in frames:
+            writer.record(direction, connection_id, memoryview(data))
+        # Readable while it is written.
+        self.assertEqual(self.read(), frames)
+        writer.close()
+        self.assertEqual(self.read(), frames)
+        self.assertEqual(self.read(logpipeline.SENT),
+                         [frame for frame in frames
+                          if frame[1] == logpipeline.SENT])
+        self.assertEqual(os.path.getsize(self.path), writer.end)
+
+    def test_times(self):
+        """Test that the frames have monotonic times"""
+        writer = capture.CaptureWriter(self.path)
+        before = time.monotonic_ns()
+        for number in range(3):
+            writer.record(logpipeline.RECEIVED, 1, b"x")
+        writer.close()
+        with capture.CaptureReader(self.path) as reader:
+            times = [frame[0] for frame in reader]
+        self.assertEqual(times, sorted(times))
+        self.assertGreaterEqual(times[0], before)
+
+    def test_append(self):
+        """Test that a capture can be continued"""
+        writer = capture.CaptureWriter(self.path)
+        writer.record(logpipeline.RECEIVED, 1, b"one")
+        writer.close()
+        writer = capture.CaptureWriter(self.path, append=True)
+        writer.record(logpipeline.SENT, 2, b"two")
+        writer.close()
+        self.assertEqual(self.read(), [(1, logpipeline.RECEIVED, b"one"),
+                                       (2, logpipeline.SENT, b"two")])
+
+    def test_one_writer(self):
+        """Test that a capture that is written is not replaced"""
+        writer = capture.CaptureWriter(self.path)
+        writer.record(logpipeline.RECEIVED, 1, b"one")
+        for append in (False, True):
+            self.assertRaises(capture.CaptureException,
+                              capture.CaptureWriter, self.path, append)
+        writer.record(logpipeline.RECEIVED, 1, b"two")
+        writer.close()
+        self.assertEqual(self.read(), [(1, logpipeline.RECEIVED, b"one"),
+                                       (1, logpipeline.RECEIVED, b"two")])
+
+    def test_replace(self):
+        """Test that a new capture leaves a reader of the old one alone"""
+        writer = capture.CaptureWriter(self.path)
+        writer.record(logpipeline.RECEIVED, 1, b"old" * 1000)
+        writer.close()
+        with capture.CaptureReader(self.path) as reader:
+            writer = capture.CaptureWriter(self.path)
+            writer.record(logpipeline.SENT, 2, b"new")
+            self.assertEqual([bytes(frame[3]) for frame in reader],
+                             [b"old" * 1000])
+            writer.close()
+        self.assertEqual(self.read(), [(2, logpipeline.SENT, b"new")])
+
+    def test_invalid(self):
+        """Test that another file is refused"""
+        with open(self.path, 'wb') as other:
+            other.write(b"something else entirely")
+        self.assertRaises(capture.CaptureException,
+                          capture.CaptureReader, self.path)
+        self.assertRaises(capture.CaptureException,
+                          capture.CaptureWriter, self.path, True)
+
+
+class IndexTestCase(unittest.TestCase):
+    """Tests for finding frames with the index"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "tcp-0.capture")
+        writer = capture.CaptureWriter(self.path, stride=4)
+        for number in range(50):
+            writer.record(number % 2, 1, bytes([number]), number % 5)
+        writer.record(logpipeline.SENT, 1, b"no id")
+        writer.close()
+        self.reader = capture.CaptureReader(self.path)
+        self.times = [frame[0] for frame in self.reader.frames()]
+
+    def tearDown(self):
+        self.reader.close()
+        self.directory.cleanup()
+
+    def numbers(self, **query):
+        """The frames of a query, as numbers."""
+        return [frame[3][0] for frame in self.reader.frames(**query)]
+
+    def test_message_id(self):
+        """Test the frames of a message id"""
+        self.assertIsNotNone(self.reader.index)
+        self.assertEqual(self.numbers(message_id=3), list(range(3, 50, 5)))
+        self.assertEqual(self.numbers(message_id=3,
+                                      direction=logpipeline.SENT),
+                         list(range(3, 50, 10)))
+        self.assertEqual(self.numbers(message_id=7), [])
+        self.assertEqual(self.reader.message_ids(),
+                         {number:10 for number in range(5)})
+        frame = next(self.reader.frames(message_id=0))
+        self.assertIsInstance(frame[3], memoryview)
+
+    def test_with(self):
+        """Test that a reader is closed while frames are referenced"""
+        self.reader.close()
+        with capture.CaptureReader(self.path) as reader:
+            for time_ns, connection_id, direction, data in reader.frames(
+                    message_id=3, start=self.times[13], end=self.times[40]):
+                pass
+        self.assertEqual(bytes(data), bytes([38]))
+        with capture.CaptureReader(self.path) as reader:
+            for time_ns, connection_id, direction, data in reader.frames():
+                if data[0] == 20:
+                    break
+        self.assertEqual(bytes(data), bytes([20]))
+        self.reader = capture.CaptureReader(self.path)
+
+    def test_time(self):
+        """Test the frames between two times"""
+        self.assertEqual(self.numbers(start=self.times[13],
+                                      end=self.times[21]),
+                         list(range(13, 21)))
+        self.assertEqual(self.numbers(message_id=4, start=self.times[13],
+                                      end=self.times[40]),
+                         [14, 19, 24, 29, 34, 39])
+        self.assertEqual(self.numbers(end=self.times[0]), [])
+        self.assertEqual(self.reader.first_time, self.times[0])
+
+    def test_time_back(self):
+        """Test the frames between two times when the times go back, as
+        after a reboot
+        """
+        self.reader.close()
+        with open(self.path, 'r+b') as capture_file:
+            data = bytearray(capture_file.read())
+            offset = capture.CAPTURE_HEADER.size
+            for number in range(51):
+                unused, connection_id, direction, length = (
+                        logpipeline.TRAFFIC_RECORD.unpack_from(data, offset))
+                logpipeline.TRAFFIC_RECORD.pack_into(
+                        data, offset, 1000 + number if number < 25 else number,
+                        connection_id, direction, length)
+                offset += logpipeline.TRAFFIC_RECORD.size + length
+            capture_file.seek(0)
+            capture_file.write(data)
+        self.reader = capture.CaptureReader(self.path)
+        self.reader.build_index(lambda data: data[0] % 5
+                                             if len(data) == 1 else None)
+        self.assertFalse(self.reader.index.ordered)
+        self.assertEqual(self.numbers(start=1010, end=1020),
+                         list(range(10, 20)))
+        self.assertEqual(self.numbers(start=30, end=40), list(range(30, 40)))
+        self.assertEqual(self.numbers(message_id=3, start=30, end=50),
+                         [33, 38, 43, 48])
+
+    def test_other_ids(self):
+        """Test that message ids that are not numbers or strings are
+        found, and that an index of pickled data is not used
+        """
+        self.reader.close()
+        writer = capture.CaptureWriter(self.path)
+        writer.record(logpipeline.RECEIVED, 1, b"t", ("a", 1))
+        writer.close()
+        self.reader = capture.CaptureReader(self.path)
+        self.assertEqual(self.numbers(message_id=("a", 1)), [ord("t")])
+        with open(capture.index_path(self.path), 'wb') as index_file:
+            index_file.write(b"TSTKIDX1" + bytes(32)
+                             + b"cos\nsystem\n(S'true'\ntR.")
+        self.reader.close()
+        self.reader = capture.CaptureReader(self.path)
+        self.assertIsNone(self.reader.index)
+
+    def test_build(self):
+        """Test that a capture without an index up to date is indexed"""
+        self.reader.close()
+        writer = capture.CaptureWriter(self.path, append=True, stride=4)
+        self.assertEqual(writer.index.count, 51)
+        writer.record(logpipeline.RECEIVED, 1, bytes([50]), 0)
+        # The index is written when the writer is closed.
+        self.reader = capture.CaptureReader(self.path)
+        self.assertIsNone(self.reader.index)
+        self.assertRaises(capture.CaptureException, list,
+                          self.reader.frames(message_id=0))
+        self.assertEqual(self.numbers(start=self.times[48]),
+                         [48, 49, ord("n"), 50])
+        self.reader.build_index(lambda data: data[0] % 5
+                                             if len(data) == 1 else None)
+        self.assertEqual(self.numbers(message_id=0), list(range(0, 51, 5)))
+        writer.close()
+        self.reader.close()
+        self.reader = capture.CaptureReader(self.path)
+        self.assertEqual(self.numbers(message_id=0), list(range(0, 51, 5)))
+
+
+class ReplayTestCase(unittest.TestCase):
+    """Tests for replaying captures"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "tcp-0.capture")
+        writer = capture.CaptureWriter(self.path)
+        for number in range(3):
+            writer.record(logpipeline.RECEIVED, 1, str(number).encode())
+            writer.record(logpipeline.SENT, 2, b"reply")
+            time.sleep(0.05)
+        writer.close()
+        self.reader = capture.CaptureReader(self.path)
+        self.played = []
+
+    def tearDown(self):
+        self.reader.close()
+        self.directory.cleanup()
+
+    def send(self, connection_id, data):
+        self.played.append((connection_id, bytes(data),
+                            time.monotonic()))
+
+    def test_speed(self):
+        """Test that the times between the frames are divided by the
+        speed
+        """
+        replay = capture.Replay(self.reader, self.send, speed=2)
+        self.assertEqual(replay.run(), 3)
+        self.assertEqual([frame[:2] for frame in self.played],
+                         [(1, b"0"), (1, b"1"), (1, b"2")])
+        self.assertGreaterEqual(self.played[2][2] - self.played[0][2],
+                                0.045)
+        self.assertLess(self.played[2][2] - self.played[0][2], 0.1)
+
+    def test_maximum_speed(self):
+        """Test that the frames are played without waiting"""
+        replay = capture.Replay(self.reader, self.send, speed=0,
+                                direction=logpipeline.SENT)
+        start = time.monotonic()
+        replay.run(wait=self.fail)
+        self.assertEqual([frame[:2] for frame in self.played],
+                         [(2, b"reply")] * 3)
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_scenario_player(self):
+        """Test that the scenario player plays the frames as steps"""
+        test_system = testsystem.TestSystem("Foo")
+        try:
+            test_system.add_scenario_player()
+            player = test_system.scenario_player
+            replay = capture.Replay(self.reader, self.send, speed=10)
+            player.add_steps(replay.steps())
+            player.play()
+        finally:
+            test_system.lock.close()
+        self.assertEqual([frame[:2] for frame in self.played],
+                         [(1, b"0"), (1, b"1"), (1, b"2")])
+        self.assertEqual(replay.count, 3)
+
+
+class DispatcherReplayTestCase(unittest.TestCase):
+    """Tests for capturing and replaying in a dispatcher"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "tcp-0.capture")
+        self.dispatcher = dispatcher.TCPDispatcher("tcp", 0)
+        self.dispatcher.accept_address = "127.0.0.1"
+        self.dispatcher.listen_port = 0
+        self.dispatcher.backlog = 16
+        self.dispatcher.command_listen_port = COMMAND_PORT
+        self.dispatcher.message_forward_port = MESSAGE_PORT
+        self.dispatcher.create_sockets()
+        self.context = zmq.Context()
+        self.interface = simulatorinterface.SimulatorInterface(
+                "tcp", 0, self.context, COMMAND_PORT, MESSAGE_PORT)
+        self.received = []
+        self.interface.set_callback(simulatorinterface.ANY,
+                                    self.received.append)
+
+    def tearDown(self):
+        self.interface.message_link.close(linger=0)
+        self.interface.command_link.close(linger=0)
+        self.context.term()
+        self.dispatcher.accept_socket.close()
+        self.dispatcher.context.destroy(linger=0)
+        self.directory.cleanup()
+
+    def test_replay(self):
+        """Test that the frames of a capture reach the player again"""
+        writer = capture.CaptureWriter(self.path)
+        for data in (b"one", b"two", b"three"):
+            writer.record(logpipeline.RECEIVED, 1, data)
+        writer.record(logpipeline.SENT, 1, b"command")
+        writer.close()
+        # The subscription takes a moment.
+        time.sleep(0.2)
+        self.assertEqual(self.dispatcher.replay(self.path, 0), 3)
+        link = self.interface.message_link
+        while len(self.received) < 3 and link.poll(5000):
+            self.interface.on_message(link, None)
+        self.assertEqual(self.received, [b"one", b"two", b"three"])
+
+
+    def test_stop(self):
+        """Test that a stop signal ends a replay"""
+        writer = capture.CaptureWriter(self.path)
+        writer.record(logpipeline.RECEIVED, 1, b"one")
+        time.sleep(0.2)
+        writer.record(logpipeline.RECEIVED, 1, b"two")
+        writer.close()
+        handlers = {number:signal.getsignal(number)
+                    for number in self.dispatcher.stop_signals}
+        self.dispatcher.install_signal_handlers()
+        try:
+            timer = threading.Timer(0.2, os.kill,
+                                    (os.getpid(), signal.SIGTERM))
+            timer.start()
+            start = time.monotonic()
+            # The second frame would come after 2 s.
+            self.assertEqual(self.dispatcher.replay(self.path, 0.1), 1)
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertFalse(self.dispatcher.go_on)
+            timer.join()
+        finally:
+            signal.set_wakeup_fd(-1)
+            self.dispatcher._wakeup.close()
+            for number, handler in handlers.items():
+                signal.signal(number, handler)
+
+
+if __name__ == '__main__':
+    unittest.main()
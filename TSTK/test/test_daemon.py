@@ -0,0 +1,169 @@
+import unittest
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import daemonbase
+import dispatcher
+
+
+COMMAND_PORT = 29151
+MESSAGE_PORT = 29152
+
+# Runs a TCP dispatcher and tells when it polls.
+DISPATCHER_SCRIPT = """
+import dispatcher
+
+class Dispatcher(dispatcher.TCPDispatcher):
+    def create_sockets(self):
+        dispatcher.TCPDispatcher.create_sockets(self)
+        print("ready", flush=True)
+
+a_dispatcher = Dispatcher("tcp", 0)
+a_dispatcher.accept_address = "127.0.0.1"
+a_dispatcher.listen_port = 0
+a_dispatcher.backlog = 16
+a_dispatcher.command_listen_port = {0}
+a_dispatcher.message_forward_port = {1}
+a_dispatcher.run()
+""".format(COMMAND_PORT, MESSAGE_PORT)
+
+# Starts a daemon with a TCP dispatcher, or one that exits without
+# reporting that it is ready.
+DAEMON_SCRIPT = """
+import sys
+import daemonbase
+import dispatcher
+
+class Daemon(daemonbase.Daemon):
+    ready_timeout = 5.0
+    def run(self):
+        if sys.argv[2] == "tcp":
+            self.dispatcher.run(self.notify_ready)
+
+daemon = Daemon(sys.argv[1])
+daemon.dispatcher = dispatcher.TCPDispatcher("tcp", 0)
+daemon.dispatcher.accept_address = "127.0.0.1"
+daemon.dispatcher.listen_port = 0
+daemon.dispatcher.backlog = 16
+daemon.dispatcher.command_listen_port = {0}
+daemon.dispatcher.message_forward_port = {1}
+daemon.start()
+""".format(COMMAND_PORT, MESSAGE_PORT)
+
+# Ignores SIGTERM.
+STUBBORN_SCRIPT = """
+import signal, time
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+print("ready", flush=True)
+time.sleep(60)
+"""
+
+
+class DaemonTestCase(unittest.TestCase):
+    """Tests for stopping daemons"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.daemon = daemonbase.Daemon(
+                os.path.join(self.directory.name, "tcp_0.pid"))
+        self.process = None
+
+    def tearDown(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self.process is not None:
+            self.process.stdout.close()
+        self.directory.cleanup()
+
+    def start(self, script):
+        """Run a script as the daemon of the pidfile."""
+        self.process = subprocess.Popen(
+                [sys.executable, "-c", script], stdout=subprocess.PIPE,
+                cwd=os.path.dirname(os.path.abspath(dispatcher.__file__)))
+        self.assertEqual(self.process.stdout.readline(), b"ready\n")
+        with open(self.daemon.pidfile, 'w') as pidfile:
+            pidfile.write("%d\n" % self.process.pid)
+
+    def test_wait_for_exit(self):
+        """Test that an exited process is noticed, also as a zombie"""
+        self.start(STUBBORN_SCRIPT)
+        self.assertTrue(daemonbase.is_running(self.process.pid))
+        self.assertFalse(daemonbase.wait_for_exit(self.process.pid, 0.05))
+        self.process.kill()
+        start = time.monotonic()
+        # Not waited for, so a zombie.
+        self.assertTrue(daemonbase.wait_for_exit(self.process.pid, 5))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_stop(self):
+        """Test that a dispatcher stops right away on SIGTERM"""
+        self.start(DISPATCHER_SCRIPT)
+        start = time.monotonic()
+        self.daemon.stop()
+        self.assertLess(time.monotonic() - start, 1)
+        # It stopped by itself.
+        self.assertEqual(self.process.wait(), 0)
+        self.assertFalse(os.path.exists(self.daemon.pidfile))
+
+    def test_stop_timeout(self):
+        """Test that a daemon that ignores SIGTERM is killed"""
+        self.start(STUBBORN_SCRIPT)
+        start = time.monotonic()
+        self.daemon.stop(timeout=0.2)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.process.wait(), -signal.SIGKILL)
+        self.assertFalse(os.path.exists(self.daemon.pidfile))
+
+    def test_stop_not_running(self):
+        """Test that a pidfile of an exited daemon is removed"""
+        self.start(STUBBORN_SCRIPT)
+        self.process.kill()
+        self.process.wait()
+        self.daemon.stop()
+        self.assertFalse(os.path.exists(self.daemon.pidfile))
+
+
+class ReadyTestCase(unittest.TestCase):
+    """Tests for starting daemons that report when they are ready"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.daemon = daemonbase.Daemon(
+                os.path.join(self.directory.name, "tcp_0.pid"))
+
+    def tearDown(self):
+        self.daemon.stop(restart=True)
+        self.directory.cleanup()
+
+    def start(self, kind):
+        """Start a daemon, return the exit status of the starter."""
+        return subprocess.call(
+                [sys.executable, "-c", DAEMON_SCRIPT, self.daemon.pidfile,
+                 kind],
+                cwd=os.path.dirname(os.path.abspath(dispatcher.__file__)))
+
+    def test_ready(self):
+        """Test that the starter exits once the sockets are bound"""
+        self.assertEqual(self.start("tcp"), 0)
+        # No blind wait: the command link accepts right away.
+        connection = socket.create_connection(("127.0.0.1", COMMAND_PORT))
+        connection.close()
+        start = time.monotonic()
+        self.daemon.stop()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertFalse(os.path.exists(self.daemon.pidfile))
+
+    def test_not_ready(self):
+        """Test that the starter fails when the daemon exits first"""
+        start = time.monotonic()
+        self.assertEqual(self.start("none"), 1)
+        self.assertLess(time.monotonic() - start, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
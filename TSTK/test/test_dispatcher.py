@@ -0,0 +1,606 @@
+import unittest
+import os
+import pickle
+import tty
+import select
+import socket
+import tempfile
+import time
+import serial
+import zmq
+import dispatcher
+import framing
+import httpparser
+import logpipeline
+import serializer
+import simulatorinterface
+
+
+COMMAND_PORT = 29101
+MESSAGE_PORT = 29102
+
+
+class TCPDispatcherTestCase(unittest.TestCase):
+    """Tests for the connections of the TCP dispatcher"""
+
+    def setUp(self):
+        self.dispatcher = dispatcher.TCPDispatcher("tcp", 0)
+        self.dispatcher.accept_address = "127.0.0.1"
+        self.dispatcher.listen_port = 0
+        self.dispatcher.backlog = 16
+        self.dispatcher.command_listen_port = COMMAND_PORT
+        self.dispatcher.message_forward_port = MESSAGE_PORT
+        self.dispatcher.create_sockets()
+        self.address = self.dispatcher.accept_socket.getsockname()
+
+        self.context = zmq.Context()
+        self.interface = simulatorinterface.SimulatorInterface(
+                "tcp", 0, self.context, COMMAND_PORT, MESSAGE_PORT)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.interface.message_link.close(linger=0)
+        self.interface.command_link.close(linger=0)
+        self.context.term()
+        for system_socket in self.dispatcher.connections.values():
+            system_socket.close()
+        self.dispatcher.accept_socket.close()
+        self.dispatcher.context.destroy(linger=0)
+
+    def poll_until(self, condition):
+        """Run the dispatcher until the condition holds."""
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            self.dispatcher.poll_sockets(10)
+
+    def connect(self, count):
+        """Connect clients and wait until the dispatcher has them."""
+        for unused in range(count):
+            client = socket.create_connection(self.address)
+            client.settimeout(5)
+            self.clients.append(client)
+        self.poll_until(lambda: len(self.dispatcher.connections) ==
+                                len(self.clients))
+
+    def receive(self):
+        """Receive a forwarded message on the interface."""
+        link = self.interface.message_link
+        self.poll_until(lambda: link.poll(0))
+        frames = link.recv_multipart(copy=False)
+        self.assertEqual(frames[0].bytes, b"tcp-0/")
+        return (serializer.unpack_connection_id(frames[1].bytes),
+                self.interface.serializer.from_frames(frames[2], frames[3]))
+
+    def test_forward_with_connection_id(self):
+        """Test that messages of all clients arrive with their id"""
+        self.connect(3)
+        # The subscription takes a moment.
+        time.sleep(0.2)
+        for number, client in enumerate(self.clients):
+            client.sendall(str(number).encode())
+            received = self.receive()
+            self.assertEqual(received[1], str(number).encode())
+            self.assertEqual(
+                    self.dispatcher.connections[received[0]].getpeername(),
+                    client.getsockname())
+
+    def test_framing(self):
+        """Test that every frame is forwarded as one message"""
+        self.dispatcher.framer = framing.get_framer("delimiter")
+        self.connect(1)
+        time.sleep(0.2)
+        self.clients[0].sendall(b"one\ntwo\nthr")
+        self.assertEqual(self.receive()[1], b"one\n")
+        self.assertEqual(self.receive()[1], b"two\n")
+        self.clients[0].sendall(b"ee\n")
+        self.assertEqual(self.receive()[1], b"three\n")
+
+    def readable(self, client):
+        """Return True if data for the client is waiting."""
+        return select.select([client], [], [], 0)[0] != []
+
+    def test_route_commands(self):
+        """Test commands for one client and for all clients"""
+        self.connect(3)
+        first, second, third = self.clients
+        # Wait until the command link is connected.
+        def sent():
+            self.interface.send(b"x", serializer.BROADCAST)
+            self.dispatcher.poll_sockets(10)
+            return self.readable(first)
+        self.poll_until(sent)
+        while self.dispatcher.poll_sockets(50):
+            pass
+        for client in self.clients:
+            while self.readable(client):
+                client.recv(100)
+
+        connection_ids = sorted(self.dispatcher.connections)
+        self.interface.send(b"one", connection_ids[1])
+        self.poll_until(lambda: self.readable(second))
+        self.assertEqual(second.recv(100), b"one")
+        self.assertFalse(self.readable(first) or self.readable(third))
+        self.interface.send(b"all")
+        self.poll_until(lambda: all(map(self.readable, self.clients)))
+        for client in self.clients:
+            self.assertEqual(client.recv(100), b"all")
+
+    def test_responses(self):
+        """Test responses of the dispatcher without the player"""
+        self.dispatcher.framer = framing.get_framer("delimiter")
+        self.connect(2)
+        first, second = self.clients
+        def installed():
+            self.interface.set_response(b"pong\n", prefix=b"ping")
+            self.dispatcher.poll_sockets(10)
+            return len(self.dispatcher.responses)
+        self.poll_until(installed)
+        self.interface.set_response(b"ack\n", prefix=b"data",
+                                    forward=False)
+        self.poll_until(lambda: len(self.dispatcher.responses) == 2)
+
+        first.sendall(b"data 1\nping 1\n")
+        self.assertEqual(self.receive()[1], b"ping 1\n")
+        self.assertEqual(first.recv(100), b"ack\npong\n")
+        self.assertFalse(self.readable(second))
+
+        self.interface.remove_response(prefix=b"ping")
+        self.poll_until(lambda: len(self.dispatcher.responses) == 1)
+        second.sendall(b"ping 2\n")
+        self.assertEqual(self.receive()[1], b"ping 2\n")
+        self.assertFalse(self.readable(second))
+
+    def test_invalid_commands(self):
+        """Test that invalid commands are logged and dropped"""
+        self.connect(1)
+        link = self.interface.command_link
+        broadcast = serializer.pack_connection_id(serializer.BROADCAST)
+        control = serializer.pack_connection_id(serializer.CONTROL)
+        invalid = [[b"tcp-0/", broadcast],
+                   [b"tcp-0/", broadcast, b"X", b"other serializer"],
+                   [b"tcp-0/", broadcast, b"P", b"not a pickle"],
+                   [b"tcp-0/", control, b"P", pickle.dumps("no tuple")]]
+        client = self.clients[0]
+        # Wait until the command link is connected.
+        def sent():
+            self.interface.send(b"x")
+            self.dispatcher.poll_sockets(10)
+            return self.readable(client)
+        self.poll_until(sent)
+        while self.dispatcher.poll_sockets(50):
+            pass
+        while self.readable(client):
+            client.recv(100)
+
+        with self.assertLogs(self.dispatcher.logger, 'WARNING') as logs:
+            for frames in invalid:
+                link.send_multipart(frames)
+            self.interface.send(b"valid")
+            self.poll_until(lambda: self.readable(client))
+        self.assertEqual(client.recv(100), b"valid")
+        self.assertEqual(len(logs.output), 4)
+        self.assertIn("Command has 1 frames", logs.output[0])
+        self.assertIn("not in PickleSerializer format", logs.output[1])
+        self.assertIn("Invalid PickleSerializer message", logs.output[2])
+        self.assertIn("Invalid control command 'no tuple'", logs.output[3])
+
+    def test_slow_client(self):
+        """Test that a client that does not read does not stop the
+        others, and is closed once too much data waits for it
+        """
+        self.dispatcher.max_output = 1 << 20
+        self.connect(2)
+        stalled, reader = self.clients
+        for connection_id, system_socket in self.dispatcher.connections.items():
+            if system_socket.getpeername() == stalled.getsockname():
+                stalled_id = connection_id
+                # Fill up soon.
+                system_socket.setsockopt(socket.SOL_SOCKET,
+                                         socket.SO_SNDBUF, 4096)
+        block = bytes(65536)
+        received = 0
+        start = time.monotonic()
+        for unused in range(64):
+            self.dispatcher.send_to_system(serializer.BROADCAST, block)
+            self.dispatcher.poll_sockets(0)
+            while self.readable(reader):
+                received += len(reader.recv(1 << 20))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertNotIn(stalled_id, self.dispatcher.connections)
+        while received < 64 * len(block):
+            self.dispatcher.poll_sockets(10)
+            while self.readable(reader):
+                received += len(reader.recv(1 << 20))
+        self.assertEqual(received, 64 * len(block))
+        self.assertEqual(self.dispatcher.output, {})
+
+    def test_close(self):
+        """Test that a closed client is forgotten"""
+        self.connect(2)
+        self.clients.pop().close()
+        self.poll_until(lambda: len(self.dispatcher.connections) == 1)
+
+    def test_traffic_log(self):
+        """Test that the frames to and from the system are logged"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "tcp-0.traffic")
+        self.dispatcher.traffic_log_path = path
+        self.dispatcher.open_traffic_log()
+        self.connect(1)
+        self.clients[0].sendall(b"ping")
+        self.receive()
+        connection_id = next(iter(self.dispatcher.connections))
+        self.dispatcher.send_to_system(connection_id, b"pong")
+        self.dispatcher.traffic_log.close()
+        frames = list(logpipeline.read_traffic(path))
+        self.assertEqual([frame[1:] for frame in frames],
+                         [(connection_id, logpipeline.RECEIVED, b"ping"),
+                          (connection_id, logpipeline.SENT, b"pong")])
+        self.assertLessEqual(frames[0][0], frames[1][0])
+
+
+class UDPDispatcherTestCase(unittest.TestCase):
+    """Tests for the batches and replies of the UDP dispatcher"""
+
+    def setUp(self):
+        self.dispatcher = dispatcher.UDPDispatcher("udp", 0)
+        self.dispatcher.accept_address = "127.0.0.1"
+        self.dispatcher.listen_port = 0
+        self.dispatcher.command_listen_port = COMMAND_PORT
+        self.dispatcher.message_forward_port = MESSAGE_PORT
+        self.dispatcher.serializer = serializer.get_serializer("raw")
+        self.dispatcher.create_sockets()
+        self.address = self.dispatcher.accept_socket.getsockname()
+
+        self.context = zmq.Context()
+        self.interface = simulatorinterface.SimulatorInterface(
+                "udp", 0, self.context, COMMAND_PORT, MESSAGE_PORT,
+                serializer="raw")
+        self.received = []
+        self.interface.set_callback(
+                simulatorinterface.ANY,
+                lambda message: self.received.append(
+                    (self.interface.connection_id, bytes(message))))
+        self.senders = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                        for unused in range(2)]
+        for sender in self.senders:
+            sender.bind(("127.0.0.1", 0))
+        # The subscription takes a moment.
+        time.sleep(0.2)
+
+    def tearDown(self):
+        for sender in self.senders:
+            sender.close()
+        self.interface.message_link.close(linger=0)
+        self.interface.command_link.close(linger=0)
+        self.context.term()
+        self.dispatcher.accept_socket.close()
+        self.dispatcher.context.destroy(linger=0)
+
+    def test_batch(self):
+        """Test that waiting datagrams are forwarded in one batch"""
+        for number in range(100):
+            self.senders[number % 2].sendto(str(number).encode(),
+                                            self.address)
+        # Let all datagrams arrive before the dispatcher wakes up.
+        time.sleep(0.05)
+        self.dispatcher.poll_sockets(1000)
+        link = self.interface.message_link
+        self.assertTrue(link.poll(1000))
+        self.interface.on_message(link, None)
+        self.assertFalse(link.poll(100))
+        self.assertEqual([data for unused, data in self.received],
+                         [str(number).encode() for number in range(100)])
+        first, second = self.received[0][0], self.received[1][0]
+        self.assertNotEqual(first, second)
+        self.assertEqual(set(self.received[2::2]), set(
+            (first, str(number).encode()) for number in range(2, 100, 2)))
+        self.assertEqual(self.dispatcher.peers[second],
+                         self.senders[1].getsockname())
+
+    def test_responses(self):
+        """Test that the control messages pass a raw link"""
+        deadline = time.monotonic() + 5
+        while not self.dispatcher.responses:
+            self.assertLess(time.monotonic(), deadline)
+            self.interface.set_response(b"pong", prefix=b"ping",
+                                        forward=False)
+            self.dispatcher.poll_sockets(10)
+        self.senders[0].sendto(b"ping 1", self.address)
+        self.dispatcher.poll_sockets(1000)
+        self.senders[0].settimeout(5)
+        self.assertEqual(self.senders[0].recv(100), b"pong")
+        self.interface.remove_response(prefix=b"ping")
+        self.dispatcher.poll_sockets(1000)
+        self.assertEqual(len(self.dispatcher.responses), 0)
+
+    def test_receive_error(self):
+        """Test that an error of the socket does not keep the
+        dispatcher reading"""
+        class Broken(object):
+            def recvfrom_into(self, buffer):
+                raise ConnectionRefusedError("refused")
+        with self.assertLogs(self.dispatcher.logger, 'WARNING') as logs:
+            self.dispatcher.read_datagrams(Broken())
+        self.assertEqual(len(logs.output), 1)
+
+    def test_max_peers(self):
+        """Test that the sender that was quiet the longest is forgotten"""
+        self.dispatcher.max_peers = 2
+        third = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(third.close)
+        third.bind(("127.0.0.1", 0))
+        for sender in self.senders + [self.senders[0], third]:
+            sender.sendto(b"data", self.address)
+            self.dispatcher.poll_sockets(1000)
+        self.assertEqual(set(self.dispatcher.peer_ids),
+                         {self.senders[0].getsockname(),
+                          third.getsockname()})
+        self.assertEqual(sorted(self.dispatcher.peers),
+                         sorted(self.dispatcher.peer_ids.values()))
+
+    def test_reply(self):
+        """Test a reply to the sender of a datagram"""
+        self.senders[1].sendto(b"ping", self.address)
+        self.dispatcher.poll_sockets(1000)
+        connection_id = self.dispatcher.peer_ids[
+                self.senders[1].getsockname()]
+        self.senders[1].settimeout(0)
+        deadline = time.monotonic() + 5
+        while True:
+            self.interface.send(b"pong", connection_id)
+            self.dispatcher.poll_sockets(10)
+            try:
+                self.assertEqual(self.senders[1].recv(100), b"pong")
+                break
+            except BlockingIOError:
+                self.assertLess(time.monotonic(), deadline)
+
+
+class HttpDispatcherTestCase(unittest.TestCase):
+    """Tests for keep-alive, pipelining and the responses of the player
+    in the HTTP dispatcher
+    """
+
+    def setUp(self):
+        self.dispatcher = dispatcher.HttpDispatcher("http", 0)
+        self.dispatcher.accept_address = "127.0.0.1"
+        self.dispatcher.listen_port = 0
+        self.dispatcher.backlog = 16
+        self.dispatcher.command_listen_port = COMMAND_PORT
+        self.dispatcher.message_forward_port = MESSAGE_PORT
+        self.dispatcher.create_sockets()
+        self.address = self.dispatcher.accept_socket.getsockname()
+
+        self.context = zmq.Context()
+        self.interface = simulatorinterface.SimulatorInterface(
+                "http", 0, self.context, COMMAND_PORT, MESSAGE_PORT)
+        self.requests = []
+        self.interface.set_callback(simulatorinterface.ANY,
+                                    self.requests.append)
+        self.clients = []
+        # The subscriptions take a moment.
+        time.sleep(0.2)
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.interface.message_link.close(linger=0)
+        self.interface.command_link.close(linger=0)
+        self.context.term()
+        for system_socket in self.dispatcher.connections.values():
+            system_socket.close()
+        self.dispatcher.accept_socket.close()
+        self.dispatcher.context.destroy(linger=0)
+
+    def connect(self):
+        client = socket.create_connection(self.address)
+        client.settimeout(5)
+        self.clients.append(client)
+        return client
+
+    def wait_for_requests(self, count):
+        """Run the dispatcher until the player has the requests."""
+        link = self.interface.message_link
+        deadline = time.monotonic() + 5
+        while len(self.requests) < count:
+            self.assertLess(time.monotonic(), deadline)
+            self.dispatcher.poll_sockets(10)
+            if link.poll(0):
+                self.interface.on_message(link, None)
+
+    def respond(self, response):
+        """Send a response of the player through the dispatcher."""
+        self.interface.send(response)
+        self.dispatcher.poll_sockets(1000)
+
+    def read(self, client, expected):
+        """Read as many bytes from the client as expected."""
+        data = b""
+        while len(data) < len(expected):
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        self.assertEqual(data, expected)
+
+    def test_pipelining(self):
+        """Test pipelined requests, answered out of order, on one
+        connection that stays open
+        """
+        client = self.connect()
+        client.sendall(b"GET /status?x=1 HTTP/1.1\r\nHost: a\r\n\r\n"
+                       b"POST /data HTTP/1.1\r\n"
+                       b"Transfer-Encoding: chunked\r\n\r\n3\r\nabc")
+        self.wait_for_requests(1)
+        client.sendall(b"\r\n2\r\nde\r\n0\r\n\r\n")
+        self.wait_for_requests(2)
+        status, data = self.requests
+        self.assertEqual(status.message_id, "/status")
+        self.assertEqual(status.headers, {"host": "a"})
+        self.assertEqual((data.method, data.body), ("POST", b"abcde"))
+        self.assertNotEqual(status.request_id, data.request_id)
+
+        self.respond(data.response(201, b"stored"))
+        self.respond(status.response(body=b"ok",
+                                     headers={"Content-Type": "text/plain"}))
+        self.read(client, b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n"
+                          b"Content-Length: 2\r\n\r\nok"
+                          b"HTTP/1.1 201 Created\r\n"
+                          b"Content-Length: 6\r\n\r\nstored")
+
+        client.sendall(b"GET /bye HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.wait_for_requests(3)
+        self.respond(self.requests[2].response(204))
+        self.read(client, b"HTTP/1.1 204 No Content\r\nContent-Length: 0"
+                          b"\r\nConnection: close\r\n\r\n")
+        self.assertEqual(client.recv(100), b"")
+        self.assertEqual(self.dispatcher.connections, {})
+        self.assertEqual(self.dispatcher.request_connections, {})
+
+    def test_large_response(self):
+        """Test that a response larger than the socket buffers is sent
+        without waiting for the client, and in full before the
+        connection closes
+        """
+        client = self.connect()
+        client.sendall(b"GET /big HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.wait_for_requests(1)
+        body = bytes(range(256)) * 32768
+        start = time.monotonic()
+        self.dispatcher.send_to_system(None,
+                                       self.requests[0].response(body=body))
+        self.assertLess(time.monotonic() - start, 0.5)
+        data = bytearray()
+        deadline = time.monotonic() + 5
+        while True:
+            self.assertLess(time.monotonic(), deadline)
+            self.dispatcher.poll_sockets(0)
+            if select.select([client], [], [], 0.01)[0]:
+                chunk = client.recv(1 << 20)
+                if not chunk:
+                    break
+                data += chunk
+        self.assertTrue(data.endswith(body))
+        self.assertEqual(self.dispatcher.connections, {})
+
+    def test_connections(self):
+        """Test that each connection gets its own response"""
+        first, second = self.connect(), self.connect()
+        first.sendall(b"GET /one HTTP/1.1\r\n\r\n")
+        second.sendall(b"GET /two HTTP/1.1\r\nContent-Length: 1\r\n\r\nx")
+        self.wait_for_requests(2)
+        for request in self.requests:
+            self.respond(request.response(body=request.message_id.encode()))
+        self.read(first, b"HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\n/one")
+        self.read(second, b"HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\n/two")
+
+    def test_responses(self):
+        """Test a response of the dispatcher after a request that waits
+        for the player
+        """
+        deadline = time.monotonic() + 5
+        while not self.dispatcher.responses:
+            self.assertLess(time.monotonic(), deadline)
+            self.interface.set_response(httpparser.HttpResponse(body=b"up"),
+                                        message_id="/health", forward=False)
+            self.dispatcher.poll_sockets(10)
+        client = self.connect()
+        client.sendall(b"GET /slow HTTP/1.1\r\n\r\n"
+                       b"GET /health HTTP/1.1\r\n\r\n")
+        self.wait_for_requests(1)
+        self.respond(self.requests[0].response(body=b"done"))
+        self.read(client, b"HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\ndone"
+                          b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nup")
+        self.assertEqual(len(self.requests), 1)
+
+    def test_invalid_request(self):
+        """Test that an invalid request is refused"""
+        client = self.connect()
+        client.sendall(b"HELLO\r\n\r\n")
+        deadline = time.monotonic() + 5
+        while not self.dispatcher.connections:
+            self.assertLess(time.monotonic(), deadline)
+            self.dispatcher.poll_sockets(10)
+        while self.dispatcher.connections:
+            self.assertLess(time.monotonic(), deadline)
+            self.dispatcher.poll_sockets(10)
+        self.read(client, b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0"
+                          b"\r\nConnection: close\r\n\r\n")
+
+
+class SerialDispatcherTestCase(unittest.TestCase):
+    """Tests for the framing of the serial dispatcher, on a pty"""
+
+    def setUp(self):
+        self.master, slave = os.openpty()
+        tty.setraw(self.master)
+        self.dispatcher = dispatcher.SerialDispatcher("serial", 0)
+        self.dispatcher.serial_device = os.ttyname(slave)
+        os.close(slave)
+        self.dispatcher.serial_baudrate = 9600
+        self.dispatcher.serial_bytesize = 8
+        self.dispatcher.serial_parity = serial.PARITY_NONE
+        self.dispatcher.serial_stopbits = serial.STOPBITS_ONE
+        self.dispatcher.command_listen_port = COMMAND_PORT
+        self.dispatcher.message_forward_port = MESSAGE_PORT
+        self.frames = []
+        self.dispatcher.forward = (
+                lambda connection_id, message: self.frames.append(message))
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+        os.close(self.master)
+        self.dispatcher.context.destroy(linger=0)
+
+    def run_dispatcher(self, duration):
+        """Run the poll loop of the dispatcher for a while."""
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            events = self.dispatcher.poll_sockets(self.dispatcher.timeout)
+            self.dispatcher.after_poll(events)
+            if self.dispatcher.timeout == self.dispatcher.default_timeout:
+                # Between frames, check the deadline now and then.
+                self.dispatcher.timeout = 5
+
+    def test_gap(self):
+        """Test that a gap of 3.5 characters ends a frame"""
+        self.dispatcher.create_sockets()
+        # 10 bits at 9600 baud, 3.5 characters
+        self.assertAlmostEqual(self.dispatcher.gap, 3645833, delta=10)
+        os.write(self.master, b"abc")
+        self.run_dispatcher(0.05)
+        os.write(self.master, b"de")
+        self.run_dispatcher(0.05)
+        self.assertEqual(self.frames, [b"abc", b"de"])
+
+    def test_delimiter(self):
+        """Test that back-to-back frames are forwarded one by one"""
+        self.dispatcher.framer = framing.get_framer("delimiter")
+        self.dispatcher.create_sockets()
+        os.write(self.master, b"one\ntwo\nthr")
+        self.run_dispatcher(0.05)
+        self.assertEqual(self.frames, [b"one\n", b"two\n"])
+        # The incomplete frame was dropped at the gap.
+        os.write(self.master, b"four\n")
+        self.run_dispatcher(0.05)
+        self.assertEqual(self.frames, [b"one\n", b"two\n", b"four\n"])
+
+    def test_reader_thread(self):
+        """Test frames that are read on the reader thread"""
+        self.dispatcher.use_reader_thread = True
+        self.dispatcher.create_sockets()
+        os.write(self.master, b"abc")
+        self.run_dispatcher(0.05)
+        os.write(self.master, b"de")
+        self.run_dispatcher(0.05)
+        self.assertEqual([bytes(frame) for frame in self.frames],
+                         [b"abc", b"de"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import unittest
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zmq
+import dispatcher
+import endpoints
+import simulatorinterface
+
+
+class AddressTestCase(unittest.TestCase):
+    """Tests for the bind and connect addresses"""
+
+    def test_bind_address(self):
+        """Test the endpoint, the port and a free port"""
+        self.assertEqual(endpoints.bind_address("ipc:///tmp/a", 9000),
+                         "ipc:///tmp/a")
+        self.assertEqual(endpoints.bind_address(None, 9000),
+                         "tcp://*:9000")
+        self.assertEqual(endpoints.bind_address(None, "0"), "tcp://*:*")
+        self.assertEqual(endpoints.bind_address(), "tcp://*:*")
+
+    def test_connect_address(self):
+        """Test ports and wildcard hosts"""
+        self.assertEqual(endpoints.connect_address(9000),
+                         "tcp://localhost:9000")
+        self.assertEqual(endpoints.connect_address("9000"),
+                         "tcp://localhost:9000")
+        self.assertEqual(endpoints.connect_address("tcp://0.0.0.0:4000"),
+                         "tcp://localhost:4000")
+        self.assertEqual(endpoints.connect_address("tcp://10.0.0.1:4000"),
+                         "tcp://10.0.0.1:4000")
+        self.assertEqual(endpoints.connect_address("inproc://tcp-0"),
+                         "inproc://tcp-0")
+
+
+class RegistryTestCase(unittest.TestCase):
+    """Tests for the endpoint registry"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.registry = endpoints.EndpointRegistry(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resolve(self):
+        """Test that an announced simulator is found"""
+        self.registry.announce("tcp-0", "tcp://0.0.0.0:4000",
+                               "ipc:///tmp/tcp-0")
+        self.assertEqual(self.registry.resolve("tcp-0"),
+                         ("tcp://localhost:4000", "ipc:///tmp/tcp-0"))
+
+    def test_withdraw(self):
+        """Test that a withdrawn simulator is not found"""
+        self.registry.announce("tcp-0", "tcp://*:4000", "tcp://*:4001")
+        self.registry.withdraw("tcp-0")
+        self.assertRaises(endpoints.EndpointException,
+                          self.registry.resolve, "tcp-0")
+
+    def test_dead_process(self):
+        """Test that the entry of a process that is gone is ignored"""
+        process = subprocess.Popen(
+                [sys.executable, '-c',
+                 'import sys; sys.path.insert(0, {0!r}); import endpoints;'
+                 'endpoints.EndpointRegistry({1!r}).announce("tcp-0", '
+                 '"tcp://*:4000", "tcp://*:4001")'.format(
+                     os.path.dirname(endpoints.__file__),
+                     self.directory.name)])
+        process.wait()
+        self.assertRaises(endpoints.EndpointException,
+                          self.registry.resolve, "tcp-0")
+        # Nor can another process withdraw it.
+        self.registry.withdraw("tcp-0")
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name,
+                                                    "tcp-0.json")))
+
+    def test_timeout(self):
+        """Test that resolve waits for the simulator"""
+        start = time.monotonic()
+        self.assertRaises(endpoints.EndpointException,
+                          self.registry.resolve, "tcp-0", 0.05)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_invalid_name(self):
+        """Test that a name can not leave the directory"""
+        self.assertRaises(endpoints.EndpointException,
+                          self.registry.announce, "../tcp-0", "", "")
+
+
+class EndpointDispatcherTestCase(unittest.TestCase):
+    """Tests for dispatchers on other transports than TCP ports"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dispatcher = dispatcher.TCPDispatcher("tcp", 0)
+        self.dispatcher.registry = endpoints.EndpointRegistry(
+                                                self.directory.name)
+        self.dispatcher.accept_address = "127.0.0.1"
+        self.dispatcher.listen_port = 0
+        self.dispatcher.backlog = 16
+        self.context = None
+        self.interface = None
+
+    def tearDown(self):
+        if self.interface is not None:
+            self.interface.message_link.close(linger=0)
+            self.interface.command_link.close(linger=0)
+        self.dispatcher.withdraw()
+        self.dispatcher.accept_socket.close()
+        self.dispatcher.context.destroy(linger=0)
+        if self.context is not None:
+            self.context.term()
+        self.directory.cleanup()
+
+    def connect(self, context):
+        """Connect an interface to the announced endpoints and check
+        that the messages go through
+        """
+        command, message = self.dispatcher.registry.resolve("tcp-0")
+        self.assertEqual((command, message),
+                         tuple(endpoints.connect_address(endpoint)
+                               for endpoint in self.dispatcher.endpoints))
+        self.interface = simulatorinterface.SimulatorInterface(
+                "tcp", 0, context, command, message, topic="tcp-0")
+        received = []
+        self.interface.set_callback(simulatorinterface.ANY, received.append)
+        deadline = time.monotonic() + 5
+        while not received:
+            self.assertLess(time.monotonic(), deadline)
+            self.dispatcher.poll_sockets(10)
+            self.dispatcher.forward(1, b"ping")
+            while self.interface.message_link.poll(10):
+                self.interface.on_message(self.interface.message_link, None)
+        self.assertEqual(received[0], b"ping")
+
+    def test_free_ports(self):
+        """Test that the system picks the ports"""
+        self.dispatcher.create_sockets()
+        self.assertTrue(self.dispatcher.endpoints[0].startswith(
+                                                    "tcp://0.0.0.0:"))
+        self.context = zmq.Context()
+        self.connect(self.context)
+
+    def test_ipc(self):
+        """Test links over ipc"""
+        self.dispatcher.command_endpoint = "ipc://{0}/command".format(
+                                                    self.directory.name)
+        self.dispatcher.message_endpoint = "ipc://{0}/message".format(
+                                                    self.directory.name)
+        self.dispatcher.create_sockets()
+        self.context = zmq.Context()
+        self.connect(self.context)
+
+    def test_inproc(self):
+        """Test links over inproc, in the context of the player"""
+        context = zmq.Context()
+        self.dispatcher.use_context(context)
+        self.dispatcher.command_endpoint = "inproc://tcp-0-command"
+        self.dispatcher.message_endpoint = "inproc://tcp-0-message"
+        self.dispatcher.create_sockets()
+        self.connect(context)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+import socket
+import struct
+import framing
+
+
+class LineMessage(object):
+    """Message class that reports its frames: a length byte and data."""
+    def frame_length(self, data):
+        if len(data) < 1 or len(data) < 1 + data[0]:
+            return None
+        return 1 + data[0]
+
+
+class HeaderMessage(object):
+    """Message class that reports its frames from a header: a length
+    byte, whether the data has arrived or not."""
+    def frame_length(self, data):
+        if len(data) < 1:
+            return None
+        return 1 + data[0]
+
+
+class FramingTestCase(unittest.TestCase):
+    """Tests for the framers and the buffer in the framing module"""
+
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def receive(self, framer, chunks, buffer_size=16):
+        """Send the chunks one by one and collect the frames."""
+        buffer = framing.StreamBuffer(buffer_size)
+        frames = []
+        for chunk in chunks:
+            self.sender.sendall(chunk)
+            received = 0
+            while received < len(chunk):
+                received += buffer.recv_into(self.receiver)
+                frames.extend(bytes(frame)
+                              for frame in buffer.frames(framer))
+        return frames, buffer
+
+    def test_length(self):
+        """Test length-prefixed frames, merged, split and larger than
+        the buffer.
+        """
+        def frame(data):
+            return struct.pack('>H', len(data)) + data
+        big = bytes(range(256)) * 4
+        frames, buffer = self.receive(
+                framing.get_framer("length", size=2),
+                [frame(b"a") + frame(b"bc") + frame(b"d")[:1],
+                 frame(b"d")[1:] + frame(big)[:100],
+                 frame(big)[100:]])
+        self.assertEqual(frames, [frame(b"a"), frame(b"bc"), frame(b"d"),
+                                  frame(big)])
+        self.assertEqual(len(buffer), 0)
+
+    def test_length_strip(self):
+        """Test a length field after a type byte that counts itself"""
+        framer = framing.get_framer("length", size=1, offset=1, adjust=-2,
+                                    strip=True)
+        frames, unused = self.receive(framer, [b"\x07\x05abc\x08\x02"])
+        self.assertEqual(frames, [b"abc", b""])
+
+    def test_delimiter(self):
+        """Test delimited frames"""
+        frames, buffer = self.receive(
+                framing.get_framer("delimiter", delimiter=b"\r\n"),
+                [b"one\r\ntwo\r", b"\nthree"])
+        self.assertEqual(frames, [b"one\r\n", b"two\r\n"])
+        self.assertEqual(len(buffer), 5)
+
+    def test_fixed_and_message(self):
+        """Test fixed-size frames and frames of the message class"""
+        frames, unused = self.receive(framing.get_framer("fixed", size=3),
+                                      [b"abcd", b"efgh"])
+        self.assertEqual(frames, [b"abc", b"def"])
+        frames, unused = self.receive(
+                framing.get_framer("message", message=LineMessage()),
+                [b"\x02ab\x01", b"c\x00"])
+        self.assertEqual(frames, [b"\x02ab", b"\x01c", b"\x00"])
+        frames, buffer = self.receive(
+                framing.get_framer("message", message=HeaderMessage()),
+                [b"\x05ab", b"cd", b"e\x03x"])
+        self.assertEqual(frames, [b"\x05abcde"])
+        self.assertEqual(len(buffer), 2)
+
+    def test_delimiter_search(self):
+        """Test that the bytes of a frame are searched once, also when
+        the delimiter is split over two reads
+        """
+        framer = framing.get_framer("delimiter", delimiter=b"\r\n")
+        searched = []
+        find = bytearray.find
+        class Buffer(bytearray):
+            def find(self, sub, start, end):
+                searched.append(end - start)
+                return find(self, sub, start, end)
+        buffer = framing.StreamBuffer(64)
+        buffer.buffer = Buffer(64)
+        buffer.view = memoryview(buffer.buffer)
+        chunks = [b"ab", b"cd", b"ef\r", b"\ngh", b"ijklmnop", b"qrs\r\n"]
+        frames = []
+        for chunk in chunks:
+            self.sender.sendall(chunk)
+            received = 0
+            while received < len(chunk):
+                received += buffer.recv_into(self.receiver)
+                frames.extend(bytes(frame)
+                              for frame in buffer.frames(framer))
+        self.assertEqual(frames, [b"abcdef\r\n", b"ghijklmnopqrs\r\n"])
+        # The new bytes, and the byte before them.
+        self.assertEqual(searched, [2, 3, 4, 4, 2, 9, 6])
+
+    def test_max_size(self):
+        """Test that a frame larger than the maximum is refused"""
+        buffer = framing.StreamBuffer(4, max_size=8)
+        self.sender.sendall(b"x" * 20)
+        framer = framing.get_framer("delimiter")
+        self.assertRaises(framing.FramingException, lambda: [
+                list(buffer.frames(framer))
+                for unused in range(10) if buffer.recv_into(self.receiver)])
+
+    def test_grow(self):
+        """Test that a buffer starts small and grows with full reads"""
+        buffer = framing.StreamBuffer()
+        self.assertEqual(len(buffer.buffer), 4096)
+        self.sender.sendall(b"x" * 100)
+        buffer.recv_into(self.receiver)
+        list(buffer.frames(framing.StreamFramer()))
+        self.assertEqual(len(buffer.buffer), 4096)
+        for unused in range(10):
+            self.sender.sendall(b"x" * 65536)
+            received = 0
+            while received < 65536:
+                received += buffer.recv_into(self.receiver)
+                list(buffer.frames(framing.StreamFramer()))
+        self.assertEqual(len(buffer.buffer), 65536)
+
+    def test_unknown(self):
+        """Test that an unknown framing type is refused"""
+        self.assertRaises(framing.FramingException,
+                          framing.get_framer, "xml")
+
+
+if __name__ == '__main__':
+    unittest.main()
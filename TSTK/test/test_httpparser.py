@@ -0,0 +1,76 @@
+import unittest
+import framing
+import httpparser
+
+
+class RequestParserTestCase(unittest.TestCase):
+    """Tests for the incremental HTTP request parser"""
+
+    def parse(self, chunks, parser=None):
+        """Feed the chunks one by one and collect the requests."""
+        parser = parser or httpparser.RequestParser()
+        buffer = framing.StreamBuffer(16)
+        requests = []
+        for chunk in chunks:
+            while chunk:
+                count = buffer.fill(lambda view: self.copy_into(view, chunk))
+                chunk = chunk[count:]
+                requests.extend(parser.requests(buffer))
+        return requests, buffer
+
+    def copy_into(self, view, chunk):
+        count = min(len(view), len(chunk))
+        view[:count] = chunk[:count]
+        return count
+
+    def test_byte_by_byte(self):
+        """Test pipelined requests that arrive one byte at a time"""
+        data = (b"POST /a HTTP/1.1\r\nContent-Length: 3\r\n\r\nxyz"
+                b"POST /b HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"2;ext=1\r\nab\r\n1\r\nc\r\n0\r\nX-Trailer: 1\r\n\r\n"
+                b"GET /c HTTP/1.0\r\nConnection: Keep-Alive\r\n\r\n")
+        requests, buffer = self.parse([data[i:i + 1]
+                                       for i in range(len(data))])
+        self.assertEqual([(r.message_id, r.body) for r in requests],
+                         [("/a", b"xyz"), ("/b", b"abc"), ("/c", b"")])
+        self.assertTrue(all(r.keep_alive for r in requests))
+        self.assertEqual(len(buffer), 0)
+
+    def test_keep_alive(self):
+        """Test the connection header of HTTP/1.0 and HTTP/1.1"""
+        requests, unused = self.parse([
+                b"GET / HTTP/1.0\r\n\r\n",
+                b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n"])
+        self.assertEqual([r.keep_alive for r in requests], [False, False])
+
+    def test_invalid(self):
+        """Test that invalid requests are refused"""
+        for data in (b"GET /\r\n\r\n",
+                     b"GET / HTTP/1.1\r\nNo colon\r\n\r\n",
+                     b"GET / HTTP/1.1\r\nContent-Length: x\r\n\r\n",
+                     b"GET / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+                     b"zz\r\n"):
+            self.assertRaises(httpparser.HttpException, self.parse, [data])
+
+    def test_limits(self):
+        """Test the limits of the head and the body"""
+        parser = httpparser.RequestParser(max_header_size=32,
+                                          max_body_size=4)
+        self.assertRaises(httpparser.HttpException, self.parse,
+                          [b"GET / HTTP/1.1\r\n", b"X-Long: " + b"x" * 30],
+                          parser)
+        parser = httpparser.RequestParser(max_body_size=4)
+        self.assertRaises(httpparser.HttpException, self.parse,
+                          [b"PUT / HTTP/1.1\r\nContent-Length: 5\r\n\r\n"],
+                          parser)
+
+    def test_response(self):
+        """Test the bytes of a response"""
+        response = httpparser.HttpResponse(7, 404, b"gone", {"X-A": "1"})
+        self.assertEqual(response.to_bytes(False),
+                         b"HTTP/1.1 404 Not Found\r\nX-A: 1\r\n"
+                         b"Content-Length: 4\r\nConnection: close\r\n\r\ngone")
+
+
+if __name__ == '__main__':
+    unittest.main()
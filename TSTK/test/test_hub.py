@@ -0,0 +1,179 @@
+import unittest
+import os
+import socket
+import tempfile
+import time
+import zmq
+import capture
+import dispatcher
+import hub
+import simulatorinterface
+
+
+COMMAND_PORT = 29111
+MESSAGE_PORT = 29112
+
+
+class HubTestCase(unittest.TestCase):
+    """Tests for simulators that share the links of a hub"""
+
+    def setUp(self):
+        self.hub = hub.Hub("hub", 0)
+        self.hub.command_listen_port = COMMAND_PORT
+        self.hub.message_forward_port = MESSAGE_PORT
+        for simulator_id in range(2):
+            a_dispatcher = dispatcher.TCPDispatcher("tcp", simulator_id)
+            a_dispatcher.accept_address = "127.0.0.1"
+            a_dispatcher.listen_port = 0
+            a_dispatcher.backlog = 16
+            self.hub.add_dispatcher(a_dispatcher)
+        self.hub.create_sockets()
+        self.dispatchers = list(self.hub.dispatchers.values())
+
+        self.context = zmq.Context()
+        self.interfaces = []
+        self.received = []
+        for simulator_id in range(2):
+            interface = simulatorinterface.SimulatorInterface(
+                    "tcp", simulator_id, self.context, COMMAND_PORT,
+                    MESSAGE_PORT, topic="tcp-{0}".format(simulator_id))
+            interface.set_callback(
+                    simulatorinterface.ANY,
+                    lambda message, simulator_id=simulator_id:
+                        self.received.append((simulator_id, message)))
+            self.interfaces.append(interface)
+        self.clients = [socket.create_connection(
+                            a_dispatcher.accept_socket.getsockname())
+                        for a_dispatcher in self.dispatchers]
+        for client in self.clients:
+            client.settimeout(5)
+        self.poll_until(lambda: all(a_dispatcher.connections
+                                    for a_dispatcher in self.dispatchers))
+        # The subscriptions take a moment, and the hub has to poll to
+        # pass them on.
+        deadline = time.monotonic() + 0.2
+        while time.monotonic() < deadline:
+            self.hub.poll_sockets(10)
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        for interface in self.interfaces:
+            interface.message_link.close(linger=0)
+            interface.command_link.close(linger=0)
+        self.context.term()
+        for a_dispatcher in self.dispatchers:
+            for system_socket in a_dispatcher.connections.values():
+                system_socket.close()
+            a_dispatcher.accept_socket.close()
+        self.hub.context.destroy(linger=0)
+
+    def poll_until(self, condition):
+        """Run the hub until the condition holds."""
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            self.hub.poll_sockets(10)
+            for interface in self.interfaces:
+                while interface.message_link.poll(0):
+                    interface.on_message(interface.message_link, None)
+
+    def test_shared_context(self):
+        """Test that the dispatchers use the loop of the hub"""
+        for a_dispatcher in self.dispatchers:
+            self.assertIs(a_dispatcher.context, self.hub.context)
+            self.assertIs(a_dispatcher.repeater_socket,
+                          self.hub.repeater_socket)
+        self.assertEqual(len(self.hub.call_backs), 5)
+
+    def test_messages(self):
+        """Test that a message only reaches the interface of its
+        simulator
+        """
+        self.clients[1].sendall(b"one")
+        self.clients[0].sendall(b"zero")
+        self.poll_until(lambda: len(self.received) == 2)
+        self.assertEqual(sorted(self.received), [(0, b"zero"), (1, b"one")])
+
+    def test_commands(self):
+        """Test that a command only reaches the system of its
+        simulator
+        """
+        self.interfaces[1].send(b"one")
+        self.hub.poll_sockets(1000)
+        self.assertEqual(self.clients[1].recv(100), b"one")
+        self.clients[0].setblocking(False)
+        self.assertRaises(BlockingIOError, self.clients[0].recv, 100)
+
+
+class HubConfigTestCase(unittest.TestCase):
+    """Tests for the configuration of a hub"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+        with open('simulator.conf', 'w') as config:
+            config.write("[dispatcher-hub-3]\n"
+                         "CommandListenPort = 29111\n"
+                         "MessageForwardPort = 29112\n"
+                         "Simulators = tcp-0, udp-1\n"
+                         "[dispatcher-tcp-0]\n"
+                         "AcceptAddress = 127.0.0.1\n"
+                         "ListenPort = 0\n"
+                         "[dispatcher-udp-1]\n"
+                         "AcceptAddress = 127.0.0.1\n"
+                         "ListenPort = 0\n"
+                         "Topic = sensors\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_config(self):
+        """Test that the simulators of the hub are created"""
+        a_hub = hub.Hub("hub", 3)
+        try:
+            self.assertEqual(sorted(a_hub.dispatchers), [b"sensors/",
+                                                         b"tcp-0/"])
+            self.assertIsInstance(a_hub.dispatchers[b"tcp-0/"],
+                                  dispatcher.TCPDispatcher)
+            self.assertIsInstance(a_hub.dispatchers[b"sensors/"],
+                                  dispatcher.UDPDispatcher)
+        finally:
+            a_hub.context.destroy(linger=0)
+
+    def test_capture(self):
+        """Test that the captures of the simulators are closed with the
+        hub, and that they cannot replay
+        """
+        with open('simulator.conf', 'a') as config:
+            config.write("[dispatcher-hub-4]\n"
+                         "Simulators = tcp-5\n"
+                         "[dispatcher-tcp-5]\n"
+                         "AcceptAddress = 127.0.0.1\n"
+                         "ListenPort = 0\n"
+                         "Capture = tcp-5.capture\n"
+                         "Replay = old.capture\n")
+        with self.assertLogs(level='ERROR') as logs:
+            a_hub = hub.Hub("hub", 4)
+        try:
+            a_dispatcher = a_hub.dispatchers[b"tcp-5/"]
+            self.assertIsNone(a_dispatcher.replay_path)
+            self.assertIn("Replay of tcp-5", logs.output[0])
+            # Only opened when the hub runs.
+            self.assertIsNone(a_dispatcher.traffic_log)
+            self.assertFalse(os.path.exists('tcp-5.capture'))
+            a_hub.open_traffic_log()
+            a_dispatcher.traffic_log.record(1, 1, b"frame", 1)
+            a_hub.shutdown()
+        finally:
+            a_hub.context.destroy(linger=0)
+        with capture.CaptureReader('tcp-5.capture') as reader:
+            self.assertIsNotNone(reader.index)
+            self.assertEqual([bytes(frame[3]) for frame
+                              in reader.frames(message_id=1)], [b"frame"])
+
+
+if __name__ == '__main__':
+    unittest.main()
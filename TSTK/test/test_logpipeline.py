@@ -0,0 +1,142 @@
+import unittest
+import logging
+import os
+import tempfile
+import logpipeline
+
+
+class ListHandler(logging.Handler):
+    """Keeps the formatted records"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+def record(category=None, msg='message', args=()):
+    """A record of a category."""
+    a_record = logging.LogRecord('test', logging.INFO, __file__, 1, msg,
+                                 args, None)
+    if category is not None:
+        a_record.category = category
+    return a_record
+
+
+class CategoryFilterTestCase(unittest.TestCase):
+    """Tests for sampling and rate limiting"""
+
+    def setUp(self):
+        self.filter = logpipeline.CategoryFilter()
+
+    def test_no_limit(self):
+        """Test that records without limits pass"""
+        self.filter.limit('traffic', sample=2)
+        self.assertTrue(all(self.filter.filter(record())
+                            for unused in range(10)))
+        self.assertTrue(all(self.filter.filter(record('alive'))
+                            for unused in range(10)))
+
+    def test_sample(self):
+        """Test that one in sample records passes"""
+        self.filter.limit('traffic', sample=3)
+        passed = [self.filter.filter(record('traffic'))
+                  for unused in range(9)]
+        self.assertEqual(passed, [False, False, True] * 3)
+
+    def test_rate(self):
+        """Test that no more than the burst passes at once, and that
+        the next record tells how many were suppressed
+        """
+        self.filter.limit('traffic', rate=0.001, burst=2)
+        passed = [self.filter.filter(record('traffic'))
+                  for unused in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+        self.filter.limits['traffic'][4] = 1
+        a_record = record('traffic', 'frame %s', (1,))
+        self.assertTrue(self.filter.filter(a_record))
+        self.assertEqual(a_record.getMessage(), 'frame 1 [3 suppressed]')
+        self.filter.limits['traffic'][4] = 0
+        self.assertFalse(self.filter.filter(record('traffic')))
+        self.filter.limits['traffic'][4] = 1
+        a_record = record('traffic', '100% of frames', ())
+        self.assertTrue(self.filter.filter(a_record))
+        self.assertEqual(a_record.getMessage(),
+                         '100% of frames [1 suppressed]')
+
+
+class LogPipelineTestCase(unittest.TestCase):
+    """Tests for the queue between the logger and the handlers"""
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_logpipeline')
+        self.logger.propagate = False
+        self.handler = ListHandler()
+        self.pipeline = logpipeline.get_pipeline(self.logger, self.handler)
+
+    def tearDown(self):
+        self.pipeline.stop()
+
+    def test_pipeline(self):
+        """Test that the records are written after they are queued"""
+        self.assertIs(logpipeline.get_pipeline(self.logger), self.pipeline)
+        buffer = bytearray(b"ab")
+        self.logger.warning('buffer %s', memoryview(buffer))
+        self.logger.warning('hex %s', logpipeline.HexDump(buffer))
+        buffer[:] = b"xy"
+        self.pipeline.filter.limit('alive', sample=2)
+        for unused in range(4):
+            self.logger.warning('alive', extra=logpipeline.ALIVE)
+        self.pipeline.stop()
+        self.assertEqual(self.handler.messages,
+                         ["buffer b'ab'", "hex 61,62",
+                          "alive [1 suppressed]", "alive [1 suppressed]"])
+        self.assertIsNone(logpipeline.get_pipeline(self.logger))
+
+
+class TrafficLogTestCase(unittest.TestCase):
+    """Tests for the binary traffic log"""
+
+    def test_read(self):
+        """Test that the frames are read back in order"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traffic")
+            traffic_log = logpipeline.TrafficLog(path)
+            data = bytearray(b"one")
+            traffic_log.record(logpipeline.RECEIVED, 1, data)
+            data[:] = b"two"
+            traffic_log.record(logpipeline.SENT, 2, memoryview(data))
+            traffic_log.record(logpipeline.SENT, 2, b"")
+            traffic_log.close()
+            frames = [frame[1:] for frame in logpipeline.read_traffic(path)]
+            self.assertEqual(frames, [(1, logpipeline.RECEIVED, b"one"),
+                                      (2, logpipeline.SENT, b"two"),
+                                      (2, logpipeline.SENT, b"")])
+
+    def test_append(self):
+        """Test that a traffic log is continued"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traffic")
+            for data in (b"one", b"two"):
+                traffic_log = logpipeline.TrafficLog(path)
+                traffic_log.record(logpipeline.RECEIVED, 1, data)
+                traffic_log.close()
+            frames = [frame[3] for frame in logpipeline.read_traffic(path)]
+            self.assertEqual(frames, [b"one", b"two"])
+
+    def test_invalid(self):
+        """Test that another file is refused"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traffic")
+            with open(path, 'wb') as other:
+                other.write(b"something else")
+            self.assertRaises(logpipeline.LogPipelineException, list,
+                              logpipeline.read_traffic(path))
+            self.assertRaises(logpipeline.LogPipelineException,
+                              logpipeline.TrafficLog, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
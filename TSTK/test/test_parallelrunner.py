@@ -0,0 +1,88 @@
+import unittest
+import glob
+import os
+import time
+import parallelrunner
+
+
+def sleeping_scenario(test_system):
+    """Scenario that takes 0.3 seconds."""
+    executed = []
+    test_system.add_step(0.3, lambda: executed.append(time.monotonic()))
+    return test_system.port_base
+
+def simulator_scenario(test_system):
+    """Scenario that uses the simulator unittest-7 on the ports of the
+    scenario for 0.3 seconds."""
+    test_system.add_simulator_interface("unittest", 7, "default")
+    test_system.add_step(0.3, lambda: None)
+
+def failing_scenario(test_system):
+    """Scenario with a step that fails."""
+    def fail():
+        raise ValueError("step failed")
+    test_system.add_step(0.01, fail)
+
+
+class ParallelRunnerTestCase(unittest.TestCase):
+    """Tests for the parallelrunner module"""
+
+    def tearDown(self):
+        for lock in glob.glob("unittest-*.lock"):
+            os.remove(lock)
+
+    def test_run_parallel(self):
+        """Test that scenario's run in parallel, each with their own
+        port range, and that the results are collected in order.
+        """
+        scenarios = [("sleep{0}".format(i), sleeping_scenario)
+                     for i in range(4)]
+        scenarios.append(("fail", failing_scenario))
+        start = time.monotonic()
+        results = parallelrunner.run_parallel(scenarios, processes=5,
+                                              base_port=30000,
+                                              lock_namespace="unittest")
+        duration = time.monotonic() - start
+        self.assertEqual([result.name for result in results],
+                         ["sleep0", "sleep1", "sleep2", "sleep3", "fail"])
+        self.assertEqual([result.passed for result in results],
+                         [True, True, True, True, False])
+        self.assertEqual([result.value for result in results[:4]],
+                         [30000, 30010, 30020, 30030])
+        self.assertIn("step failed", results[4].error)
+        # The scenario's overlapped.
+        self.assertLess(duration, 4 * 0.3)
+
+    def test_own_simulators(self):
+        """Test that scenario's with the same interfaces on their own
+        port ranges run in parallel.
+        """
+        scenarios = [("own{0}".format(i), simulator_scenario)
+                     for i in range(2)]
+        start = time.monotonic()
+        results = parallelrunner.run_parallel(scenarios, processes=2,
+                                              base_port=30100,
+                                              lock_namespace="unittest")
+        self.assertEqual([result.passed for result in results],
+                         [True, True])
+        self.assertLess(time.monotonic() - start, 2 * 0.3)
+
+    def test_shared_simulator(self):
+        """Test that scenario's that use the same simulator at the same
+        time are refused.
+        """
+        scenarios = [("shared{0}".format(i), simulator_scenario)
+                     for i in range(2)]
+        results = parallelrunner.run_parallel(scenarios, processes=2,
+                                              base_port=30120,
+                                              ports_per_scenario=0,
+                                              lock_namespace="unittest")
+        self.assertEqual(sorted(result.passed for result in results),
+                         [False, True])
+        self.assertIn("localhost:30120 is used by another",
+                      "".join(result.error for result in results
+                              if not result.passed))
+
+
+if __name__ == '__main__':
+    unittest.main()
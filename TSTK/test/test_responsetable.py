@@ -0,0 +1,56 @@
+import unittest
+import responsetable
+
+
+class Message(object):
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class ResponseTableTestCase(unittest.TestCase):
+    """Tests for the matching of the response table"""
+
+    def setUp(self):
+        self.table = responsetable.ResponseTable()
+        for rule in (responsetable.ResponseRule(b"short", prefix=b"ab"),
+                     responsetable.ResponseRule(b"long", prefix=b"abc"),
+                     responsetable.ResponseRule(b"id", message_id=7)):
+            self.table.add(rule)
+
+    def response(self, data, message=None):
+        rule = self.table.match(memoryview(data), message)
+        return rule and rule.response
+
+    def test_match(self):
+        """Test that the message id goes first, then the longest
+        prefix
+        """
+        self.assertEqual(self.response(b"abcd", Message(7)), b"id")
+        self.assertEqual(self.response(b"abcd", Message(8)), b"long")
+        self.assertEqual(self.response(b"abd"), b"short")
+        self.assertEqual(self.response(b"a"), None)
+        self.assertEqual(self.response(b"xyz", Message(8)), None)
+
+    def test_remove(self):
+        """Test removing and replacing rules"""
+        self.assertTrue(self.table.remove(responsetable.rule_key(
+                prefix=b"abc")))
+        self.assertFalse(self.table.remove(responsetable.rule_key(
+                prefix=b"abc")))
+        self.assertEqual(self.response(b"abcd"), b"short")
+        self.table.add(responsetable.ResponseRule(b"new", prefix=b"ab"))
+        self.assertEqual(self.response(b"abcd"), b"new")
+        self.table.clear()
+        self.assertEqual(len(self.table), 0)
+        self.assertEqual(self.response(b"abcd", Message(7)), None)
+
+    def test_invalid_rule(self):
+        """Test that a rule needs one of a message id and a prefix"""
+        for kwargs in ({}, {"message_id":1, "prefix":b"a"},
+                       {"prefix":b""}):
+            self.assertRaises(responsetable.ResponseTableException,
+                              responsetable.ResponseRule, b"", **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
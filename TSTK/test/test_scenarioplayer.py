@@ -1,7 +1,15 @@
 import unittest
+import threading
+import time
+import zmq
 import testsystem
 import scenarioplayer
 
+#: attempts of a timing test.  A stall of the host delays the steps that
+#: fall in it, whatever the player does, so one stall on a busy host
+#: spoils one attempt, and the best attempt is checked.
+TIMING_ATTEMPTS = 3
+
 class Track(object):
     def __init__(self):
         self.count = [0, 1, 2, 3 , 4]
@@ -51,6 +59,8 @@ class ScenarioPlayerTestCase(unittest.TestCase):
         self.scenario_player = self.test_system.scenario_player
 
     def tearDown(self):
+        # Release the lock, otherwise the next test system kills us.
+        self.test_system.lock.close()
         self.scenario_player = None
         self.test_system = None
 
@@ -69,7 +79,227 @@ class ScenarioPlayerTestCase(unittest.TestCase):
         s.add_step(0.4, track.four)
         s.play()
         self.assertTrue(track.check())
-    
+
+    def test_schedulers(self):
+        """Test that the steps are played in order with each of the
+        scheduler backends.
+        """
+        for name in ("heap", "queue", "wheel"):
+            self.test_system.add_scenario_player(name)
+            s = self.test_system
+            track = Track()
+            s.add_step(0.04, track.four)
+            s.add_step(0.01, track.one)
+            s.add_step(0.0, track.zero)
+            s.add_step(0.03, track.three)
+            s.add_step(0.02, track.two)
+            s.play()
+            self.assertTrue(track.check())
+
+    def play_under_traffic(self):
+        """Play 40 steps 25 ms apart on a new scenario player while 10k
+        messages per second arrive.
+
+        :returns: the lateness of each step, in seconds.
+        """
+        self.test_system.add_scenario_player()
+        player = self.test_system.scenario_player
+        receiver = player.context.socket(zmq.PULL)
+        receiver.bind("inproc://drift")
+        sender = player.context.socket(zmq.PUSH)
+        sender.connect("inproc://drift")
+        received = []
+        player.add_socket(receiver,
+                          lambda a_socket, unused: received.append(
+                              a_socket.recv()))
+
+        running = threading.Event()
+        running.set()
+        def send_traffic():
+            # Bursts of 10 messages every millisecond.
+            next_burst = time.monotonic()
+            while running.is_set():
+                for unused in range(10):
+                    try:
+                        sender.send(b"x", zmq.NOBLOCK)
+                    except zmq.Again:
+                        pass
+                next_burst += 0.001
+                time.sleep(max(0, next_burst - time.monotonic()))
+        traffic = threading.Thread(target=send_traffic)
+
+        interval = 0.025
+        executed = []
+        for i in range(40):
+            self.test_system.add_step(
+                i * interval, lambda: executed.append(
+                    (time.monotonic_ns() - player._start_time) / 1e9))
+        traffic.start()
+        try:
+            self.test_system.play()
+        finally:
+            running.clear()
+            traffic.join()
+            player.remove_socket(receiver)
+            sender.close(linger=0)
+            receiver.close(linger=0)
+
+        self.assertEqual(len(executed), 40)
+        self.assertGreater(len(received), 1000)
+        return [executed[i] - i * interval for i in range(len(executed))]
+
+    def test_drift_under_traffic(self):
+        """Test that the timing error of the steps stays bounded when
+        10k messages per second arrive between the steps.
+        """
+        for attempt in range(TIMING_ATTEMPTS):
+            lateness = self.play_under_traffic()
+            if max(lateness) < 0.020:
+                break
+        # Steps never fire early and the error does not build up.
+        self.assertGreaterEqual(min(lateness), 0)
+        self.assertLess(max(lateness), 0.020)
+
+    def test_call_back_changes(self):
+        """Test that a call back can remove and add sockets while the
+        ready sockets are handled.
+        """
+        player = self.scenario_player
+        pairs = []
+        for i in range(2):
+            receiver = player.context.socket(zmq.PAIR)
+            receiver.bind("inproc://change{0}".format(i))
+            sender = player.context.socket(zmq.PAIR)
+            sender.connect("inproc://change{0}".format(i))
+            pairs.append((sender, receiver))
+        called = []
+        def first(a_socket, unused):
+            called.append("first")
+            a_socket.recv()
+            # Remove the other one and register it with a new call
+            # back, that should wait for the next poll.
+            player.remove_socket(pairs[1][1])
+            player.add_socket(pairs[1][1], second)
+        def second(a_socket, unused):
+            called.append("second")
+            a_socket.recv()
+        def unexpected(a_socket, unused):
+            called.append("unexpected")
+            a_socket.recv()
+        # The poller reports the sockets in the order of registration.
+        player.add_socket(pairs[0][1], first)
+        player.add_socket(pairs[1][1], unexpected)
+        for sender, receiver in pairs:
+            sender.send(b"x")
+        time.sleep(0.01)
+        try:
+            player.poll_sockets(0)
+            self.assertEqual(called, ["first"])
+            player.poll_sockets(0)
+            self.assertEqual(called, ["first", "second"])
+        finally:
+            for sender, receiver in pairs:
+                sender.close(linger=0)
+                receiver.close(linger=0)
+
+    def test_lateness(self):
+        """Test that the lateness of the steps is recorded and stays
+        small for steps that are close together.
+        """
+        s = self.test_system
+        for attempt in range(TIMING_ATTEMPTS):
+            s.add_scenario_player()
+            s.add_periodic_step(0.0005, lambda: None, count=200)
+            s.play()
+            lateness = s.scenario_player.lateness
+            if lateness.percentile(90) < 1000000:
+                break
+        self.assertEqual(lateness.count, 200)
+        self.assertEqual(sum(count for bound, count in lateness.buckets()),
+                         200)
+        self.assertLessEqual(lateness.percentile(50), lateness.maximum)
+        # Spinning keeps most of the steps well within a millisecond.
+        self.assertLess(lateness.percentile(90), 1000000)
+
+    def test_lateness_histogram(self):
+        """Test the buckets of the lateness histogram"""
+        histogram = scenarioplayer.LatenessHistogram()
+        for lateness in (0, 500, 1500, 3000, 3000, 1000000):
+            histogram.record(lateness)
+        self.assertEqual(histogram.count, 6)
+        self.assertEqual(histogram.maximum, 1000000)
+        self.assertEqual(histogram.buckets()[:3],
+                         [(1000, 2), (2000, 1), (4000, 2)])
+        self.assertEqual(histogram.percentile(50), 2000)
+        self.assertEqual(histogram.percentile(100), 1000000)
+        histogram.reset()
+        self.assertEqual(histogram.count, 0)
+        self.assertEqual(histogram.mean(), 0)
+
+    def test_periodic_step(self):
+        """Test that a periodic step runs the requested number of times
+        and keeps a single entry in the scheduler.
+        """
+        s = self.test_system
+        executed = []
+        sizes = []
+        def tick():
+            executed.append(time.monotonic())
+            sizes.append(len(self.scenario_player.scheduler))
+        s.add_periodic_step(0.01, tick, count=5)
+        s.add_periodic_step("00:00.01", lambda: executed.append(None),
+                            start=0.005, end=0.03)
+        s.play()
+        self.assertEqual(len([x for x in executed if x is not None]), 5)
+        self.assertEqual(len([x for x in executed if x is None]), 3)
+        self.assertLessEqual(max(sizes), 2)
+
+    def test_add_steps(self):
+        """Test that a series of steps is played in order and is taken
+        from the iterable lazily.
+        """
+        s = self.test_system
+        track = Track()
+        taken = []
+        def steps():
+            for i, step in enumerate([track.zero, track.one, track.two,
+                                      track.three, track.four]):
+                taken.append(i)
+                yield (i * 0.01, step)
+        s.add_steps(steps())
+        self.assertEqual(taken, [0])
+        self.assertEqual(len(self.scenario_player.scheduler), 1)
+        s.play()
+        self.assertTrue(track.check())
+        self.assertEqual(taken, [0, 1, 2, 3, 4])
+
+    def test_step_arguments(self):
+        """Test that steps get the test system only when they take a
+        parameter, and that the signatures are cached weakly.
+        """
+        player = self.scenario_player
+        track = Track()
+        def with_parameter(test_system):
+            pass
+        def without_parameter():
+            pass
+        self.assertEqual(player.step_arguments(with_parameter),
+                         (self.test_system,))
+        self.assertEqual(player.step_arguments(without_parameter), ())
+        self.assertEqual(player.step_arguments(track.zero),
+                         (self.test_system,))
+        self.assertEqual(player.step_arguments(track.check), ())
+        self.assertEqual(player.step_arguments(lambda: None), ())
+        self.assertEqual(player.step_arguments(len),
+                         (self.test_system,))
+
+        self.assertIn(with_parameter, scenarioplayer._positional_counts)
+        self.assertIn(Track.zero, scenarioplayer._positional_counts)
+        count = len(scenarioplayer._positional_counts)
+        del with_parameter
+        self.assertEqual(len(scenarioplayer._positional_counts),
+                         count - 1)
+
 
 if __name__ == '__main__':
     unittest.main()
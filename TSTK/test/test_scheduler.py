@@ -0,0 +1,79 @@
+import unittest
+import random
+import scheduler
+
+
+class SchedulerTestCase(unittest.TestCase):
+    """Tests for the scheduler backends in the scheduler module"""
+
+    def check_order(self, a_scheduler):
+        """Push entries in random order and check they come out sorted,
+        also when entries are popped in between.
+        """
+        rand = random.Random(42)
+        expected = []
+        result = []
+        for i in range(2000):
+            if rand.random() < 0.7 or not expected:
+                when = rand.choice([rand.randint(0, 100),
+                                    rand.random() * 1000,
+                                    rand.random() * 100000])
+                priority = rand.randint(0, 2)
+                a_scheduler.push(when, priority, i)
+                expected.append((when, priority, i))
+            else:
+                expected.sort()
+                self.assertEqual(a_scheduler.peek(), expected[0])
+                self.assertEqual(a_scheduler.pop(), expected.pop(0))
+        while not a_scheduler.empty():
+            result.append(a_scheduler.pop())
+        self.assertEqual(result, sorted(expected))
+        self.assertEqual(len(a_scheduler), 0)
+        self.assertIsNone(a_scheduler.peek())
+        self.assertRaises(scheduler.SchedulerException, a_scheduler.pop)
+
+    def test_heap(self):
+        """Test the order of the heap scheduler"""
+        self.check_order(scheduler.HeapScheduler())
+
+    def test_queue(self):
+        """Test the order of the priority queue scheduler"""
+        self.check_order(scheduler.PriorityQueueScheduler())
+
+    def test_wheel(self):
+        """Test the order of the timer wheel scheduler, also with a
+        small wheel so items overflow.
+        """
+        self.check_order(scheduler.TimerWheelScheduler())
+        self.check_order(scheduler.TimerWheelScheduler(resolution=0.5,
+                                                       slots=4,
+                                                       levels=2))
+
+    def test_same_deadline(self):
+        """Entries with the same deadline and priority keep their
+        order.
+        """
+        for name in ("heap", "queue", "wheel"):
+            a_scheduler = scheduler.get_scheduler(name)
+            for i in range(10):
+                a_scheduler.push(1.0, 1, i)
+            self.assertEqual([a_scheduler.pop()[2] for i in range(10)],
+                             list(range(10)))
+
+    def test_get_scheduler(self):
+        """Test the retrieval of a scheduler through the get_scheduler
+        function
+        """
+        self.assertIsInstance(scheduler.get_scheduler("heap"),
+                              scheduler.HeapScheduler)
+        self.assertIsInstance(scheduler.get_scheduler("queue"),
+                              scheduler.PriorityQueueScheduler)
+        wheel = scheduler.get_scheduler("wheel", resolution=0.01)
+        self.assertIsInstance(wheel, scheduler.TimerWheelScheduler)
+        self.assertEqual(wheel.resolution, 0.01)
+        self.assertRaises(scheduler.SchedulerException,
+                          scheduler.get_scheduler, "foo")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import zmq
+import serializer
+
+
+@serializer.register_message_class
+class Payload(object):
+    """Message class for the round trip tests."""
+    def __init__(self, message_id, data):
+        self.message_id = message_id
+        self.data = data
+
+
+class SerializerTestCase(unittest.TestCase):
+    """Tests for the serializers in the serializer module"""
+
+    def setUp(self):
+        self.context = zmq.Context()
+        self.receiver = self.context.socket(zmq.PULL)
+        self.receiver.bind("inproc://serializer")
+        self.sender = self.context.socket(zmq.PUSH)
+        self.sender.connect("inproc://serializer")
+
+    def tearDown(self):
+        self.sender.close(linger=0)
+        self.receiver.close(linger=0)
+        self.context.term()
+
+    def round_trip(self, a_serializer, obj):
+        """Send an object over the sockets and return what arrives."""
+        a_serializer.send(self.sender, obj)
+        return a_serializer.recv(self.receiver)
+
+    def test_pickle(self):
+        """Test a round trip of an object with pickle"""
+        received = self.round_trip(serializer.get_serializer("pickle"),
+                                   Payload(3, (1, b"abc")))
+        self.assertIsInstance(received, Payload)
+        self.assertEqual(received.message_id, 3)
+        self.assertEqual(received.data, (1, b"abc"))
+
+    def test_msgpack(self):
+        """Test a round trip of plain data and objects with msgpack"""
+        a_serializer = serializer.get_serializer("msgpack")
+        data = {"none":None, "bools":[True, False],
+                "ints":[0, 1, 127, 128, 255, 256, 65536, 2 ** 32, 2 ** 63,
+                        -1, -32, -33, -128, -129, -32768, -32769,
+                        -2 ** 31 - 1, -2 ** 63],
+                "float":1.5, "short":"abc", "long":"x" * 300,
+                "bytes":b"\x00\xff" * 200, "list":list(range(20)),
+                7:{"nested":[[], {}]}}
+        self.assertEqual(self.round_trip(a_serializer, data), data)
+        received = self.round_trip(a_serializer,
+                                   Payload(5, Payload(6, "inner")))
+        self.assertIsInstance(received, Payload)
+        self.assertEqual(received.message_id, 5)
+        self.assertIsInstance(received.data, Payload)
+        self.assertEqual(received.data.data, "inner")
+        # Tuples arrive as lists.
+        self.assertEqual(self.round_trip(a_serializer, (1, 2)), [1, 2])
+
+    def test_msgpack_classes(self):
+        """Test that only registered classes are sent and created"""
+        class Other(object):
+            pass
+        a_serializer = serializer.get_serializer("msgpack")
+        self.assertRaises(serializer.SerializerException,
+                          a_serializer.dumps, Other())
+        serializer.register_message_class(Other)
+        data = bytes(a_serializer.dumps(Other()))
+        del serializer._message_classes[serializer._class_path(Other)]
+        self.assertRaises(serializer.SerializerException,
+                          a_serializer.loads, data)
+
+    def test_msgpack_format(self):
+        """Test that the encoding is MessagePack"""
+        a_serializer = serializer.get_serializer("msgpack")
+        self.assertEqual(bytes(a_serializer.dumps([1, "a", None])),
+                         b"\x93\x01\xa1a\xc0")
+        self.assertEqual(bytes(a_serializer.dumps({b"k":-1.0})),
+                         b"\x81\xc4\x01k\xcb\xbf\xf0\x00\x00\x00\x00\x00\x00")
+
+    def test_raw(self):
+        """Test that the raw serializer only passes bytes"""
+        a_serializer = serializer.get_serializer("raw")
+        received = self.round_trip(a_serializer, b"\x01\x02\x03")
+        self.assertEqual(bytes(received), b"\x01\x02\x03")
+        self.assertRaises(serializer.SerializerException,
+                          a_serializer.send, self.sender, "text")
+
+    def test_mismatch(self):
+        """Test that a message of another serializer is refused"""
+        serializer.get_serializer("pickle").send(self.sender, b"data")
+        self.assertRaises(serializer.SerializerException,
+                          serializer.get_serializer("msgpack").recv,
+                          self.receiver)
+
+    def test_unknown(self):
+        """Test that an unknown serializer type is refused"""
+        self.assertRaises(serializer.SerializerException,
+                          serializer.get_serializer, "xml")
+
+
+if __name__ == '__main__':
+    unittest.main()
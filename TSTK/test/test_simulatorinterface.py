@@ -1,5 +1,19 @@
 import unittest
+import pickle
+import threading
+import time
+import zmq
 import connectionfactory
+import dispatcher
+import serializer
+import simulatorinterface
+
+
+class Message(object):
+    """Message from a simulator."""
+    def __init__(self, message_id, value=None):
+        self.message_id = message_id
+        self.value = value
 
 
 class TestSystemTestCase(unittest.TestCase):
@@ -8,7 +22,219 @@ class TestSystemTestCase(unittest.TestCase):
     def tearDown(self):
         pass
 
-        
+
+class CallbackTestCase(unittest.TestCase):
+    """Tests for the callbacks of the simulator interface"""
+
+    def setUp(self):
+        self.context = zmq.Context()
+        self.interface = simulatorinterface.SimulatorInterface(
+                "unittest", 0, self.context)
+        self.called = []
+
+    def tearDown(self):
+        self.interface.message_link.close(linger=0)
+        self.interface.command_link.close(linger=0)
+        self.context.term()
+
+    def record(self, name):
+        """Return a callback that records its name and message."""
+        return lambda message: self.called.append((name, message.value))
+
+    def test_message_id(self):
+        """Test that only the callbacks for the message id are called,
+        in order.
+        """
+        interface = self.interface
+        interface.set_callback(1, self.record("a"))
+        interface.set_callback(1, self.record("b"))
+        interface.set_callback(2, self.record("c"))
+        interface.do_callbacks(Message(1, 10))
+        self.assertEqual(self.called, [("a", 10), ("b", 10)])
+
+    def test_once(self):
+        """Test that a one-shot callback is called once"""
+        interface = self.interface
+        interface.set_callback(1, self.record("once"), once=True)
+        interface.do_callbacks(Message(1, 1))
+        interface.do_callbacks(Message(1, 2))
+        self.assertEqual(self.called, [("once", 1)])
+        self.assertNotIn(1, interface.callbacks)
+
+    def test_wildcard_and_predicate(self):
+        """Test callbacks for all messages and predicate callbacks"""
+        interface = self.interface
+        interface.set_callback(simulatorinterface.ANY, self.record("any"))
+        interface.set_predicate_callback(lambda message: message.value > 5,
+                                         self.record("big"))
+        interface.set_callback(3, self.record("three"))
+        interface.do_callbacks(Message(3, 1))
+        interface.do_callbacks(Message(4, 9))
+        self.assertEqual(self.called, [("three", 1), ("any", 1),
+                                       ("any", 9), ("big", 9)])
+
+    def test_change_during_dispatch(self):
+        """Test removing and adding callbacks from a callback"""
+        interface = self.interface
+        subscriptions = []
+        def first(message):
+            self.called.append(("first", message.value))
+            interface.remove_callback(subscriptions[1])
+            interface.remove_callback(subscriptions[0])
+            interface.set_callback(1, self.record("new"))
+        subscriptions.append(interface.set_callback(1, first))
+        subscriptions.append(interface.set_callback(1, self.record("second")))
+        interface.do_callbacks(Message(1, 1))
+        interface.do_callbacks(Message(1, 2))
+        self.assertEqual(self.called, [("first", 1), ("new", 2)])
+        # Removing twice is harmless.
+        interface.remove_callback(subscriptions[0])
+
+
+class InvalidMessageTestCase(unittest.TestCase):
+    """Tests for messages the interface can not read"""
+
+    def setUp(self):
+        self.context = zmq.Context()
+        self.interface = simulatorinterface.SimulatorInterface(
+                "unittest", 0, self.context)
+        self.receiver = self.context.socket(zmq.PULL)
+        self.receiver.bind("inproc://invalid")
+        self.sender = self.context.socket(zmq.PUSH)
+        self.sender.connect("inproc://invalid")
+
+    def tearDown(self):
+        self.sender.close(linger=0)
+        self.receiver.close(linger=0)
+        self.interface.message_link.close(linger=0)
+        self.interface.command_link.close(linger=0)
+        self.context.term()
+
+    def test_invalid(self):
+        """Test that invalid messages are logged and dropped, and the
+        valid messages of a batch still arrive
+        """
+        received = []
+        self.interface.set_callback(simulatorinterface.ANY, received.append)
+        connection_id = serializer.pack_connection_id(1)
+        self.sender.send_multipart([b"", connection_id])
+        self.sender.send_multipart(
+                [b"", connection_id, b"P", b"not a pickle",
+                 connection_id, b"P", pickle.dumps("valid")])
+        with self.assertLogs(self.interface.logger, 'WARNING') as logs:
+            self.interface.on_message(self.receiver, None)
+            self.interface.on_message(self.receiver, None)
+        self.assertEqual(received, ["valid"])
+        self.assertIn("Message with 2 frames dropped", logs.output[0])
+        self.assertIn("Invalid PickleSerializer message", logs.output[1])
+
+
+class TopicTestCase(unittest.TestCase):
+    """Tests for the subscriptions of an interface with a topic"""
+
+    def setUp(self):
+        self.context = zmq.Context()
+        self.dispatcher = dispatcher.Dispatcher("tcp", 0)
+        self.dispatcher.repeater_socket = self.context.socket(zmq.PUB)
+        self.dispatcher.repeater_socket.bind("tcp://127.0.0.1:29121")
+        self.interface = simulatorinterface.SimulatorInterface(
+                "tcp", 0, self.context, 29120, 29121, topic="tcp-0")
+        self.received = []
+
+    def tearDown(self):
+        self.interface.message_link.close(linger=0)
+        self.interface.command_link.close(linger=0)
+        self.dispatcher.repeater_socket.close(linger=0)
+        self.context.term()
+        self.dispatcher.context.term()
+
+    def publish(self):
+        """Publish messages with ids 1 and 2 and raw data, and receive
+        what the subscriptions let through.
+        """
+        # Subscriptions take a moment to reach the publisher.
+        time.sleep(0.2)
+        self.received = []
+        self.dispatcher.forward_batch([(1, Message(1, "a")),
+                                       (2, Message(1, "b")),
+                                       (1, Message(2, "c")),
+                                       (2, b"raw")])
+        link = self.interface.message_link
+        while link.poll(200):
+            frames = link.recv_multipart()
+            self.received.append((frames[0], (len(frames) - 1) // 3))
+
+    def test_message_ids(self):
+        """Test that only the messages with a callback arrive"""
+        subscription = self.interface.set_callback(1, lambda message: None)
+        self.publish()
+        self.assertEqual(self.received, [(b"tcp-0/1/", 2)])
+        self.interface.remove_callback(subscription)
+        self.assertEqual(self.interface.callbacks, {})
+        self.publish()
+        self.assertEqual(self.received, [])
+
+    def test_any(self):
+        """Test that a callback for all messages gets everything,
+        batched per topic
+        """
+        self.interface.set_callback(simulatorinterface.ANY,
+                                    lambda message: None)
+        self.publish()
+        self.assertEqual(self.received, [(b"tcp-0/1/", 2), (b"tcp-0/2/", 1),
+                                         (b"tcp-0/", 1)])
+
+
+class ReadyTestCase(unittest.TestCase):
+    """Tests for waiting until the links with a simulator connect"""
+
+    def setUp(self):
+        self.dispatcher = dispatcher.TCPDispatcher("tcp", 0)
+        self.dispatcher.accept_address = "127.0.0.1"
+        self.dispatcher.listen_port = 0
+        self.dispatcher.backlog = 16
+        self.dispatcher.command_listen_port = 29160
+        self.dispatcher.message_forward_port = 29161
+        self.dispatcher.create_sockets()
+        self.context = zmq.Context()
+        self.interface = simulatorinterface.SimulatorInterface(
+                "tcp", 0, self.context, 29160, 29161, topic="tcp-0")
+        self.stop = threading.Event()
+        self.thread = None
+
+    def tearDown(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.interface.message_link.close(linger=0)
+        self.interface.command_link.close(linger=0)
+        self.context.term()
+        self.dispatcher.accept_socket.close()
+        self.dispatcher.context.destroy(linger=0)
+
+    def run_dispatcher(self):
+        """Poll the dispatcher until a response rule arrives."""
+        while not self.stop.is_set() and not len(self.dispatcher.responses):
+            self.dispatcher.poll_sockets(10)
+
+    def test_ready(self):
+        """Test that no command is lost after the simulator answered"""
+        self.thread = threading.Thread(target=self.run_dispatcher)
+        self.thread.start()
+        start = time.monotonic()
+        self.interface.wait_ready(5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.interface.set_response(b"pong", prefix=b"ping")
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertEqual(len(self.dispatcher.responses), 1)
+
+    def test_not_ready(self):
+        """Test that a simulator that does not answer is noticed"""
+        start = time.monotonic()
+        self.assertRaises(simulatorinterface.SimulatorInterfaceException,
+                          self.interface.wait_ready, 0.2)
+        self.assertLess(time.monotonic() - start, 0.5)
 
 
 if __name__ == '__main__':
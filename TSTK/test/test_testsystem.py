@@ -1,4 +1,7 @@
 import unittest
+import glob
+import os
+import tempfile
 import testsystem
 import scenarioplayer
 import driver
@@ -27,6 +30,27 @@ class TestSystemTestCase(unittest.TestCase):
         self.test_system.add_simulator_interface("unittest", 0, "default")
         self.assertIn("unittest", self.test_system.simulator_interfaces)
 
+    def test_claims(self):
+        """ Test that test systems in one process share the claims on
+        their simulators, and that the last one removes the lock file
+        """
+        pattern = os.path.join(tempfile.gettempdir(),
+                               "tstk-*29170*.simulator.lock")
+        test_systems = []
+        for number in range(2):
+            test_system = testsystem.TestSystem("claimtest", port_base=29170)
+            test_system.add_scenario_player()
+            test_system.add_simulator_interface("unittest", 0, "default")
+            test_system.lock.close()
+            test_systems.append(test_system)
+        self.assertEqual(len(glob.glob(pattern)), 1)
+        test_systems[0].release_simulators()
+        self.assertEqual(len(glob.glob(pattern)), 1)
+        test_systems[1].release_simulators()
+        self.assertEqual(glob.glob(pattern), [])
+        for test_system in test_systems:
+            test_system.scenario_player.context.destroy(linger=0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,13 +1,78 @@
+import atexit
 import logging
 
 from scenarioplayer import ScenarioPlayer
+from asyncscenarioplayer import AsyncScenarioPlayer
 import simulatorinterface
+from endpoints import EndpointRegistry
+from endpoints import connect_address
+from daemonbase import wait_for_exit
+import fcntl
 import os
+import re
+import signal
 import subprocess
+import tempfile
 import driver
 
 import zmq
 
+
+class TestSystemException(Exception):
+    """Base class for test system exceptions"""
+    pass
+
+
+# The claims of the simulators in this process: the locked file and the
+# number of test systems that hold it, by path.
+_claims = {}
+
+
+def _claim_path(command_endpoint, topic):
+    """The lock file of the claim on a simulator."""
+    name = re.sub(r'[^\w.-]+', '_', '{0}-{1}'.format(
+            connect_address(command_endpoint), topic or ''))
+    return os.path.join(tempfile.gettempdir(),
+                        'tstk-{0}.simulator.lock'.format(name))
+
+
+def _lock_claim(path):
+    """Lock the claim file, None if another process has it."""
+    while True:
+        claim = open(path, 'a')
+        try:
+            fcntl.flock(claim, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            claim.close()
+            return None
+        # The last holder removes the file after the lock, the lock
+        # only counts if the file is still there.
+        try:
+            if os.stat(path).st_ino == os.fstat(claim.fileno()).st_ino:
+                return claim
+        except FileNotFoundError:
+            pass
+        claim.close()
+
+
+def _forget_claims():
+    """A forked child does not hold the claims of its parent."""
+    for claim, unused in _claims.values():
+        claim.close()
+    _claims.clear()
+
+
+def _release_claims():
+    """Remove the lock files of the claims that are left at exit."""
+    for path, (claim, unused) in list(_claims.items()):
+        os.remove(path)
+        claim.close()
+    _claims.clear()
+
+os.register_at_fork(after_in_child=_forget_claims)
+atexit.register(_release_claims)
+
+
 class TestSystem(object):
     """ Starting point when creating a test system for a specific
     system. 
@@ -19,19 +84,35 @@ class TestSystem(object):
     #: The scenario player which will play the steps.
     scenario_player = None
 
-    #: The simulator_interfaces used by this test system.
-    simulator_interfaces = {}
-
-    #: The drivers used by the testsystem.
-    drivers = {}
-
     #: The logger.
     logger = None
 
-    def __init__(self, test_system_name):
+    def __init__(self, test_system_name, lock_namespace=None,
+                 port_base=None):
         """
+        :param test_system_name: The name of the test system.
+        :type test_system_name: string
+        :param lock_namespace: Prefix for the lock file.  Only a running
+                               script with the same name and namespace
+                               is killed, so test systems in different
+                               namespaces can run side by side.
+        :type lock_namespace: string
+        :param port_base: The command port of the simulators, the
+                          message port is the next one.  The default
+                          is 9000.  Only the simulator interfaces use
+                          it, the simulators read their ports from
+                          simulator.conf, see :meth:`claim_simulator`.
+        :type port_base: int
         """
-        self.kill_previous_script(test_system_name)
+        #: The simulator_interfaces used by this test system.
+        self.simulator_interfaces = {}
+        #: The drivers used by the testsystem.
+        self.drivers = {}
+        #: First port of the port range of this test system.
+        self.port_base = port_base
+        # the paths of the claims on the simulators in use
+        self._claims = set()
+        self.kill_previous_script(test_system_name, lock_namespace)
         #Setup logging.
         logger = logging.getLogger('Testsystem')
         logger.setLevel(logging.DEBUG)
@@ -45,12 +126,14 @@ class TestSystem(object):
         self.logger = logger
         
         
-    def kill_previous_script( self, test_system_name ):
+    def kill_previous_script( self, test_system_name, lock_namespace=None ):
         """Kill an already running test script. Can't have two 
         scripts running at the same time.
         """
 
         lock_name = '{0}.lock'.format(test_system_name)
+        if lock_namespace is not None:
+            lock_name = '{0}.{1}'.format(lock_namespace, lock_name)
         if os.path.exists( lock_name ):
             # Find the process that has lock_name open.
             subp = subprocess.Popen(['lsof', '-t', lock_name],
@@ -63,28 +146,57 @@ class TestSystem(object):
                 # It's not a list, it is really a string
                 # pylint: disable=E1103
                 for pid in pids.split():
+                    if int(pid) == os.getpid():
+                        # Lock left open by an earlier test system in
+                        # this process.
+                        continue
                     # And kill it.
-                    subp = subprocess.Popen(['kill', '-9', pid.rstrip()])
-                    subp.communicate()
-                    if subp.returncode != 0 :
+                    try:
+                        os.kill(int(pid), signal.SIGKILL)
+                    except ProcessLookupError:
+                        continue
+                    except OSError:
                         print("Can't kill previous test script")
                         exit(1)
-                # Give it some time
-                time.sleep(1)
+                    # Until it is gone it keeps the lock open.
+                    wait_for_exit(int(pid), 5.0)
         # Now open a file and keep it open, so the next
         # script can kill us.
         self.lock = open(lock_name, 'w')
 
-    def add_scenario_player(self):
+    def add_scenario_player(self, scheduler="heap", engine="poller"):
         """ Set the scenario player for the testsystem
+
+        :param scheduler: The scheduler for the scenario player, see
+                          :class:`ScenarioPlayer`.
+        :type scheduler: string or scheduler object
+        :param engine: The engine that plays the scenario, "poller" for
+                       :class:`ScenarioPlayer` or "asyncio" for
+                       :class:`AsyncScenarioPlayer`.
+        :type engine: string
         """
-        self.scenario_player = ScenarioPlayer(self)
+        scenario_players = {"poller":ScenarioPlayer,
+                            "asyncio":AsyncScenarioPlayer}
+        self.scenario_player = scenario_players[engine](self, scheduler)
     
     def add_step(self, when, step, priority = 1,):
         """ See :func:`ScenarioPlayer.add_step` """
         self.scenario_player.add_step(when, priority, step)
 
-    def add_simulator_interface(self, name, sim_id, sim_interface):
+    def add_periodic_step(self, interval, step, priority=1, start=0,
+                          end=None, count=None):
+        """ See :func:`ScenarioPlayer.add_periodic_step` """
+        self.scenario_player.add_periodic_step(interval, priority, step,
+                                               start, end, count)
+
+    def add_steps(self, steps, priority=1):
+        """ See :func:`ScenarioPlayer.add_steps` """
+        self.scenario_player.add_steps(steps, priority)
+
+    def add_simulator_interface(self, name, sim_id, sim_interface,
+                                serializer="pickle", topic=None,
+                                simulator=None, timeout=10,
+                                ready_timeout=None):
         """Add a new simulator interface to the list of 
         simulator_interfaces and also add a socket to the scenario
         player.
@@ -95,15 +207,106 @@ class TestSystem(object):
         :type sim_id: int
         :param sim_interface: The kind of simulator interface.
         :type sim_interface: string
+        :param serializer: The serializer for the links to the
+                           simulator, see :func:`serializer.get_serializer`.
+                           Must match the ``Serializer`` setting of the
+                           dispatcher.
+        :type serializer: string
+        :param topic: The name of the simulator in a hub, for instance
+                      "tcp-0", see :mod:`hub`.
+        :type topic: string
+        :param simulator: The name of a simulator that announces its
+                          endpoints in the registry, for instance "tcp-0",
+                          see :mod:`endpoints`.  It is also the topic.
+        :type simulator: string
+        :param timeout: How long to wait for the simulator to announce
+                        itself, in seconds.
+        :param ready_timeout: How long to wait for the links with the
+                              simulator to connect, in seconds, see
+                              :meth:`simulatorinterface.SimulatorInterface.wait_ready`.
+                              None does not wait.
         """
         a_sim_interface = simulatorinterface.get_simulator_interface(
                                                 sim_interface)
-        simulator_interface = a_sim_interface(name, sim_id, 
-                                self.scenario_player.context)
+        if simulator is not None:
+            command_endpoint, message_endpoint = EndpointRegistry().resolve(
+                                                        simulator, timeout)
+            self.claim_simulator(command_endpoint, simulator)
+            simulator_interface = a_sim_interface(name, sim_id,
+                                    self.scenario_player.context,
+                                    command_endpoint, message_endpoint,
+                                    serializer, simulator)
+        elif self.port_base is None:
+            self.claim_simulator(9000, topic)
+            simulator_interface = a_sim_interface(name, sim_id, 
+                                    self.scenario_player.context,
+                                    serializer=serializer, topic=topic)
+        else:
+            self.claim_simulator(self.port_base, topic)
+            simulator_interface = a_sim_interface(name, sim_id, 
+                                    self.scenario_player.context,
+                                    self.port_base, self.port_base + 1,
+                                    serializer, topic)
+        if ready_timeout is not None:
+            simulator_interface.wait_ready(ready_timeout)
         self.simulator_interfaces.update({name:simulator_interface})
         self.scenario_player.add_socket(simulator_interface.message_link, 
                                         simulator_interface.on_message)
 
+    def claim_simulator(self, command_endpoint, topic=None):
+        """ Make sure that no test system in another process uses a
+        simulator at the same time, for instance a scenario that runs
+        in parallel, see :mod:`parallelrunner`.  Its commands and
+        restarts would mix with ours.
+
+        A simulator is known by the endpoint of its command link and
+        its topic in a hub, so scenario's with their own port ranges
+        do not share simulators.  The claim is a lock on a file in the
+        temporary directory, which lasts until the last test system of
+        the process that claimed it calls :meth:`release_simulators`,
+        or the end of the process.  Test systems in the same process
+        share their claims.
+
+        :param command_endpoint: The command port or endpoint of the
+                                 simulator.
+        :param topic: The topic of the simulator in a hub.
+        :type topic: string
+        :raises: TestSystemException if another process uses it.
+        """
+        path = _claim_path(command_endpoint, topic)
+        if path in self._claims:
+            return
+        claim = _claims.get(path)
+        if claim is None:
+            lock = _lock_claim(path)
+            if lock is None:
+                name = connect_address(command_endpoint)
+                if topic:
+                    name = '{0} {1}'.format(name, topic)
+                raise TestSystemException(
+                        "Simulator {0} is used by another test system"
+                        .format(name))
+            claim = _claims[path] = [lock, 0]
+        claim[1] += 1
+        self._claims.add(path)
+
+    def release_simulators(self):
+        """ Let other test systems use the simulators of this one, see
+        :meth:`claim_simulator`.
+        """
+        for path in self._claims:
+            claim = _claims.get(path)
+            if claim is None:
+                # Claimed by the parent of a forked process.
+                continue
+            claim[1] -= 1
+            if not claim[1]:
+                del _claims[path]
+                # Still locked, so nobody else has it yet.
+                os.remove(path)
+                claim[0].close()
+        self._claims = set()
+
     def add_driver(self, name, driver_type, driver_id):
         """ Add a driver to the test system. The configuration of the
         driver is done with a configuration file. It wil add a driver 